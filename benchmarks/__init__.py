@@ -0,0 +1,5 @@
+"""
+Benchmarks for the storefront. Each module is a script run from the
+repository root, e.g. ``python -m benchmarks.cart_storage``; they build a
+throwaway database and never touch db.sqlite3.
+"""
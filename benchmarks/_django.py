@@ -0,0 +1,65 @@
+import os
+import tempfile
+from pathlib import Path
+
+# Seeded catalogs are kept here between runs (see setup_seeded).
+SEED_CACHE_DIR = Path(__file__).resolve().parent.parent / '.cache' / 'benchmarks'
+
+
+def setup(db_path=None):
+    """
+    Configures Django for a benchmark run against a fresh SQLite database and
+    returns its path.
+    """
+    if db_path is None:
+        db_path = Path(tempfile.mkdtemp(prefix='ecom-bench-')) / 'db.sqlite3'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecom_demo.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark-only-not-secret')
+    os.environ.setdefault('ALLOWED_HOSTS', 'testserver,localhost,127.0.0.1')
+    os.environ['DATABASE_PATH'] = str(db_path)
+
+    import django
+    from django.core.management import call_command
+    django.setup()
+    call_command('migrate', verbosity=0)
+    return db_path
+
+
+def seed_products(count, batch_size=5000):
+    """
+    Inserts count products with deterministic names and prices.
+    """
+    from products.models import Product
+    for start in range(0, count, batch_size):
+        Product.objects.bulk_create(
+            Product(
+                name=f'Product {i:07d}',
+                description=f'Description of product {i}. ' * 8,
+                price=f'{(i * 37) % 100000 / 100 + 1:.2f}',
+                image_url=f'https://example.com/images/{i}.jpg',
+            )
+            for i in range(start, min(start + batch_size, count))
+        )
+    return list(Product.objects.order_by('pk').values_list('pk', flat=True)[:count])
+
+
+def setup_seeded(count):
+    """
+    Configures Django against a fresh copy of a database seeded with count
+    products and returns its path.
+
+    Seeding a million products takes minutes, so each seeded catalog is
+    built once and kept in .cache/benchmarks; later runs copy it. Migrations
+    added since are applied to the copy.
+    """
+    from products.replication import copy_database
+    template = SEED_CACHE_DIR / f'products-{count}.sqlite3'
+    db_path = Path(tempfile.mkdtemp(prefix='ecom-bench-')) / 'db.sqlite3'
+    if template.exists():
+        copy_database(template, db_path)
+        return setup(db_path)
+    setup(db_path)
+    seed_products(count)
+    SEED_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    copy_database(db_path, template)
+    return db_path
@@ -0,0 +1,46 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command, workers, port, db_path, **env):
+    """
+    Starts `python -m <command>` (a gunicorn command line without --workers
+    or --bind) against db_path and waits until it serves the catalog.
+    Extra keyword arguments are set in the server's environment.
+    """
+    env = dict(
+        os.environ,
+        DATABASE_PATH=str(db_path),
+        SECRET_KEY='benchmark-only-not-secret',
+        ALLOWED_HOSTS='127.0.0.1',
+        **env,
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', *command, '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+         '--timeout', '120', '--log-level', 'warning'],
+        env=env,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f'{command[1]} did not start')
+
+
+def stop_server(server):
+    server.terminate()
+    server.wait()
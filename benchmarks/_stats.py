@@ -0,0 +1,91 @@
+import json
+import math
+import os
+
+
+def percentile(sorted_values, q):
+    """
+    Returns the q-th percentile (0-100) of an already sorted list, using the
+    nearest-rank method.
+    """
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """
+    Summarizes request latencies (seconds) into milliseconds and throughput.
+    """
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3) if values else float('nan'),
+        'rps': round(len(values) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def print_table(rows, columns=('p50_ms', 'p95_ms', 'p99_ms', 'rps', 'errors')):
+    """
+    Prints {name: summary} as an aligned table.
+    """
+    width = max(len(name) for name in rows)
+    print(f'{"":{width}}  ' + '  '.join(f'{column:>10}' for column in columns))
+    for name, summary in rows.items():
+        print(f'{name:{width}}  ' + '  '.join(f'{summary[column]:>10}' for column in columns))
+
+
+def write_json(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=0.2, min_ms=0.5):
+    """
+    Returns a list of regressions of results against baseline, both
+    {name: summary}, as messages.
+
+    Latencies regress when they grow by more than tolerance (a fraction) and
+    by at least min_ms, so sub-millisecond noise is not reported; throughput
+    regresses when it drops by more than tolerance. New errors always count.
+    Names missing from either side are skipped.
+    """
+    regressions = []
+    for name in sorted(results.keys() & baseline.keys()):
+        current, before = results[name], baseline[name]
+        for column in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if current[column] > before[column] * (1 + tolerance) and current[column] - before[column] >= min_ms:
+                regressions.append(f'{name}: {column} {before[column]} -> {current[column]}')
+        if current['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f'{name}: rps {before["rps"]} -> {current["rps"]}')
+        if current['errors'] > before['errors']:
+            regressions.append(f'{name}: errors {before["errors"]} -> {current["errors"]}')
+    return regressions
+
+
+def check_baseline(results, path, tolerance, save=False):
+    """
+    Compares results with the baseline at path and prints any regressions,
+    returning the process exit status: 1 if something regressed. With save,
+    or when there is no baseline yet, writes results as the new baseline.
+    """
+    if save or not os.path.exists(path):
+        write_json(path, results)
+        print(f'Baseline written to {path}')
+        return 0
+    regressions = compare(results, read_json(path), tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if not regressions:
+        print(f'No regressions against {path} (tolerance {tolerance:.0%})')
+    return 1 if regressions else 0
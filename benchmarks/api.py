@@ -0,0 +1,75 @@
+"""
+The JSON catalog API against the HTML catalog page it replaces for
+scrapers, through the Django test client.
+
+    python -m benchmarks.api [--products 20000] [--page-size 2000] [--repeat 20] [--json out.json]
+
+Fetches --page-size products --repeat times as a catalog page, as an API
+page with the default fields and with ?fields=id,price, and as an ?ids=
+batch of random products. The catalog cache is invalidated before each
+request, so every response is rendered or serialized afresh. Reports
+latency and the size of each response, plain and gzipped.
+"""
+import argparse
+import gzip
+import random
+import time
+
+from benchmarks import _django, _stats
+
+
+def scenarios(product_ids, page_size, rng):
+    """
+    Returns {name: callable returning a URL}.
+    """
+    from django.urls import reverse
+    api = reverse('product_api')
+    return {
+        'html page': lambda: f'{reverse("product_list")}?page_size={page_size}',
+        'api page': lambda: f'{api}?page_size={page_size}',
+        'api page, id+price': lambda: f'{api}?page_size={page_size}&fields=id,price',
+        'api ids': lambda: f'{api}?ids={",".join(map(str, rng.sample(product_ids, page_size)))}',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--page-size', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    _django.setup_seeded(args.products)
+    from django.conf import settings
+    from django.test import Client
+    from products.cache import bump_catalog_version
+    from products.models import Product
+    settings.CATALOG_MAX_PAGE_SIZE = settings.API_MAX_PAGE_SIZE = args.page_size
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+    rng = random.Random(0)
+    client = Client()
+
+    results, sizes = {}, {}
+    for name, url in scenarios(product_ids, args.page_size, rng).items():
+        latencies, errors = [], 0
+        for _ in range(args.repeat):
+            bump_catalog_version()
+            start = time.perf_counter()
+            response = client.get(url())
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code != 200
+        body = response.content
+        results[name] = _stats.summarize(latencies, sum(latencies), errors)
+        sizes[name] = {'kib': round(len(body) / 1024, 1), 'gzip_kib': round(len(gzip.compress(body)) / 1024, 1)}
+
+    _stats.print_table(results, columns=('p50_ms', 'p95_ms', 'max_ms', 'errors'))
+    print(f'\nResponse size for {args.page_size} products:')
+    for name, size in sizes.items():
+        print(f'  {name:20} {size["kib"]:9.1f} KiB  {size["gzip_kib"]:8.1f} KiB gzipped')
+    if args.json:
+        _stats.write_json(args.json, {**results, 'sizes': sizes})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Load test for slow clients: gunicorn sync workers against uvicorn workers
+running the async views.
+
+    python -m benchmarks.asgi_load [--workers 2] [--per-worker 0,1,4,16] [--fast 8] [--seconds 5]
+
+For each deployment and each --per-worker level, opens that many slow
+connections per worker, which trickle their request headers in for the
+whole run the way a client on a bad mobile link does, and measures what
+--fast ordinary clients get from the catalog page meanwhile. A sync worker
+is pinned by one slow connection, so once every worker has one the fast
+clients only get timeouts; an async worker keeps serving them.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks import _django, _server, _stats
+
+DEPLOYMENTS = {
+    'gunicorn sync': ['gunicorn', 'ecom_demo.wsgi:application'],
+    'gunicorn uvicorn': ['gunicorn', 'ecom_demo.asgi:application', '-k', 'uvicorn_worker.UvicornWorker'],
+}
+
+
+def request_bytes(path):
+    return f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n'.encode()
+
+
+async def fetch(port, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(request_bytes(path))
+        await writer.drain()
+        data = await reader.read()
+    finally:
+        writer.close()
+    return int(data.split(b' ', 2)[1])
+
+
+async def slow_client(port, stop, interval=0.5):
+    """
+    Sends a request one header line every interval seconds until stop is set.
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(b'GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n')
+        while not stop.is_set():
+            writer.write(b'X-Padding: slow\r\n')
+            await writer.drain()
+            await asyncio.sleep(interval)
+        writer.write(b'Connection: close\r\n\r\n')
+        await writer.drain()
+        await reader.read()
+    except OSError:
+        pass
+    finally:
+        writer.close()
+
+
+async def fast_client(port, stop, latencies, failures, timeout):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(fetch(port, '/'), timeout)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            status = None
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            failures.append(status)
+
+
+async def run_level(port, slow, fast, seconds, timeout):
+    stop = asyncio.Event()
+    latencies, failures = [], []
+    slow_tasks = [asyncio.create_task(slow_client(port, stop)) for _ in range(slow)]
+    # Let the slow connections reach the workers first.
+    await asyncio.sleep(0.5)
+    start = time.perf_counter()
+    fast_tasks = [asyncio.create_task(fast_client(port, stop, latencies, failures, timeout)) for _ in range(fast)]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*fast_tasks)
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*slow_tasks)
+    return _stats.summarize(latencies, elapsed, errors=len(failures))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--per-worker', default='0,1,4,16', help='slow connections per worker, comma-separated')
+    parser.add_argument('--fast', type=int, default=8, help='concurrent ordinary clients')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--timeout', type=float, default=2, help='seconds before a fast request counts as an error')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    db_path = _django.setup()
+    _django.seed_products(args.products)
+    levels = [int(level) for level in args.per_worker.split(',')]
+
+    results = {}
+    for name, command in DEPLOYMENTS.items():
+        port = _server.free_port()
+        server = _server.start_server(command, args.workers, port, db_path)
+        try:
+            for level in levels:
+                results[f'{name}, {level} slow/worker'] = asyncio.run(
+                    run_level(port, level * args.workers, args.fast, args.seconds, args.timeout)
+                )
+        finally:
+            _server.stop_server(server)
+
+    _stats.print_table(results)
+    if args.json:
+        _stats.write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Worker cold start: how long a new process takes to import and set up the
+application, and which imports that time goes to.
+
+    python -m benchmarks.boot [--settings ecom_demo.settings,ecom_demo.settings_storefront] [--repeat 10]
+                              [--top 15] [--json out.json] [--baseline boot.json [--save-baseline] [--tolerance 0.2]]
+
+For each settings module, starts --repeat fresh interpreters that load
+ecom_demo.wsgi and run products.boot.warm, and reports the time to a
+loaded application ("import"), the warm-up ("warm") and the whole process
+including interpreter start-up ("process"). Then one more run under
+`python -X importtime` breaks the import time down by top-level package
+and lists the --top slowest modules. See benchmarks.endpoints for
+--baseline.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from benchmarks import _django, _stats
+
+BOOT = '''
+import time
+start = time.perf_counter()
+import ecom_demo.wsgi
+loaded = time.perf_counter()
+from products.boot import warm
+warm()
+print(loaded - start, time.perf_counter() - loaded)
+'''
+
+
+def run_boot(env, importtime=False):
+    """
+    Returns (import seconds, warm seconds, process seconds, stderr) of one
+    fresh interpreter.
+    """
+    command = [sys.executable, *(['-X', 'importtime'] if importtime else []), '-c', BOOT]
+    start = time.perf_counter()
+    result = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - start
+    imported, warmed = map(float, result.stdout.split())
+    return imported, warmed, elapsed, result.stderr
+
+
+def parse_importtime(stderr):
+    """
+    Returns [(module, self microseconds, cumulative microseconds)] from the
+    output of -X importtime.
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line.removeprefix('import time:').split('|')
+        modules.append((name.strip(), int(own), int(cumulative)))
+    return modules
+
+
+def print_import_report(name, modules, top):
+    total = sum(own for _, own, _ in modules)
+    packages = Counter()
+    for module, own, _ in modules:
+        packages[module.split('.')[0]] += own
+    print(f'\n{name}: {len(modules)} modules imported in {total / 1000:.1f} ms')
+    print('  by package:')
+    for package, own in packages.most_common(top):
+        print(f'    {package:40} {own / 1000:8.1f} ms  {own / total:6.1%}')
+    print('  slowest modules (self time):')
+    for module, own, cumulative in sorted(modules, key=lambda m: -m[1])[:top]:
+        print(f'    {module:40} {own / 1000:8.1f} ms  (cumulative {cumulative / 1000:.1f} ms)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--settings', default='ecom_demo.settings,ecom_demo.settings_storefront',
+                        help='settings modules, comma-separated')
+    parser.add_argument('--repeat', type=int, default=10, help='processes started per settings module')
+    parser.add_argument('--top', type=int, default=15, help='packages and modules listed in the import report')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare against (or create) this results file')
+    parser.add_argument('--save-baseline', action='store_true', help='overwrite --baseline with these results')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown, as a fraction')
+    args = parser.parse_args()
+
+    db_path = _django.setup_seeded(args.products)
+    results, reports = {}, {}
+    for settings_module in args.settings.split(','):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module, DATABASE_PATH=str(db_path))
+        # One untimed run first, so bytecode is compiled and files are cached.
+        run_boot(env)
+        runs = [run_boot(env) for _ in range(args.repeat)]
+        for index, step in enumerate(('import', 'warm', 'process')):
+            latencies = [run[index] for run in runs]
+            results[f'{settings_module} {step}'] = _stats.summarize(latencies, sum(latencies))
+        reports[settings_module] = parse_importtime(run_boot(env, importtime=True)[3])
+
+    _stats.print_table(results, columns=('p50_ms', 'p95_ms', 'max_ms', 'errors'))
+    for settings_module, modules in reports.items():
+        print_import_report(settings_module, modules, args.top)
+    if args.json:
+        _stats.write_json(args.json, results)
+    if args.baseline:
+        sys.exit(_stats.check_baseline(results, args.baseline, args.tolerance, args.save_baseline))
+
+
+if __name__ == '__main__':
+    main()
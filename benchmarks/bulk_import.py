@@ -0,0 +1,71 @@
+"""
+Times import_products and export_products on a generated catalog file.
+
+    python -m benchmarks.bulk_import [--rows 1000000] [--batch-size 1000] [--json out.json]
+
+Imports the file into an empty database, imports it again (every row is an
+unchanged upsert), then exports it, reporting rows per second and the
+process's peak resident memory after each step.
+"""
+import argparse
+import csv
+import os
+import resource
+import tempfile
+import time
+
+from benchmarks import _django, _stats
+
+
+def generate(path, rows):
+    with open(path, 'w', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(['sku', 'name', 'description', 'price', 'image_url'])
+        for i in range(rows):
+            writer.writerow([
+                f'SKU-{i:08d}', f'Product {i:07d}', f'Description of product {i}. ' * 4,
+                f'{(i * 37) % 100000 / 100 + 1:.2f}', f'https://example.com/images/{i}.jpg',
+            ])
+
+
+def peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    db_path = _django.setup()
+    from django.core.management import call_command
+
+    directory = tempfile.mkdtemp(prefix='ecom-bench-')
+    source = os.path.join(directory, 'products.csv')
+    generate(source, args.rows)
+    steps = [
+        ('import (insert)', lambda: call_command('import_products', source, '--batch-size', str(args.batch_size))),
+        ('import (unchanged)', lambda: call_command('import_products', source, '--batch-size', str(args.batch_size))),
+        ('export', lambda: call_command('export_products', os.path.join(directory, 'export.jsonl'))),
+    ]
+    results = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        step()
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            'rows': args.rows,
+            'seconds': round(elapsed, 1),
+            'rows_per_s': round(args.rows / elapsed),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+    print(f'database: {db_path}')
+    _stats.print_table(results, columns=('rows', 'seconds', 'rows_per_s', 'peak_rss_mb'))
+    if args.json:
+        _stats.write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares cart-mutation latency across the cart storage backends with
+concurrent clients.
+
+    python -m benchmarks.cart_storage [--clients 8] [--requests 200] [--json out.json]
+
+Each client adds a few products, then hammers the quantity endpoint. The
+database is a SQLite file, so session writes contend for its write lock as
+they would under several gunicorn workers.
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import _django, _stats
+
+
+def run_mode(mode, product_ids, clients, requests_per_client):
+    from django.conf import settings
+    from django.db import connection
+    from django.test import Client
+    from django.urls import reverse
+    from products.cart_storage import _load_storage, get_cart_storage
+
+    settings.CART_STORAGE = settings.CART_STORAGE_BACKENDS[mode]
+    _load_storage.cache_clear()
+    barrier = threading.Barrier(clients)
+    latencies = []
+    errors = []
+
+    def client_loop(seed):
+        rng = random.Random(seed)
+        client = Client()
+        cart = rng.sample(product_ids, 5)
+        for product_id in cart:
+            client.post(reverse('add_to_cart', args=[product_id]))
+        urls = [reverse('update_cart_quantity', args=[product_id]) for product_id in cart]
+        barrier.wait()
+        own_latencies, own_errors = [], 0
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            response = client.post(rng.choice(urls), {'action': 'increase'})
+            own_latencies.append(time.perf_counter() - start)
+            own_errors += response.status_code != 200
+        connection.close()
+        latencies.extend(own_latencies)
+        errors.append(own_errors)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(client_loop, range(clients)))
+    elapsed = time.perf_counter() - start
+    if mode == 'cache':
+        get_cart_storage().queue.flush()
+    return _stats.summarize(latencies, elapsed, sum(errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='mutations per client')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--modes', nargs='+', default=['session', 'cookie', 'cache', 'database'])
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    _django.setup()
+    product_ids = _django.seed_products(args.products)
+    results = {
+        mode: run_mode(mode, product_ids, args.clients, args.requests)
+        for mode in args.modes
+    }
+    _stats.print_table(results)
+    if args.json:
+        _stats.write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
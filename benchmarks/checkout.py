@@ -0,0 +1,139 @@
+"""
+Checkout latency with the post-order work queued, against doing it in the
+request, and how fast `run_jobs` workers drain the queue.
+
+    python -m benchmarks.checkout [--orders 200] [--clients 4] [--workers 1,4] [--smtp-delay 0.05] [--json out.json]
+
+--clients threads each fill carts with three stock-tracked products and
+check them out, --orders in all. "queued" is the checkout view as shipped;
+"inline" also settles the stock and sends the confirmation before the
+response, the way a checkout without the job queue would. Sending mail
+sleeps --smtp-delay seconds, standing in for an SMTP server. Then, for each
+--workers level, the jobs of --orders orders are drained by that many
+worker threads, reporting jobs per second.
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.mail.backends.locmem import EmailBackend
+
+from benchmarks import _django, _stats
+
+SMTP_DELAY = 0.0
+
+
+class SlowEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        time.sleep(SMTP_DELAY)
+        return super().send_messages(messages)
+
+
+def place_orders(mode, product_ids, orders, clients):
+    """
+    Checks out orders carts from clients threads; returns the latency summary.
+    """
+    from django.db import connection
+    from django.test import Client
+    from django.urls import reverse
+    from products.models import Job, Order
+    from products.orders import finalize_order, send_confirmation
+    latencies, errors = [], []
+
+    def client_loop(seed):
+        rng = random.Random(seed)
+        client = Client()
+        for index in range(seed, orders, clients):
+            for product_id in rng.sample(product_ids, 3):
+                client.post(reverse('add_to_cart', args=[product_id]))
+            start = time.perf_counter()
+            response = client.post(
+                reverse('checkout'), {'email': 'buyer@example.com'},
+                headers={'Idempotency-Key': f'{mode}-{index}'},
+            )
+            if response.status_code == 201 and mode == 'inline':
+                order_id = Order.objects.values_list('pk', flat=True).get(number=response.json()['order'])
+                finalize_order(order_id)
+                send_confirmation(order_id)
+                Job.objects.filter(payload__order_id=order_id).delete()
+            latencies.append(time.perf_counter() - start)
+            errors.append(response.status_code != 201)
+        connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(client_loop, range(clients)))
+    return _stats.summarize(latencies, time.perf_counter() - start, sum(errors))
+
+
+def drain(workers):
+    """
+    Runs every due job with workers threads; returns (jobs run, seconds).
+    """
+    from django.db import connections
+    from products import jobs
+    counts = [{'done': 0, 'failed': 0} for _ in range(workers)]
+
+    def worker(thread_counts):
+        try:
+            jobs.work(threading.Event(), drain=True, counts=thread_counts)
+        finally:
+            connections.close_all()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(thread_counts,)) for thread_counts in counts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(c['done'] + c['failed'] for c in counts), time.perf_counter() - start
+
+
+def main():
+    global SMTP_DELAY
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--workers', default='1,4', help='worker thread counts to try, comma-separated')
+    parser.add_argument('--smtp-delay', type=float, default=0.05, help='seconds each email takes to send')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    SMTP_DELAY = args.smtp_delay
+
+    _django.setup()
+    from django.conf import settings
+    from products import jobs
+    from products.inventory import set_stock
+    from products.models import Job
+    settings.EMAIL_BACKEND = 'benchmarks.checkout.SlowEmailBackend'
+    product_ids = _django.seed_products(args.products)
+    for product_id in product_ids:
+        set_stock(product_id, 1_000_000)
+
+    results = {}
+    for mode in ('inline', 'queued'):
+        results[f'checkout, {mode}'] = place_orders(mode, product_ids, args.orders, args.clients)
+    _stats.print_table(results)
+
+    print(f'\nDraining the jobs of {args.orders} orders:')
+    drains = {}
+    for workers in map(int, args.workers.split(',')):
+        # The queued checkouts above left their jobs for the first level.
+        if not Job.objects.filter(status=Job.PENDING).exists():
+            place_orders(f'drain-{workers}', product_ids, args.orders, args.clients)
+        backlog = jobs.backlog()
+        ran, elapsed = drain(workers)
+        drains[f'{workers} worker(s)'] = {'jobs': ran, 'seconds': round(elapsed, 2), 'jobs_per_s': round(ran / elapsed, 1)}
+        print(
+            f'  {workers:3} worker(s): {ran} jobs in {elapsed:.1f}s ({ran / elapsed:.1f}/s), '
+            f'oldest waiting {backlog["oldest_due_seconds"]:.1f}s at the start'
+        )
+    if args.json:
+        _stats.write_json(args.json, {**results, 'drain': drains})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+In-process micro-benchmarks of every storefront endpoint, through the
+Django test client.
+
+    python -m benchmarks.endpoints [--sizes 1000,100000,1000000] [--repeat 200] [--json out.json]
+                                   [--baseline benchmarks.json [--save-baseline] [--tolerance 0.2]]
+
+For each catalog size, times each view on its own, with the catalog page
+cache warm and (the "uncached" scenarios) after invalidating it, so both
+the common path and the rendering path are covered. With --baseline the
+results are compared against a previous run, and the command exits with
+status 1 if any latency or throughput regressed beyond --tolerance; the
+baseline is written if it does not exist yet.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from benchmarks import _django, _stats
+
+
+def scenarios(product_ids, rng):
+    """
+    Returns {name: (method, url or callable returning one, data, before)},
+    where before() runs untimed ahead of each request.
+    """
+    from django.urls import reverse
+    from products.cache import bump_catalog_version
+    from products.models import Product
+    from products.pagination import DEFAULT_ORDERING, encode_cursor
+
+    middle = Product.objects.filter(pk__gte=product_ids[len(product_ids) // 2]).order_by('pk').first()
+    deep_cursor = encode_cursor(DEFAULT_ORDERING, (middle.name, middle.pk))
+    cart = product_ids[:5]
+    words = ['product', 'description', 'product 00', 'desc']
+
+    def detail_url():
+        return reverse('product_detail', args=[rng.choice(product_ids)])
+
+    return {
+        'product_list': ('get', reverse('product_list'), None, None),
+        'product_list uncached': ('get', reverse('product_list'), None, bump_catalog_version),
+        'product_list deep page uncached': ('get', f'{reverse("product_list")}?cursor={deep_cursor}', None, bump_catalog_version),
+        'product_list by price uncached': ('get', f'{reverse("product_list")}?sort=-price', None, bump_catalog_version),
+        'product_detail': ('get', lambda: reverse('product_detail', args=[cart[0]]), None, None),
+        'product_detail uncached': ('get', detail_url, None, bump_catalog_version),
+        'search uncached': ('get', lambda: f'{reverse("search")}?q={rng.choice(words)}', None, bump_catalog_version),
+        'view_cart': ('get', reverse('view_cart'), None, None),
+        'add_to_cart': ('post', lambda: reverse('add_to_cart', args=[rng.choice(cart)]), None, None),
+        'update_cart_quantity': (
+            'post', lambda: reverse('update_cart_quantity', args=[rng.choice(cart)]), {'action': 'increase'}, None,
+        ),
+        'cart_batch': (
+            'post', reverse('cart_batch'),
+            json.dumps([{'op': 'increase', 'product_id': product_id} for product_id in cart]), None,
+        ),
+    }
+
+
+def run_scenario(client, method, url, data, before, repeat):
+    latencies, errors = [], 0
+    request = getattr(client, method)
+    kwargs = {'content_type': 'application/json'} if isinstance(data, str) else {}
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        path = url() if callable(url) else url
+        start = time.perf_counter()
+        response = request(path, data, **kwargs) if data is not None else request(path)
+        latencies.append(time.perf_counter() - start)
+        errors += response.status_code >= 400
+    return _stats.summarize(latencies, sum(latencies), errors)
+
+
+def run_size(size, repeat):
+    from django.test import Client
+    from django.urls import reverse
+    from products.models import Product
+
+    product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    rng = random.Random(size)
+    client = Client()
+    for product_id in product_ids[:5]:
+        client.post(reverse('add_to_cart', args=[product_id]))
+
+    results = {}
+    for name, (method, url, data, before) in scenarios(product_ids, rng).items():
+        # One untimed request first, so the timings cover the steady state
+        # (compiled templates, open connection) rather than process warm-up.
+        run_scenario(client, method, url, data, before, 1)
+        results[f'{size} {name}'] = run_scenario(client, method, url, data, before, repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000', help='catalog sizes, comma-separated (e.g. 1000,100000,1000000)')
+    parser.add_argument('--repeat', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare against (or create) this results file')
+    parser.add_argument('--save-baseline', action='store_true', help='overwrite --baseline with these results')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown, as a fraction')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if len(sizes) > 1:
+        # Django can only be set up once per process.
+        results = {}
+        for size in sizes:
+            results.update(_run_in_subprocess(size, args.repeat))
+    else:
+        _django.setup_seeded(sizes[0])
+        results = run_size(sizes[0], args.repeat)
+
+    _stats.print_table(results)
+    if args.json:
+        _stats.write_json(args.json, results)
+    if args.baseline:
+        sys.exit(_stats.check_baseline(results, args.baseline, args.tolerance, args.save_baseline))
+
+
+def _run_in_subprocess(size, repeat):
+    import subprocess
+    import tempfile
+    with tempfile.NamedTemporaryFile(suffix='.json') as output:
+        subprocess.run(
+            [sys.executable, '-m', 'benchmarks.endpoints', '--sizes', str(size), '--repeat', str(repeat),
+             '--json', output.name],
+            check=True,
+        )
+        return _stats.read_json(output.name)
+
+
+if __name__ == '__main__':
+    main()
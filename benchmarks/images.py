@@ -0,0 +1,132 @@
+"""
+Image ingest throughput and catalog page image weight.
+
+    python -m benchmarks.images [--images 48] [--size 2400x1800] [--workers 4] [--json out.json]
+
+Generates --images photo-like JPEG originals, serves them over a local HTTP
+server and ingests them into fresh products twice: resizing in this
+process, then in a pool of --workers processes. Then compares the image
+bytes one catalog page (CATALOG_PAGE_SIZE cards) downloads with the
+originals against the 400 px copies its srcset picks for a card at 1x.
+"""
+import argparse
+import functools
+import http.server
+import io
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from benchmarks import _django, _stats
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def make_original(index, size):
+    """
+    Returns a JPEG of size with noise and gradients, which compresses about
+    as badly as a product photo.
+    """
+    from PIL import Image, ImageFilter
+    rng = random.Random(index)
+    small = Image.frombytes('RGB', (size[0] // 16, size[1] // 16), rng.randbytes(size[0] // 16 * (size[1] // 16) * 3))
+    image = small.resize(size, Image.Resampling.BICUBIC).filter(ImageFilter.GaussianBlur(2))
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+def ingest_all(urls, pool):
+    from products import images
+    from products.models import Product
+    Product.objects.all().delete()
+    Product.objects.bulk_create(
+        Product(name=f'Product {i}', description='', price=1, image_url=url) for i, url in enumerate(urls)
+    )
+    start = time.perf_counter()
+    ingested, failed = images.ingest(list(Product.objects.only(*images.INGEST_FIELDS)), pool)
+    elapsed = time.perf_counter() - start
+    assert not failed, f'{failed} images failed'
+    return ingested, elapsed
+
+
+def page_weights(originals):
+    """
+    Returns the bytes of the first catalog page's images: the originals,
+    and the 400 px copy in each format.
+    """
+    from django.conf import settings
+    from django.core.files.storage import default_storage
+    from products import images
+    from products.models import Product
+    page = list(Product.objects.order_by('pk')[:settings.CATALOG_PAGE_SIZE])
+    return {
+        'originals': sum((originals / url.rsplit('/', 1)[1]).stat().st_size for url in (p.image_url for p in page)),
+        **{
+            f'400w {format}': sum(
+                default_storage.size(images.variant_name(product.image_digest, 400, format)) for product in page
+            )
+            for format in images.FORMATS
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', type=int, default=48)
+    parser.add_argument('--size', default='2400x1800', help='original size, WIDTHxHEIGHT')
+    parser.add_argument('--workers', type=int, default=4, help='resizing processes')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    _django.setup()
+    from django.conf import settings
+    from django.test.utils import override_settings
+    from products import images
+
+    if not images.available():
+        raise SystemExit('Needs Pillow: pip install Pillow')
+    size = tuple(int(part) for part in args.size.split('x'))
+    originals = Path(tempfile.mkdtemp(prefix='ecom-bench-originals-'))
+    for index in range(args.images):
+        (originals / f'{index}.jpg').write_bytes(make_original(index, size))
+
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), functools.partial(QuietHandler, directory=str(originals)),
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [f'http://127.0.0.1:{server.server_port}/{index}.jpg' for index in range(args.images)]
+
+    results = {}
+    try:
+        for name, workers in (('in process', 0), (f'{args.workers} processes', args.workers)):
+            # A fresh MEDIA_ROOT each time, so every image is resized again.
+            with override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='ecom-bench-media-')):
+                if workers:
+                    with ProcessPoolExecutor(workers) as pool:
+                        count, elapsed = ingest_all(urls, pool)
+                else:
+                    count, elapsed = ingest_all(urls, None)
+                # Per image; rps is images resized per second.
+                results[f'ingest {name}'] = _stats.summarize([elapsed / count] * count, elapsed)
+                weights = page_weights(originals)
+    finally:
+        server.shutdown()
+
+    _stats.print_table(results, columns=('p50_ms', 'rps', 'errors'))
+    print(f'\nImage bytes for one catalog page of {settings.CATALOG_PAGE_SIZE} cards:')
+    for name, weight in weights.items():
+        ratio = '' if name == 'originals' else f'  ({weights["originals"] / weight:.1f}x smaller)'
+        print(f'  {name:12} {weight / 1024:10.0f} KiB{ratio}')
+    if args.json:
+        _stats.write_json(args.json, {**results, 'page_bytes': weights})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Stress test for stock reservations: many buyers reserving one hot product
+at once.
+
+    python -m benchmarks.inventory [--stock 2000] [--processes 4] [--threads 4] [--shards 1,8] [--json out.json]
+
+Gives one product --stock units, then starts --processes processes of
+--threads threads each, which reserve one unit at a time until the product
+is sold out. Runs once per --shards level with products.inventory.reserve,
+and once with a naive read-modify-write decrement for comparison. Reports
+reservations per second, latency, and how many units were sold beyond the
+stock ("oversold"), which must be 0 for every reserve() run.
+"""
+import argparse
+import multiprocessing
+import threading
+import time
+
+from benchmarks import _django, _stats
+
+
+def naive_take(product_id):
+    """
+    Reads the stock and writes it back decremented, the race reserve()
+    avoids. Returns False once the product is sold out.
+    """
+    from products.models import Stock
+    stock = Stock.objects.filter(product_id=product_id).first()
+    if stock.quantity < 1:
+        return False
+    Stock.objects.filter(pk=stock.pk).update(quantity=stock.quantity - 1)
+    return True
+
+
+def buy_until_sold_out(mode, product_id, holder, latencies, errors):
+    from django.db import OperationalError, connection
+    from products.cart import OutOfStock
+    from products.inventory import reserve
+    while True:
+        start = time.perf_counter()
+        try:
+            if mode == 'naive':
+                if not naive_take(product_id):
+                    break
+            else:
+                reserve(holder, product_id, 1)
+        except OutOfStock:
+            break
+        except OperationalError:
+            errors.append(1)
+            continue
+        # One entry per unit sold; list.append is safe across threads.
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def run_process(args):
+    mode, product_id, process, threads = args
+    from django.db import connections
+    connections.close_all()
+    latencies, errors = [], []
+    workers = [
+        threading.Thread(
+            target=buy_until_sold_out,
+            args=(mode, product_id, f'session:bench-{process}-{thread}', latencies, errors),
+        )
+        for thread in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, len(errors)
+
+
+def run(mode, shards, stock, processes, threads):
+    from django.db import connections
+    from products.inventory import set_stock
+    from products.models import Product, Reservation
+    product_id = Product.objects.order_by('pk').values_list('pk', flat=True).first()
+    Reservation.objects.all().delete()
+    set_stock(product_id, stock, shards)
+    connections.close_all()
+
+    start = time.perf_counter()
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        results = pool.map(run_process, [(mode, product_id, process, threads) for process in range(processes)])
+    elapsed = time.perf_counter() - start
+    latencies = [latency for process_latencies, _ in results for latency in process_latencies]
+    errors = sum(process_errors for _, process_errors in results)
+    return {**_stats.summarize(latencies, elapsed, errors=errors), 'oversold': len(latencies) - stock}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--stock', type=int, default=2000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4, help='buyers per process')
+    parser.add_argument('--shards', default='1,8', help='stock shard counts to try, comma-separated')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    _django.setup()
+    _django.seed_products(1)
+    results = {}
+    for shards in map(int, args.shards.split(',')):
+        results[f'reserve, {shards} shard(s)'] = run('reserve', shards, args.stock, args.processes, args.threads)
+    results['naive read-modify-write'] = run('naive', 1, args.stock, args.processes, args.threads)
+
+    print(f'{args.processes} processes x {args.threads} buyers, {args.stock} units of one product:')
+    _stats.print_table(results, columns=('p50_ms', 'p99_ms', 'rps', 'errors', 'oversold'))
+    if args.json:
+        _stats.write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+HTTP load test of a local gunicorn with a storefront traffic mix.
+
+    python -m benchmarks.load [--products 1000] [--workers 4] [--processes 4] [--clients 8] [--seconds 10]
+                              [--mix browse=70,add=15,update=15] [--json out.json]
+                              [--baseline load.json [--save-baseline] [--tolerance 0.2]]
+
+Starts gunicorn (--worker-class sync, or any gunicorn worker class) on a
+copy of a seeded catalog, then runs --processes load generator processes
+of --clients threads each. Every client keeps its own cookies, so carts
+and CSRF tokens behave as for real visitors. Each request is picked from
+the mix:
+
+    browse  a catalog page (any sort, any depth), a product page or a search
+    add     add a random product to the cart
+    update  increase or decrease the quantity of a product in the cart
+
+Results are reported per kind of request and overall; see
+benchmarks.endpoints for --baseline.
+"""
+import argparse
+import html
+import http.client
+import http.cookiejar
+import json
+import multiprocessing
+import random
+import re
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from benchmarks import _django, _server, _stats
+
+WORKER_CLASSES = {
+    'sync': ['gunicorn', 'ecom_demo.wsgi:application'],
+    'uvicorn': ['gunicorn', 'ecom_demo.asgi:application', '-k', 'uvicorn_worker.UvicornWorker'],
+}
+
+# Next/previous links of a catalog page.
+PAGE_LINK = re.compile(rb'href="(\?[^"]*cursor=[^"]+)"')
+
+
+class Visitor:
+    """
+    One simulated shopper with its own cookies.
+    """
+    def __init__(self, base_url, product_ids, rng):
+        self.base_url = base_url
+        self.product_ids = product_ids
+        self.rng = rng
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        self.cart = {}
+        self.pages = []
+
+    def request(self, path, data=None):
+        headers = {}
+        if data is not None:
+            data = urllib.parse.urlencode(data).encode()
+            token = next((c.value for c in self.cookies if c.name == 'csrftoken'), None)
+            if token is None:
+                # Catalog pages set no cookie; fetch it as their script does.
+                token = json.loads(self.request('/csrf/')[1] or b'{}').get('token', '')
+            headers['X-CSRFToken'] = token
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, b''
+
+    def browse(self):
+        choice = self.rng.random()
+        if choice < 0.5:
+            if self.pages and self.rng.random() < 0.7:
+                path = self.rng.choice(self.pages)
+            else:
+                path = '/?' + urllib.parse.urlencode({'sort': self.rng.choice(['name', '-name', 'price', '-price'])})
+            status, body = self.request(path)
+            links = ['/' + html.unescape(link.decode()) for link in PAGE_LINK.findall(body)]
+            self.pages = (self.pages + links)[-20:]
+            return status
+        if choice < 0.85:
+            return self.request(f'/product/{self.rng.choice(self.product_ids)}/')[0]
+        query = {'q': self.rng.choice(['product', 'description', 'product 00'])}
+        return self.request('/search/?' + urllib.parse.urlencode(query))[0]
+
+    def add(self):
+        product_id = self.rng.choice(self.product_ids)
+        status, _ = self.request(f'/add_to_cart/{product_id}/', {})
+        if status < 400:
+            self.cart[product_id] = self.cart.get(product_id, 0) + 1
+        return status
+
+    def update(self):
+        if not self.cart:
+            return self.add()
+        product_id = self.rng.choice(list(self.cart))
+        action = self.rng.choice(['increase', 'increase', 'decrease'])
+        status, _ = self.request(f'/update_cart_quantity/{product_id}/', {'action': action})
+        if status < 400:
+            self.cart[product_id] += 1 if action == 'increase' else -1
+            if not self.cart[product_id]:
+                del self.cart[product_id]
+        return status
+
+
+def run_clients(args):
+    """
+    Runs clients threads in this process until the deadline, returning
+    {kind: (latencies, errors)}.
+    """
+    import threading
+    base_url, product_ids, clients, deadline, mix, seed = args
+    kinds, weights = zip(*mix.items())
+    results = {kind: ([], [0]) for kind in kinds}
+    lock = threading.Lock()
+
+    def client_loop(index):
+        rng = random.Random(seed * 1000 + index)
+        visitor = Visitor(base_url, product_ids, rng)
+        visitor.request('/')
+        local = {kind: ([], 0) for kind in kinds}
+        while time.time() < deadline:
+            kind = rng.choices(kinds, weights)[0]
+            start = time.perf_counter()
+            try:
+                status = getattr(visitor, kind)()
+            except (OSError, http.client.HTTPException):
+                status = None
+            latencies, errors = local[kind]
+            latencies.append(time.perf_counter() - start)
+            if status is None or status >= 400:
+                local[kind] = (latencies, errors + 1)
+        with lock:
+            for kind, (latencies, errors) in local.items():
+                results[kind][0].extend(latencies)
+                results[kind][1][0] += errors
+
+    threads = [threading.Thread(target=client_loop, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {kind: (latencies, errors[0]) for kind, (latencies, errors) in results.items()}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        kind, weight = part.split('=')
+        if kind not in ('browse', 'add', 'update'):
+            raise argparse.ArgumentTypeError(f'unknown request kind: {kind}')
+        mix[kind] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--worker-class', choices=WORKER_CLASSES, default='sync')
+    parser.add_argument('--processes', type=int, default=4, help='load generator processes')
+    parser.add_argument('--clients', type=int, default=8, help='clients per load generator process')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('browse=70,add=15,update=15'))
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare against (or create) this results file')
+    parser.add_argument('--save-baseline', action='store_true', help='overwrite --baseline with these results')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown, as a fraction')
+    args = parser.parse_args()
+
+    db_path = _django.setup_seeded(args.products)
+    from products.models import Product
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+
+    port = _server.free_port()
+    server = _server.start_server(
+        WORKER_CLASSES[args.worker_class], args.workers, port, db_path,
+        # Share carts and the catalog cache between workers, as deployed.
+        CATALOG_CACHE='file', CATALOG_CACHE_DIR=str(db_path.parent / 'catalog-cache'),
+    )
+    try:
+        start = time.perf_counter()
+        deadline = time.time() + args.seconds
+        jobs = [
+            (f'http://127.0.0.1:{port}', product_ids, args.clients, deadline, args.mix, seed)
+            for seed in range(args.processes)
+        ]
+        with multiprocessing.Pool(args.processes) as pool:
+            outputs = pool.map(run_clients, jobs)
+        elapsed = time.perf_counter() - start
+    finally:
+        _server.stop_server(server)
+
+    prefix = f'{args.products} {args.worker_class}'
+    results = {}
+    everything, all_errors = [], 0
+    for kind in args.mix:
+        latencies = [value for output in outputs for value in output[kind][0]]
+        errors = sum(output[kind][1] for output in outputs)
+        results[f'{prefix} {kind}'] = _stats.summarize(latencies, elapsed, errors)
+        everything.extend(latencies)
+        all_errors += errors
+    results[f'{prefix} all'] = _stats.summarize(everything, elapsed, all_errors)
+
+    _stats.print_table(results)
+    if args.json:
+        _stats.write_json(args.json, results)
+    if args.baseline:
+        sys.exit(_stats.check_baseline(results, args.baseline, args.tolerance, args.save_baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Measures the time to render 1,000 product cards.
+
+    python -m benchmarks.render_cards [--cards 1000] [--repeat 20] [--json out.json]
+
+Compares the previous markup, which reversed three URLs per card with
+{% url %}, against {% product_cards %} with an empty card cache (URLs built
+by url_builder) and with a warm one, and loading a page template through
+the cached loader against a plain app-directories loader.
+"""
+import argparse
+import time
+from decimal import Decimal
+
+from benchmarks import _django, _stats
+
+
+def timed(function, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return _stats.summarize(latencies, sum(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cards', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    _django.setup()
+    from django.template import Context, engines
+    from django.template.engine import Engine
+    from products.cache import get_cache
+    from products.models import Product
+
+    engine = engines['django'].engine
+    products = [
+        Product(pk=i, name=f'Product {i}', price=Decimal('9.99'), image_url=f'https://example.com/{i}.jpg')
+        for i in range(1, args.cards + 1)
+    ]
+    for product in products:
+        product.short_description = f'Description of product {product.pk}.'
+    context = {'products': products, 'csrf_token': 'benchmark-token'}
+
+    card_source = engine.get_template('products/_product_card.html').source
+    previous = engine.from_string(
+        '{% for product in products %}'
+        + card_source.replace('{{ detail_url }}', "{% url 'product_detail' product.pk %}")
+                     .replace('{{ add_to_cart_url }}', "{% url 'add_to_cart' product.pk %}")
+        + '{% endfor %}'
+    )
+    cards = engine.from_string('{% load catalog_cache %}{% product_cards products %}')
+
+    def render_cold():
+        get_cache().clear()
+        cards.render(Context(context))
+
+    uncached_loader = Engine(loaders=['django.template.loaders.app_directories.Loader'], libraries=engine.libraries)
+    results = {
+        '{% url %} per card': timed(lambda: previous.render(Context(context)), args.repeat),
+        'product_cards, cold cache': timed(render_cold, args.repeat),
+        'product_cards, warm cache': timed(lambda: cards.render(Context(context)), args.repeat),
+        'load product_list.html, app_directories': timed(
+            lambda: uncached_loader.get_template('products/product_list.html'), args.repeat),
+        'load product_list.html, cached loader': timed(
+            lambda: engine.get_template('products/product_list.html'), args.repeat),
+    }
+    _stats.print_table(results, columns=('p50_ms', 'p95_ms', 'max_ms'))
+    if args.json:
+        _stats.write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
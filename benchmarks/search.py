@@ -0,0 +1,64 @@
+"""
+Compares product search through the FTS5 index with the LIKE scan the
+admin used to do.
+
+    python -m benchmarks.search [--products 100000] [--repeat 20] [--json out.json]
+
+Each query is run --repeat times against a catalog of --products rows;
+seeding a million products takes a minute or two.
+"""
+import argparse
+import time
+
+from benchmarks import _django, _stats
+
+# (label, query) pairs: an exact product number, a prefix matching about a
+# hundred products, and a two-word query.
+QUERIES = [
+    ('exact', '{mid:07d}'),
+    ('prefix', '{prefix:05d}'),
+    ('two words', 'product {mid}'),
+]
+
+
+def run(product_count, repeat):
+    from django.db.models import Q
+    from products.models import Product
+    from products.search import search_product_ids
+
+    results = {}
+    for label, template in QUERIES:
+        query = template.format(mid=product_count // 2, prefix=product_count // 200)
+        for method, search in [
+            ('fts', lambda: search_product_ids(query, 24)),
+            ('like', lambda: list(
+                Product.objects.filter(Q(name__icontains=query) | Q(description__icontains=query))
+                .values_list('pk', flat=True)[:24]
+            )),
+        ]:
+            latencies = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                search()
+                latencies.append(time.perf_counter() - start)
+            results[f'{label} ({query}) {method}'] = _stats.summarize(latencies, sum(latencies))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    _django.setup()
+    _django.seed_products(args.products)
+    results = run(args.products, args.repeat)
+    _stats.print_table(results, columns=('p50_ms', 'p95_ms', 'max_ms'))
+    if args.json:
+        _stats.write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
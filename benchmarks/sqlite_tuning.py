@@ -0,0 +1,98 @@
+"""
+Load test for the SQLite connection tuning: concurrent readers of the cart
+page while other clients mutate their carts.
+
+    python -m benchmarks.sqlite_tuning [--readers 8] [--writers 4] [--seconds 5]
+
+Runs the workload twice, in separate processes, once with SQLite's defaults
+(SQLITE_TUNING=0: rollback journal, a new connection per request) and once
+with the tuned settings (WAL, synchronous=NORMAL, persistent connections),
+and reports reader and writer throughput for each.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks import _django, _stats
+
+
+def run_workload(readers, writers, seconds):
+    from django.db import connection
+    from django.test import Client
+    from django.urls import reverse
+
+    product_ids = _django.seed_products(200)
+    stop = threading.Event()
+    results = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+    lock = threading.Lock()
+
+    def client_loop(role, index):
+        client = Client()
+        cart = product_ids[index * 5:index * 5 + 5]
+        for product_id in cart:
+            client.post(reverse('add_to_cart', args=[product_id]))
+        url = reverse('view_cart') if role == 'read' else reverse('update_cart_quantity', args=[cart[0]])
+        latencies, failed = [], 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                if role == 'read':
+                    response = client.get(url)
+                else:
+                    response = client.post(url, {'action': 'increase'})
+                failed += response.status_code != 200
+            except Exception:
+                failed += 1
+            latencies.append(time.perf_counter() - start)
+        connection.close()
+        with lock:
+            results[role].extend(latencies)
+            errors[role] += failed
+
+    threads = [threading.Thread(target=client_loop, args=('read', i)) for i in range(readers)]
+    threads += [threading.Thread(target=client_loop, args=('write', readers + i)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return {role: _stats.summarize(results[role], seconds, errors[role]) for role in results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _django.setup()
+        print(json.dumps(run_workload(args.readers, args.writers, args.seconds)))
+        return
+
+    results = {}
+    for name, tuning in [('defaults', '0'), ('tuned', '1')]:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.sqlite_tuning', '--worker',
+             '--readers', str(args.readers), '--writers', str(args.writers), '--seconds', str(args.seconds)],
+            env={**os.environ, 'SQLITE_TUNING': tuning},
+            check=True, capture_output=True, text=True,
+        ).stdout
+        for role, summary in json.loads(output.strip().splitlines()[-1]).items():
+            results[f'{name} {role}'] = summary
+    _stats.print_table(results)
+    if args.json:
+        _stats.write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
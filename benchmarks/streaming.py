@@ -0,0 +1,94 @@
+"""
+Large catalog pages, rendered whole against streamed (CATALOG_STREAMING).
+
+    python -m benchmarks.streaming [--products 5000] [--page-size 2000] [--requests 20] [--json out.json]
+
+Starts one worker of each deployment of benchmarks.asgi_load, once with
+streaming off and once on, and requests the first --page-size products
+--requests times, one request at a time, each with a query string of its
+own so none is answered from the page cache. Reports the time to the first
+byte of the response ("ttfb"), to the last ("total"), and the worker's
+peak resident memory once the run is over.
+"""
+import argparse
+import socket
+import time
+from pathlib import Path
+
+from benchmarks import _django, _server, _stats
+from benchmarks.asgi_load import DEPLOYMENTS
+
+
+def timed_get(port, path):
+    """
+    Returns (seconds to the first byte, seconds to the last, bytes) of one
+    GET request.
+    """
+    start = time.perf_counter()
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n'.encode())
+        first, received = None, 0
+        while data := sock.recv(65536):
+            if first is None:
+                first = time.perf_counter() - start
+                if not data.startswith(b'HTTP/1.1 200'):
+                    raise RuntimeError(f'{path}: {data.splitlines()[0].decode()}')
+            received += len(data)
+    return first, time.perf_counter() - start, received
+
+
+def worker_peak_rss(server):
+    """
+    Returns the largest peak resident set size, in KiB, of server's worker
+    processes.
+    """
+    children = Path(f'/proc/{server.pid}/task/{server.pid}/children').read_text().split()
+    peaks = []
+    for pid in children:
+        for line in Path(f'/proc/{pid}/status').read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                peaks.append(int(line.split()[1]))
+    return max(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--page-size', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    db_path = _django.setup_seeded(args.products)
+    results, peaks, sizes = {}, {}, {}
+    for name, command in DEPLOYMENTS.items():
+        for streaming in ('0', '1'):
+            label = f'{name}, {"streamed" if streaming == "1" else "rendered"}'
+            port = _server.free_port()
+            server = _server.start_server(
+                command, 1, port, db_path,
+                CATALOG_STREAMING=streaming, CATALOG_MAX_PAGE_SIZE=str(args.page_size),
+            )
+            try:
+                runs = [
+                    timed_get(port, f'/?page_size={args.page_size}&run={index}')
+                    for index in range(args.requests)
+                ]
+                peaks[label] = worker_peak_rss(server)
+            finally:
+                _server.stop_server(server)
+            elapsed = sum(total for _, total, _ in runs)
+            results[f'{label} ttfb'] = _stats.summarize([first for first, _, _ in runs], elapsed)
+            results[f'{label} total'] = _stats.summarize([total for _, total, _ in runs], elapsed)
+            sizes[label] = runs[-1][2]
+
+    _stats.print_table(results, columns=('p50_ms', 'p95_ms', 'max_ms', 'errors'))
+    print(f'\nWorker peak RSS after {args.requests} pages of {args.page_size} products:')
+    for label, peak in peaks.items():
+        print(f'  {label:32} {peak / 1024:8.1f} MiB  ({sizes[label] / 1024:.0f} KiB per page)')
+    if args.json:
+        _stats.write_json(args.json, {**results, 'peak_rss_kib': peaks})
+
+
+if __name__ == '__main__':
+    main()
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecom_demo.settings')
+# Serve the async catalog and cart views, which do not tie up a thread
+# while they wait on the database or a slow client.
+os.environ.setdefault('ROOT_URLCONF', 'ecom_demo.async_urls')
+# Async views run their queries in sync_to_async threads, and Django only
+# closes a connection at the end of a request in the thread that ran the
+# request, so persistent connections would pile up in those threads.
+os.environ['CONN_MAX_AGE'] = '0'
 
 application = get_asgi_application()
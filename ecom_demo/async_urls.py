@@ -0,0 +1,15 @@
+"""
+URL configuration used under ASGI (see ecom_demo/asgi.py): the same routes
+as ecom_demo.urls, with the products app served by its async views.
+"""
+from django.apps import apps
+from django.urls import path,include
+
+urlpatterns = [
+    path('', include('products.async_urls')),
+]
+
+# Storefront workers (ecom_demo.settings_storefront) run without the admin.
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
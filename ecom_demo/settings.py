@@ -12,14 +12,17 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# python-dotenv is only imported when there is a .env file to read, so
+# deployments configured through real environment variables start faster.
+if (BASE_DIR / '.env').exists():
+    from dotenv import load_dotenv
+    load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -46,8 +49,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'products.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'products.middleware.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'products.middleware.CartMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -55,14 +61,25 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'ecom_demo.urls'
+# ecom_demo/asgi.py switches this to ecom_demo.async_urls, so ASGI servers
+# get the async views and WSGI servers the sync ones.
+ROOT_URLCONF = os.getenv('ROOT_URLCONF', 'ecom_demo.urls')
 
+# Templates are compiled once per process by the cached loader and reused
+# for every render, with or without DEBUG. Under DEBUG the runserver
+# autoreloader still clears it when a template file changes.
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for products.metrics.
+        'BACKEND': 'products.metrics.TimedDjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
@@ -78,13 +95,124 @@ WSGI_APPLICATION = 'ecom_demo.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+#
+# SQLite is tuned for a web workload when each connection opens: WAL lets
+# readers proceed while a writer holds the lock, synchronous=NORMAL is safe
+# under WAL and avoids an fsync per commit, and the mmap and page cache sizes
+# keep hot pages in memory. Write transactions take the write lock when they
+# begin (IMMEDIATE), so they wait in the busy handler instead of failing on a
+# lock upgrade, and connections are kept open between requests.
+# Set SQLITE_TUNING=0 to fall back to SQLite's defaults.
+
+SQLITE_PRAGMAS = {
+    # Only takes effect on a new, empty database; lets collect_garbage
+    # return freed pages to the file system without a blocking VACUUM.
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative means KiB: 64 MiB
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv('DATABASE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+if os.getenv('SQLITE_TUNING', '1') != '0':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+            # Seconds a connection waits on a locked database before raising.
+            'timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', 10)),
+        },
+    })
+
+# Read replica
+# With DATABASE_REPLICA_PATH set, catalog reads (REPLICA_READ_MODELS) go to a
+# second SQLite file kept up to date by `manage.py sync_replica`, while
+# sessions, carts and admin writes stay on the primary. After writing a
+# replicated model, a client reads from the primary for
+# REPLICA_STICKY_SECONDS.
+
+READ_REPLICA_ALIAS = None
+
+if os.getenv('DATABASE_REPLICA_PATH'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DATABASE_REPLICA_PATH'),
+        'TEST': {'MIRROR': 'default'},
+    }
+    READ_REPLICA_ALIAS = 'replica'
+
+DATABASE_ROUTERS = ['products.routers.PrimaryReplicaRouter']
+REPLICA_READ_MODELS = ['products.Product']
+REPLICA_STICKY_SECONDS = 15
+REPLICA_STICKY_COOKIE_NAME = 'read_primary_until'
+
+# Retries for writes that still find the database locked after the busy
+# timeout; see products.db.retry_on_lock.
+DATABASE_LOCK_RETRIES = 3
+DATABASE_LOCK_RETRY_BACKOFF = 0.05
+
+SESSION_ENGINE = 'products.sessions'
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# Rendered catalog pages and fragments live in the 'catalog' cache. The
+# default local-memory backend is private to each worker process; set
+# CATALOG_CACHE=file to share one cache directory between gunicorn workers.
+
+CATALOG_CACHE_ALIAS = 'catalog'
+
+# The catalog version that cache keys carry, bumped by every product change,
+# lives in this file so that all workers share it whatever their cache
+# backend. Every process serving the database must see the same file.
+CATALOG_VERSION_PATH = os.getenv('CATALOG_VERSION_PATH', f"{DATABASES['default']['NAME']}.catalog-version")
+# Likewise for the set of stock-tracked products, which changes far less often.
+STOCK_VERSION_PATH = os.getenv('STOCK_VERSION_PATH', f"{DATABASES['default']['NAME']}.stock-version")
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        # Entries are never stale (keys carry the catalog version); the
+        # timeout only reclaims space held by superseded versions.
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+if os.getenv('CATALOG_CACHE') == 'file':
+    CACHES['catalog'].update({
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CATALOG_CACHE_DIR', str(BASE_DIR / '.cache' / 'catalog')),
+    })
+
+# Carts, when CART_STORAGE is 'cache'. Must be shared by all workers, so
+# local memory is only suitable for a single process.
+CACHES['carts'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'carts',
+}
+
+if os.getenv('CART_CACHE') == 'file':
+    CACHES['carts'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CART_CACHE_DIR', str(BASE_DIR / '.cache' / 'carts')),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -121,12 +249,135 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = os.getenv('STATIC_ROOT', BASE_DIR / 'staticfiles')
 # STATICFILES_DIRS = [
 #     BASE_DIR / 'static',
 # ]
 
+# Uploaded and generated files; product images are resized into
+# MEDIA_ROOT/images/ (see products.images).
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', BASE_DIR / 'media')
+
+# collectstatic writes content-hashed names (site.<hash>.css) that can be
+# cached forever, plus .gz/.br copies for the web server to serve as is.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'products.storage.CompressedManifestStaticFilesStorage'},
+}
+
+# products/static/products/css/site.css is generated from the templates by
+# `manage.py build_css`; `build_css --check` fails past this size.
+CSS_BUDGET_BYTES = 16 * 1024
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Catalog
+# Page sizes for the keyset-paginated product list, and how much of each
+# description the product grid loads.
+
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', 24))
+CATALOG_MAX_PAGE_SIZE = int(os.getenv('CATALOG_MAX_PAGE_SIZE', 96))
+CATALOG_DESCRIPTION_CHARS = 160
+
+# With CATALOG_STREAMING, a catalog page missing from the page cache is
+# streamed: the page shell is sent at once, then the product cards in
+# chunks of CATALOG_STREAM_CHUNK_SIZE as they are read from the database.
+# Useful with a large CATALOG_MAX_PAGE_SIZE.
+CATALOG_STREAMING = os.getenv('CATALOG_STREAMING', '0') != '0'
+CATALOG_STREAM_CHUNK_SIZE = int(os.getenv('CATALOG_STREAM_CHUNK_SIZE', 24))
+
+# How long browsers and shared caches may reuse a catalog page before
+# revalidating it with its ETag. Revalidation is answered with a 304 without
+# rendering, so the default of 0 (always revalidate) is already cheap.
+CATALOG_MAX_AGE = int(os.getenv('CATALOG_MAX_AGE', 0))
+
+
+# JSON catalog API (/api/products/, see products.api): products per page
+# by default and at most, which also bounds the ids of a batch lookup.
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', 100))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 5000))
+
+
+# Product images
+# Each product's image_url is downloaded and resized to these widths, in
+# WebP and JPEG, by `manage.py ingest_images`, `import_products --images`
+# and, with PRODUCT_IMAGE_INGEST_ON_SAVE, when a product's image changes.
+# Pages then load the smallest copy that fills each slot (srcset). Needs
+# Pillow.
+
+PRODUCT_IMAGE_WIDTHS = [64, 400, 600]
+PRODUCT_IMAGE_MAX_BYTES = 20 * 1024 * 1024
+PRODUCT_IMAGE_INGEST_ON_SAVE = os.getenv('PRODUCT_IMAGE_INGEST_ON_SAVE', '1') != '0'
+
+
+# Cart
+# CART_STORAGE picks where carts live: 'session' (the session backend, the
+# database by default), 'cookie' (a signed, compressed cookie, falling back
+# to the session for carts too large for one) or 'cache' (the 'carts' cache,
+# written behind to the session every CART_WRITE_BEHIND_SECONDS) or
+# 'database' (the Cart and CartItem tables, owned by the user or session,
+# updated line by line). A dotted path to a
+# products.cart_storage.CartStorage subclass also works.
+
+CART_STORAGE_BACKENDS = {
+    'session': 'products.cart_storage.SessionCartStorage',
+    'cookie': 'products.cart_storage.SignedCookieCartStorage',
+    'cache': 'products.cart_storage.CacheCartStorage',
+    'database': 'products.cart_storage.DatabaseCartStorage',
+}
+CART_STORAGE = os.getenv('CART_STORAGE', 'session')
+CART_STORAGE = CART_STORAGE_BACKENDS.get(CART_STORAGE, CART_STORAGE)
+
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_MAX_BYTES = 3800
+CART_CACHE_ALIAS = 'carts'
+CART_WRITE_BEHIND_SECONDS = float(os.getenv('CART_WRITE_BEHIND_SECONDS', 2))
+
+CART_BATCH_MAX_OPERATIONS = 100
+# The largest quantity one batch operation may set or add.
+CART_BATCH_MAX_QUANTITY = 1000
+
+# Database carts (CART_STORAGE='database') untouched for this long are
+# deleted by `manage.py collect_garbage`, as are carts whose session expired.
+CART_ABANDONED_DAYS = int(os.getenv('CART_ABANDONED_DAYS', 30))
+
+# Stock-tracked products put in a cart are reserved for it for this long
+# after the cart last changed or was viewed (see products.inventory).
+# `manage.py collect_garbage` returns expired reservations to stock.
+STOCK_RESERVATION_SECONDS = int(os.getenv('STOCK_RESERVATION_SECONDS', 15 * 60))
+
+
+# Jobs
+# Work queued by checkout (see products.jobs) is run by `manage.py run_jobs`.
+# A claimed job is leased to its worker for JOB_LEASE_SECONDS; a job that
+# fails is retried after JOB_RETRY_BACKOFF seconds, doubling each time, up to
+# JOB_MAX_ATTEMPTS attempts. Finished jobs are deleted by
+# `manage.py collect_garbage` after JOB_RETENTION_HOURS.
+
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 5 * 60))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_BACKOFF = float(os.getenv('JOB_RETRY_BACKOFF', 10))
+JOB_RETENTION_HOURS = int(os.getenv('JOB_RETENTION_HOURS', 24))
+
+# Order confirmations are printed to the worker's console unless another
+# backend is configured.
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'shop@localhost')
+
+
+# Metrics
+# PerformanceMiddleware keeps per-view histograms of request time, queries,
+# template rendering and session saves in each process. They are served at
+# /metrics to staff users, or to scrapers sending "Authorization: Bearer
+# <METRICS_TOKEN>". A request running one SQL statement
+# METRICS_N_PLUS_ONE_THRESHOLD times or more is logged as a likely N+1.
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_N_PLUS_ONE_THRESHOLD = int(os.getenv('METRICS_N_PLUS_ONE_THRESHOLD', 10))
+SERVER_TIMING = os.getenv('SERVER_TIMING', '1') != '0'
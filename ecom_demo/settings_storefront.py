@@ -0,0 +1,37 @@
+"""
+Settings for the public storefront workers: ecom_demo.settings without the
+admin, flash messages or per-request user lookup, none of which the
+catalog, cart or metrics views use. Workers boot faster and each request
+skips the authentication and messages middleware.
+
+    DJANGO_SETTINGS_MODULE=ecom_demo.settings_storefront gunicorn ecom_demo.wsgi:application
+
+Serve /admin/ from a separate, small pool of workers on ecom_demo.settings.
+Storefront requests are anonymous, so database carts (CART_STORAGE=database)
+are always keyed by session here.
+"""
+from .settings import *  # noqa: F401,F403
+
+# The auth and contenttypes apps stay installed for their models (carts
+# may belong to a user); only their request-time parts are dropped.
+STOREFRONT_EXCLUDED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.messages',
+]
+STOREFRONT_EXCLUDED_MIDDLEWARE = [
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+]
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in STOREFRONT_EXCLUDED_APPS]
+MIDDLEWARE = [name for name in MIDDLEWARE if name not in STOREFRONT_EXCLUDED_MIDDLEWARE]
+
+# Copied rather than edited in place, so ecom_demo.settings is unchanged
+# when both modules are imported in one process.
+TEMPLATES = [{
+    **TEMPLATES[0],
+    'OPTIONS': {
+        **TEMPLATES[0]['OPTIONS'],
+        'context_processors': ['django.template.context_processors.request'],
+    },
+}]
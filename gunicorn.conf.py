@@ -0,0 +1,28 @@
+"""
+gunicorn settings, read by any `gunicorn` started in this directory.
+
+The application is imported once in the master (preload_app) and warmed
+there by products.boot.warm, then the garbage collector's view of the heap
+is frozen before workers are forked. New workers start serving at once,
+and they share the master's memory instead of each building their own
+copy. Set GUNICORN_PRELOAD=0 to load the application in each worker
+instead, for example to pick up code changes with a HUP.
+
+Worker count and class come from the command line (or WEB_CONCURRENCY).
+"""
+import gc
+import os
+
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    from products.boot import warm
+    timings = warm()
+    server.log.info('Warmed the application in %.0f ms', sum(timings.values()) * 1000)
+    # Objects that survive start-up are never collected; freezing them keeps
+    # collections in the workers from writing to (and so copying) their pages.
+    gc.collect()
+    gc.freeze()
@@ -1,11 +1,19 @@
 from django.contrib import admin
 from .models import Product
+from .search import matching_products
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     """
     Admin configuration for the Product model.
     """
-    list_display = ('name', 'price', 'description')
+    list_display = ('name', 'sku', 'price', 'description')
     search_fields = ('name',)
     list_filter = ('price',)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Searches names and descriptions through the full-text index instead
+        of a LIKE scan of every row.
+        """
+        return matching_products(queryset, search_term), False
@@ -0,0 +1,140 @@
+"""
+The read-only JSON catalog API, /api/products/.
+
+    /api/products/?fields=id,name,price&sort=price&page_size=1000&cursor=...
+    /api/products/?ids=3,1,2&fields=id,name
+
+A page walks the catalog with the same keyset cursors as the product list
+and returns {"results": [...], "next": cursor, "previous": cursor}; ids
+fetches up to API_MAX_PAGE_SIZE products by id in one query and returns
+{"results": [...]} in the order asked, without the ids that do not exist.
+fields picks the columns read from the database and sent (API_FIELDS,
+API_DEFAULT_FIELDS by default).
+
+Rows are read with values_list() and serialized from the tuples, so no
+Product is ever instantiated.
+"""
+import json
+
+from django.conf import settings
+
+from .models import Product
+from .pagination import ORDERINGS, KeysetPaginator, get_page_size
+
+API_FIELDS = ('id', 'sku', 'name', 'description', 'price', 'image_url', 'updated_at')
+API_DEFAULT_FIELDS = ('id', 'sku', 'name', 'price', 'image_url')
+
+# How values of the fields that are not JSON types are written.
+_ENCODERS = {
+    'price': str,
+    'updated_at': lambda value: value.isoformat(),
+}
+
+
+class InvalidQuery(ValueError):
+    """
+    Raised for query-string parameters the API cannot serve.
+    """
+
+
+class ProductQuery:
+    """
+    A parsed API request: the fields to send, and either ids to fetch or the
+    ordering, page size and cursor of a page.
+    """
+    def __init__(self, fields, ids=None, ordering=None, page_size=None, cursor=None):
+        self.fields = fields
+        self.ids = ids
+        self.ordering = ordering
+        self.page_size = page_size
+        self.cursor = cursor
+
+    @classmethod
+    def parse(cls, params):
+        """
+        Reads a ProductQuery from a QueryDict. Raises InvalidQuery.
+        """
+        fields = API_DEFAULT_FIELDS
+        if params.get('fields'):
+            fields = tuple(dict.fromkeys(name.strip() for name in params['fields'].split(',') if name.strip()))
+            unknown = [name for name in fields if name not in API_FIELDS]
+            if unknown or not fields:
+                raise InvalidQuery(f'fields must be a comma-separated list of {", ".join(API_FIELDS)}')
+
+        if 'ids' in params:
+            try:
+                ids = list(dict.fromkeys(int(pk) for pk in params['ids'].split(',')))
+            except ValueError:
+                raise InvalidQuery('ids must be a comma-separated list of integers')
+            if len(ids) > settings.API_MAX_PAGE_SIZE:
+                raise InvalidQuery(f'At most {settings.API_MAX_PAGE_SIZE} ids per request')
+            return cls(fields, ids=ids)
+
+        ordering = params.get('sort') or 'name'
+        if ordering not in ORDERINGS:
+            raise InvalidQuery(f'sort must be one of {", ".join(ORDERINGS)}')
+        page_size = get_page_size(params.get('page_size'), settings.API_PAGE_SIZE, settings.API_MAX_PAGE_SIZE)
+        return cls(fields, ordering=ordering, page_size=page_size, cursor=params.get('cursor'))
+
+    def _columns(self):
+        # The rows of a page also carry its sort key, after the fields sent.
+        if self.ids is not None:
+            return self.fields if 'id' in self.fields else (*self.fields, 'id')
+        field, _ = ORDERINGS[self.ordering]
+        return (*self.fields, *(name for name in (field, 'id') if name not in self.fields))
+
+    def _paginator(self, columns):
+        field, _ = ORDERINGS[self.ordering]
+        key_index = columns.index(field), columns.index('id')
+        return KeysetPaginator(
+            Product.objects.values_list(*columns), self.ordering, self.page_size,
+            key=lambda row: (row[key_index[0]], row[key_index[1]]),
+        )
+
+    def _ids_queryset(self, columns):
+        return Product.objects.filter(pk__in=self.ids).values_list(*columns)
+
+    def _ids_body(self, rows, columns):
+        id_index = columns.index('id')
+        by_id = {row[id_index]: row for row in rows}
+        return self.encode([by_id[pk] for pk in self.ids if pk in by_id])
+
+    def body(self):
+        """
+        Returns the JSON response body. Raises InvalidCursor.
+        """
+        columns = self._columns()
+        if self.ids is not None:
+            return self._ids_body(self._ids_queryset(columns), columns)
+        page = self._paginator(columns).page(self.cursor)
+        return self.encode(page.items, page)
+
+    async def abody(self):
+        """
+        Async version of body().
+        """
+        columns = self._columns()
+        if self.ids is not None:
+            return self._ids_body([row async for row in self._ids_queryset(columns)], columns)
+        page = await self._paginator(columns).apage(self.cursor)
+        return self.encode(page.items, page)
+
+    def encode(self, rows, page=None):
+        """
+        Serializes value rows, whose first columns are self.fields, and the
+        cursors of page if given.
+        """
+        fields = self.fields
+        encoders = [(index, _ENCODERS[name]) for index, name in enumerate(fields) if name in _ENCODERS]
+        results = []
+        for row in rows:
+            values = list(row[:len(fields)])
+            for index, encode in encoders:
+                if values[index] is not None:
+                    values[index] = encode(values[index])
+            results.append(dict(zip(fields, values)))
+        data = {'results': results}
+        if page is not None:
+            data['next'] = page.next_cursor
+            data['previous'] = page.previous_cursor
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'products'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+        from . import metrics, signals
+        # Also covers databases built without running migrations, such as
+        # the test database.
+        post_migrate.connect(signals.install_search_index, sender=self)
+        connection_created.connect(metrics.install_query_timer)
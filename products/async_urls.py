@@ -0,0 +1,21 @@
+from django.urls import path
+from . import async_views, views
+
+# The same routes as products.urls, with the catalog and cart views swapped
+# for their async versions.
+urlpatterns = [
+    path('', async_views.product_list, name='product_list'),
+    path('search/', async_views.search, name='search'),
+    path('product/<int:pk>/', async_views.product_detail, name='product_detail'),
+    path('add_to_cart/<int:pk>/', async_views.add_to_cart, name='add_to_cart'),
+    path('update_cart_quantity/<int:product_id>/', async_views.update_cart_quantity, name='update_cart_quantity'),
+    path('remove_from_cart/<int:product_id>/', async_views.remove_from_cart, name='remove_from_cart'),
+    path('cart/', async_views.view_cart, name='view_cart'),
+    path('cart/batch/', async_views.cart_batch, name='cart_batch'),
+    path('cart/checkout/', async_views.checkout, name='checkout'),
+    path('orders/<uuid:number>/', async_views.order_detail, name='order_detail'),
+    path('api/products/', async_views.product_api, name='product_api'),
+    path('csrf/', views.csrf_token, name='csrf_token'),
+    path('metrics', views.metrics, name='metrics'),
+    path('media/<path:name>', views.product_image, name='product_image'),
+]
@@ -0,0 +1,275 @@
+"""
+Async versions of the catalog and cart views, served by ecom_demo.async_urls
+under ASGI.
+
+They behave like the views in products.views but wait on the database,
+cache and session without holding a thread, so a worker can keep many slow
+connections open at once. Template rendering and the few calls with no
+async equivalent run in a thread via sync_to_async.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.shortcuts import aget_object_or_404, redirect
+from django.template import Engine
+from django.template.loader import render_to_string
+from django.template.response import TemplateResponse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_safe
+
+from .api import InvalidQuery, ProductQuery
+from .cache import CatalogStream, aget_or_set_catalog_value, cache_catalog_page, conditional_catalog_page
+from .cart import CartError, OutOfStock, aadd_product, aapply_operation, aget_cart, undo_holds
+from .inventory import hold_cart
+from .models import Order, Product
+from .pagination import InvalidCursor, KeysetPaginator, get_page_size
+from .search import search_product_ids
+from .templatetags.catalog_cache import render_cards
+from .views import (
+    _api_error, _catalog_shell, _checkout_error, _checkout_form, _checkout_params, _checkout_response, _grid_products,
+    _order_context, _parse_batch, _place_order, _product_last_modified,
+)
+
+
+async def _stream_product_list(request, stream, context):
+    """
+    Async version of views._stream_product_list.
+    """
+    head, middle, tail = await sync_to_async(_catalog_shell)(request, context)
+    yield head
+    engine = Engine.get_default()
+    products = []
+    empty = True
+    async for product in stream:
+        products.append(product)
+        if len(products) == stream.chunk_size:
+            empty = False
+            yield await sync_to_async(render_cards)(products, engine)
+            products = []
+    if products:
+        yield await sync_to_async(render_cards)(products, engine)
+    elif empty:
+        yield await sync_to_async(render_to_string)('products/_catalog_empty.html')
+    yield middle
+    yield await sync_to_async(render_to_string)('products/_catalog_pagination.html', {'page': stream.page}, request)
+    yield tail
+
+@conditional_catalog_page()
+@cache_catalog_page
+async def product_list(request):
+    """
+    Displays one keyset-paginated page of the catalog. With
+    CATALOG_STREAMING, forward pages are streamed as they render.
+    """
+    paginator = KeysetPaginator(
+        _grid_products(),
+        ordering=request.GET.get('sort'),
+        page_size=get_page_size(request.GET.get('page_size')),
+    )
+    cursor = request.GET.get('cursor')
+    context = {'sort': paginator.ordering}
+    try:
+        if settings.CATALOG_STREAMING:
+            stream = paginator.stream(cursor, chunk_size=settings.CATALOG_STREAM_CHUNK_SIZE)
+            if stream is not None:
+                return CatalogStream(request, _stream_product_list(request, stream, context))
+        page = await paginator.apage(cursor)
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor')
+    return TemplateResponse(request, 'products/product_list.html', {
+        **context,
+        'products': page.items,
+        'page': page,
+    })
+
+@require_safe
+@gzip_page
+@conditional_catalog_page()
+async def product_api(request):
+    """
+    Serves a page of the catalog, or the products listed in ?ids=, as JSON;
+    see products.views.product_api.
+    """
+    try:
+        query = ProductQuery.parse(request.GET)
+        body = await aget_or_set_catalog_value('api', [request.get_full_path()], query.abody)
+    except (InvalidQuery, InvalidCursor) as e:
+        return _api_error(str(e))
+    return HttpResponse(body, content_type='application/json')
+
+@conditional_catalog_page(_product_last_modified)
+@cache_catalog_page
+async def product_detail(request, pk):
+    """
+    Displays the details of a single product.
+    """
+    product = await aget_object_or_404(Product, pk=pk)
+    return TemplateResponse(request, 'products/product_detail.html', {'product': product})
+
+@conditional_catalog_page()
+@cache_catalog_page
+async def search(request):
+    """
+    Displays products matching the q parameter, best matches first, one
+    numbered page at a time.
+    """
+    query = request.GET.get('q', '').strip()
+    page_size = get_page_size(request.GET.get('page_size'))
+    try:
+        page_number = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page_number = 1
+    ids = []
+    if query:
+        # The ranked lookup is raw SQL on a cursor, which has no async API.
+        ids = await sync_to_async(search_product_ids)(query, page_size + 1, (page_number - 1) * page_size)
+    products = await _grid_products().ain_bulk(ids[:page_size])
+    return TemplateResponse(request, 'products/search.html', {
+        'query': query,
+        'products': [products[pk] for pk in ids[:page_size] if pk in products],
+        'page_number': page_number,
+        'has_previous': page_number > 1,
+        'has_next': len(ids) > page_size,
+    })
+
+
+@never_cache
+async def add_to_cart(request, pk):
+    """
+    Adds a specified product to the user's shopping cart.
+    If the product is already in the cart, its quantity is increased.
+    """
+    cart = await aget_cart(request)
+    try:
+        _, name = await aadd_product(cart, pk)
+    except Product.DoesNotExist:
+        raise Http404('No Product matches the given query.')
+    except OutOfStock as e:
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=e.status_code)
+        return HttpResponse(str(e), status=e.status_code, content_type='text/plain; charset=utf-8')
+    cart.save()
+
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        if name is None:
+            # Already in the cart, so aadd_product() did not read it.
+            name = await Product.objects.values_list('name', flat=True).aget(pk=pk)
+        return JsonResponse({'status': 'success', 'message': f'{name} added to cart!', **cart.totals.as_json()})
+    return redirect('view_cart')
+
+@never_cache
+async def view_cart(request):
+    """
+    Displays the contents of the user's shopping cart.
+    """
+    cart = await aget_cart(request)
+    cart_items = await cart.alines()
+    short = await sync_to_async(hold_cart)(cart)
+    for line in cart_items:
+        line.available = short.get(line.product_id)
+    return TemplateResponse(request, 'products/cart.html', {
+        'cart_items': cart_items,
+        'totals': cart.totals,
+        'total_price': cart.totals.total_price,
+        **await sync_to_async(_checkout_form)(request),
+    })
+
+@never_cache
+async def checkout(request):
+    """
+    Places an order for the cart; see products.views.checkout.
+    """
+    if not request.method == 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
+
+    # Both may load request.user.
+    key, email, error = await sync_to_async(_checkout_params)(request)
+    if error:
+        return _checkout_error(request, error, 400)
+    await aget_cart(request)
+    try:
+        order, created = await sync_to_async(_place_order)(request, key, email)
+    except CartError as e:
+        return _checkout_error(request, str(e), e.status_code)
+    return _checkout_response(request, order, created)
+
+@never_cache
+async def order_detail(request, number):
+    """
+    Shows a placed order to the customer who placed it.
+    """
+    order = await aget_object_or_404(Order, number=number)
+    return TemplateResponse(request, 'products/order.html', await sync_to_async(_order_context)(request, order))
+
+@never_cache
+async def update_cart_quantity(request, product_id):
+    """Handle quantity updates via AJAX"""
+    if not request.method == 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
+
+    action = request.POST.get('action')
+    if action not in ('increase', 'decrease'):
+        return JsonResponse({'status': 'error', 'message': 'Invalid action'}, status=400)
+
+    cart = await aget_cart(request)
+    try:
+        new_quantity = await aapply_operation(cart, action, product_id)
+    except CartError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=e.status_code)
+    cart.save()
+
+    response = {'status': 'success', 'new_quantity': new_quantity, **cart.totals.as_json()}
+    if new_quantity:
+        response['new_subtotal'] = float(cart.line_subtotal(product_id))
+    return JsonResponse(response)
+
+@never_cache
+async def remove_from_cart(request, product_id):
+    """Handle item removal via AJAX"""
+    if not request.method == 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
+
+    cart = await aget_cart(request)
+    try:
+        await aapply_operation(cart, 'remove', product_id)
+    except CartError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=e.status_code)
+    cart.save()
+
+    return JsonResponse({'status': 'success', **cart.totals.as_json()})
+
+@never_cache
+async def cart_batch(request):
+    """
+    Applies a JSON list of cart operations in one request; see
+    products.views.cart_batch.
+    """
+    if not request.method == 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
+
+    operations, error = _parse_batch(request.body)
+    if error:
+        return JsonResponse({'status': 'error', 'message': error}, status=400)
+
+    cart = await aget_cart(request)
+    # Loading may already have marked the cart to be saved (repriced or
+    # migrated), so a failed batch goes back to this state rather than just
+    # skipping cart.save().
+    checkpoint = cart.checkpoint()
+    results = []
+    for index, (op, product_id, quantity) in enumerate(operations):
+        try:
+            new_quantity = await aapply_operation(cart, op, product_id, quantity)
+        except CartError as e:
+            await sync_to_async(undo_holds)(cart)
+            cart.rollback(checkpoint)
+            return JsonResponse({'status': 'error', 'message': str(e), 'index': index}, status=e.status_code)
+        results.append({'product_id': product_id, 'new_quantity': new_quantity})
+
+    cart.save()
+
+    for result in results:
+        if result['product_id'] in cart:
+            result['new_subtotal'] = float(cart.line_subtotal(result['product_id']))
+    return JsonResponse({'status': 'success', 'results': results, **cart.totals.as_json()})
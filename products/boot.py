@@ -0,0 +1,120 @@
+"""
+Start-up work done once, in the gunicorn master, before workers are forked.
+
+With preload_app (see gunicorn.conf.py) the master imports the application
+and calls warm(), so every worker starts with its URL resolvers built, its
+templates compiled and the first catalog page cached, and shares that
+memory with the master copy-on-write instead of building its own copy on
+its first requests.
+"""
+import logging
+import time
+import warnings
+from pathlib import Path
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.template.utils import get_app_template_dirs
+from django.urls import get_resolver, resolve, reverse
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def warm_urls():
+    """
+    Builds the URL resolvers, importing every view on the way.
+    """
+    resolver = get_resolver()
+    # Reading reverse_dict populates the resolver and the ones it includes.
+    resolver.reverse_dict
+    resolve(reverse('product_list'))
+    return len(resolver.reverse_dict)
+
+
+def template_names():
+    """
+    Yields the name of every template in the template directories.
+    """
+    for engine in engines.all():
+        directories = [*engine.dirs, *get_app_template_dirs('templates')]
+        for directory in map(Path, directories):
+            for path in sorted(directory.rglob('*.html')):
+                yield engine, path.relative_to(directory).as_posix()
+
+
+def warm_templates():
+    """
+    Compiles every template into the cached template loader.
+    """
+    compiled = 0
+    for engine, name in template_names():
+        try:
+            engine.get_template(name)
+        except (TemplateDoesNotExist, TemplateSyntaxError):
+            # Partials of other engines or apps, not servable on their own.
+            logger.debug('Not warming template %s', name, exc_info=True)
+        else:
+            compiled += 1
+    return compiled
+
+
+def _warm_host():
+    for host in settings.ALLOWED_HOSTS:
+        host = host.lstrip('.')
+        if host and host != '*':
+            return host
+    return 'localhost'
+
+
+def warm_catalog(paths=None):
+    """
+    Requests the catalog pages at paths (the first page by default) through
+    the whole middleware stack, leaving them in the catalog cache. Returns
+    {path: status code}.
+    """
+    from django.core.handlers.wsgi import WSGIHandler
+    handler = WSGIHandler()
+    statuses = {}
+    for path in paths or [reverse('product_list')]:
+        path, _, query = path.partition('?')
+        environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'HTTP_HOST': _warm_host()}
+        setup_testing_defaults(environ)
+        status = []
+        with warnings.catch_warnings():
+            # Async views stream async iterators, which a WSGIHandler reads
+            # with a warning; served under ASGI they are not.
+            warnings.filterwarnings('ignore', 'StreamingHttpResponse must consume asynchronous iterators')
+            response = handler(environ, lambda code, headers, exc_info=None: status.append(code))
+            b''.join(response)
+        response.close()
+        code = statuses[path + (f'?{query}' if query else '')] = int(status[0].split()[0])
+        if code != 200:
+            logger.warning('Warming %s returned %s', path, code)
+    return statuses
+
+
+def warm(catalog=True):
+    """
+    Does the per-process start-up work ahead of time and returns how long
+    each step took, in seconds. Database connections are closed afterwards,
+    as they must not be shared with forked workers, and the metrics of the
+    warm-up requests are discarded.
+    """
+    timings = {}
+    steps = [('urls', warm_urls), ('templates', warm_templates)]
+    if catalog:
+        steps.append(('catalog', warm_catalog))
+    try:
+        for name, step in steps:
+            start = time.perf_counter()
+            result = step()
+            timings[name] = time.perf_counter() - start
+            logger.info('Warmed %s in %.1f ms: %s', name, timings[name] * 1000, result)
+    finally:
+        connections.close_all()
+        metrics.reset()
+    return timings
@@ -0,0 +1,133 @@
+import csv
+import json
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import Product
+
+# Columns of an import or export file, in export order. sku is the natural
+# key rows are matched on.
+FIELDS = ('sku', 'name', 'description', 'price', 'image_url')
+REQUIRED_FIELDS = ('sku', 'name', 'price')
+FORMATS = ('csv', 'jsonl')
+
+
+class RowError(ValueError):
+    """
+    A row that cannot be imported; line is its line number in the source.
+    """
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+        self.message = message
+
+
+def guess_format(path):
+    return 'jsonl' if str(path).endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_rows(stream, format):
+    """
+    Yields (line_number, row) pairs from a CSV or JSON Lines text stream
+    without reading it all into memory. Rows that cannot be parsed are
+    yielded as RowError instances instead.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_number, RowError(line_number, f'invalid JSON ({exc})')
+            continue
+        if not isinstance(row, dict):
+            row = RowError(line_number, 'expected a JSON object')
+        yield line_number, row
+
+
+def clean_row(line, row):
+    """
+    Validates a parsed row against the Product fields and returns a dict of
+    field values. Raises RowError.
+    """
+    if isinstance(row, RowError):
+        raise row
+    values = {}
+    for name in FIELDS:
+        value = row.get(name)
+        if isinstance(value, str):
+            value = value.strip()
+        if value in (None, ''):
+            if name in REQUIRED_FIELDS:
+                raise RowError(line, f'{name} is required')
+            values[name] = '' if name == 'description' else None
+            continue
+        try:
+            values[name] = Product._meta.get_field(name).clean(value, None)
+        except ValidationError as exc:
+            raise RowError(line, f'{name}: {" ".join(exc.messages)}')
+    return values
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def upsert_batch(rows):
+    """
+    Creates or updates products from cleaned rows, matched by sku, in one
+    transaction. Products whose values are unchanged are not written.
+    Returns (created, updated).
+    """
+    # Later rows for the same sku win.
+    rows = {row['sku']: row for row in rows}
+    fields = [name for name in FIELDS if name != 'sku']
+    with transaction.atomic():
+        existing = Product.objects.in_bulk(rows, field_name='sku')
+        changed = []
+        for sku, product in existing.items():
+            row = rows[sku]
+            if any(getattr(product, name) != row[name] for name in fields):
+                for name in fields:
+                    setattr(product, name, row[name])
+                changed.append(product)
+        new = [Product(**row) for sku, row in rows.items() if sku not in existing]
+        Product.objects.bulk_create(new)
+        Product.objects.bulk_update(changed, fields)
+    return len(new), len(changed)
+
+
+def export_rows(queryset, chunk_size):
+    """
+    Yields products as dicts of FIELDS, streaming them from the database in
+    chunks of chunk_size rows.
+    """
+    for values in queryset.order_by('pk').values_list(*FIELDS).iterator(chunk_size=chunk_size):
+        yield dict(zip(FIELDS, values))
+
+
+def write_rows(stream, rows, format):
+    """
+    Writes dicts of FIELDS to a text stream as CSV or JSON Lines. Returns the
+    number of rows written.
+    """
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(stream, FIELDS)
+        writer.writeheader()
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)
+        return count
+    for count, row in enumerate(rows, 1):
+        row['price'] = str(row['price'])
+        stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+    return count
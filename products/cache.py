@@ -0,0 +1,365 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template.response import SimpleTemplateResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+class CacheStats:
+    """
+    Per-process hit and miss counters for the catalog cache, by namespace.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, namespace, hit):
+        with self._lock:
+            counts = self._counts.setdefault(namespace, {'hits': 0, 'misses': 0})
+            counts['hits' if hit else 'misses'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {namespace: dict(counts) for namespace, counts in self._counts.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+stats = CacheStats()
+
+
+# The catalog version is kept in a file (CATALOG_VERSION_PATH) rather than
+# in a cache, so that every process serving the database, whatever its cache
+# backend, sees a change made by any of them. It is the time of the last
+# bump, in microseconds, and is rewritten whole with an atomic rename; each
+# process rereads it only when the file was replaced since its last read.
+# STOCK_VERSION_PATH holds the version of the set of stock-tracked products
+# the same way.
+_versions_read = {}
+
+
+def _read_version(path):
+    try:
+        stat = os.stat(path)
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        read_key, version = _versions_read.get(str(path), (None, None))
+        if read_key == key:
+            return version
+        version = int(Path(path).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    _versions_read[str(path)] = (key, version)
+    return version
+
+
+def _write_version(path, version):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}')
+    temporary.write_text(str(version))
+    os.replace(temporary, path)
+    return version
+
+
+def shared_version(path):
+    """
+    Returns the version kept in the file at path, shared by every process
+    that sees the file, initialising it if it is missing.
+
+    Versions are taken from the clock so that if the file is ever lost the
+    numbering resumes above every version already handed out.
+    """
+    version = _read_version(path)
+    if version is None:
+        version = _write_version(path, time.time_ns() // 1000)
+    return version
+
+
+def bump_shared_version(path):
+    """
+    Moves the version kept in the file at path on, for every process.
+    """
+    return _write_version(path, max(shared_version(path) + 1, time.time_ns() // 1000))
+
+
+def catalog_version():
+    """
+    Returns the current catalog version, shared by every process through
+    CATALOG_VERSION_PATH.
+    """
+    return shared_version(settings.CATALOG_VERSION_PATH)
+
+
+def bump_catalog_version():
+    """
+    Invalidates every cached page and fragment, in every process, by moving
+    to a new catalog version.
+    """
+    return bump_shared_version(settings.CATALOG_VERSION_PATH)
+
+
+def catalog_last_modified():
+    """
+    Returns when the catalog version last moved on, as an aware datetime.
+    """
+    return datetime.fromtimestamp(catalog_version() / 1_000_000, timezone.utc)
+
+
+def schedule_catalog_bump(using=None):
+    """
+    Bumps the catalog version once the current transaction commits.
+
+    Bumping before the commit would let a concurrent request cache the old
+    rows under the new version, where they would never be invalidated.
+    """
+    transaction.on_commit(bump_catalog_version, using=using)
+
+
+def catalog_key(namespace, *parts, version=None):
+    """
+    Builds a cache key scoped to a catalog version.
+    """
+    if version is None:
+        version = catalog_version()
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'catalog:{version}:{namespace}:{digest}'
+
+
+def get_or_set_catalog_value(namespace, parts, compute):
+    """
+    Returns a cached value derived from the catalog, calling compute() to
+    produce it on a miss. None results are not cached.
+    """
+    cache = get_cache()
+    key = catalog_key(namespace, *parts)
+    value = cache.get(key)
+    stats.record(namespace, value is not None)
+    if value is None:
+        value = compute()
+        if value is not None:
+            cache.set(key, value)
+    return value
+
+
+async def aget_or_set_catalog_value(namespace, parts, compute):
+    """
+    Async version of get_or_set_catalog_value(); compute is a coroutine
+    function.
+    """
+    cache = get_cache()
+    key = await sync_to_async(catalog_key)(namespace, *parts)
+    value = await cache.aget(key)
+    stats.record(namespace, value is not None)
+    if value is None:
+        value = await compute()
+        if value is not None:
+            await cache.aset(key, value)
+    return value
+
+
+def get_or_render_fragment(namespace, parts, render):
+    """
+    Returns cached markup for a fragment, calling render() to produce it on a miss.
+    """
+    return get_or_set_catalog_value(namespace, parts, render)
+
+
+def _is_anonymous(request):
+    user = getattr(request, 'user', None)
+    return user is None or not user.is_authenticated
+
+
+async def _ais_anonymous(request):
+    # request.user would load the session synchronously.
+    auser = getattr(request, 'auser', None)
+    return auser is None or not (await auser()).is_authenticated
+
+
+def _is_cacheable(response):
+    return isinstance(response, SimpleTemplateResponse) and response.status_code == 200
+
+
+def _page_entry(response):
+    return response.content.decode(response.charset), response['Content-Type']
+
+
+class CatalogStream(StreamingHttpResponse):
+    """
+    A catalog page sent while it renders.
+
+    chunks is an iterator of markup, or an async iterator under ASGI. Once
+    the last chunk is sent, each of on_complete is called with the whole
+    page (after an async iterator, in a thread).
+    """
+    def __init__(self, request, chunks, **kwargs):
+        self.on_complete = []
+        if hasattr(chunks, '__aiter__'):
+            streaming_content = self._asend(chunks)
+        else:
+            streaming_content = self._send(chunks)
+        super().__init__(streaming_content, **kwargs)
+
+    def _send(self, chunks):
+        sent = []
+        for chunk in chunks:
+            sent.append(chunk)
+            yield chunk
+        content = ''.join(sent)
+        for callback in self.on_complete:
+            callback(content)
+
+    async def _asend(self, chunks):
+        sent = []
+        async for chunk in chunks:
+            sent.append(chunk)
+            yield chunk
+        content = ''.join(sent)
+        for callback in self.on_complete:
+            await sync_to_async(callback)(content)
+
+
+def _cache_when_sent(response, cache, key):
+    response.on_complete.append(lambda content: cache.set(key, (content, response['Content-Type'])))
+    return response
+
+
+def cache_catalog_page(view_func):
+    """
+    Caches the full response of a catalog view for anonymous GET requests.
+
+    The view must return an unrendered TemplateResponse, or a CatalogStream,
+    which is cached once it has been sent in full. Cached markup is the same
+    for every visitor, so catalog templates must not embed a CSRF token; see
+    the csrf_token view. Entries are keyed by
+    catalog version and full path, so a product change makes every cached
+    page unreachable at once instead of waiting for a timeout. Works on sync
+    and async views.
+    """
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not await _ais_anonymous(request):
+                return await view_func(request, *args, **kwargs)
+
+            cache = get_cache()
+            key = await sync_to_async(catalog_key)('page', request.get_full_path())
+            cached = await cache.aget(key)
+            stats.record('page', cached is not None)
+            if cached is None:
+                response = await view_func(request, *args, **kwargs)
+                if isinstance(response, CatalogStream):
+                    return _cache_when_sent(response, cache, key)
+                if not _is_cacheable(response):
+                    return response
+                # Templates may query or hit the cache synchronously.
+                await sync_to_async(response.render)()
+                await cache.aset(key, _page_entry(response))
+                return response
+
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or not _is_anonymous(request):
+            return view_func(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = catalog_key('page', request.get_full_path())
+        cached = cache.get(key)
+        stats.record('page', cached is not None)
+        if cached is None:
+            response = view_func(request, *args, **kwargs)
+            if isinstance(response, CatalogStream):
+                return _cache_when_sent(response, cache, key)
+            if not _is_cacheable(response):
+                return response
+            response.render()
+            cache.set(key, _page_entry(response))
+            return response
+
+        content, content_type = cached
+        return HttpResponse(content, content_type=content_type)
+    return wrapper
+
+
+def _catalog_page_last_modified(request, *args, **kwargs):
+    return catalog_last_modified()
+
+
+def _catalog_etag(request, modified):
+    digest = hashlib.md5(f'{modified.isoformat()}|{request.get_full_path()}'.encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def conditional_catalog_page(last_modified=_catalog_page_last_modified):
+    """
+    Answers conditional GETs for a catalog view with 304 Not Modified before
+    the view, or its template, runs.
+
+    last_modified(request, *args, **kwargs) returns when the page last
+    changed, or None if it cannot tell (the view then runs as usual); it
+    defaults to the catalog-wide time. The ETag also covers the page's URL.
+
+    Responses may be reused for CATALOG_MAX_AGE seconds and revalidated
+    after that, and vary on Cookie. Those to anonymous visitors are public,
+    so a CDN can share them; the pages carry no CSRF token (see the
+    csrf_token view). Responses to signed-in users, and any that set a
+    cookie, are private. Works on sync and async views.
+    """
+    def decorator(view_func):
+        def conditional(request, modified):
+            etag = _catalog_etag(request, modified) if modified is not None else None
+            return condition(
+                etag_func=lambda *args, **kwargs: etag,
+                last_modified_func=lambda *args, **kwargs: modified,
+            )(view_func)
+
+        def finish(request, response, anonymous):
+            if response.status_code in (200, 304):
+                # CsrfViewMiddleware sets the csrftoken cookie after the view
+                # if anything asked for the token.
+                shared = anonymous and not response.cookies and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+                patch_cache_control(
+                    response,
+                    **{'public' if shared else 'private': True},
+                    max_age=settings.CATALOG_MAX_AGE,
+                    must_revalidate=True,
+                )
+                patch_vary_headers(response, ['Cookie'])
+            return response
+
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                modified = await sync_to_async(last_modified)(request, *args, **kwargs)
+                view = conditional(request, modified)
+                response = await view(request, *args, **kwargs)
+                return finish(request, response, await _ais_anonymous(request))
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            modified = last_modified(request, *args, **kwargs)
+            view = conditional(request, modified)
+            response = view(request, *args, **kwargs)
+            return finish(request, response, _is_anonymous(request))
+        return wrapper
+    return decorator
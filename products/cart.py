@@ -0,0 +1,558 @@
+import threading
+from array import array
+from bisect import bisect_left
+from decimal import Decimal
+from functools import partial
+
+from asgiref.sync import sync_to_async
+
+from .cache import catalog_version
+from .models import Product
+
+CART_SESSION_KEY = 'cart'
+CART_SCHEMA_VERSION = 3
+
+# Prices are Product.price values (two decimal places) held as integer minor
+# units, so running totals are exact and never drift.
+MINOR_UNITS = 100
+
+
+def to_minor(amount):
+    return int((Decimal(amount) * MINOR_UNITS).to_integral_value())
+
+
+def from_minor(amount):
+    return (Decimal(amount) / MINOR_UNITS).quantize(Decimal('0.01'))
+
+
+def decode_cart(data):
+    """
+    Returns ({product_id: [quantity, unit_price_minor]}, catalog_version) from
+    a session cart in any known format.
+
+    Version 1 carts (no 'v' key) copied the product's name, price and image
+    into every line, and version 2 carts held quantities only. Neither carries
+    a catalog version, so their prices are re-resolved on load.
+    """
+    if not data:
+        return {}, None
+    version = data.get('v', 1)
+    if version == 1:
+        return {
+            int(product_id): [int(line['quantity']), to_minor(line['price'])]
+            for product_id, line in data.items()
+        }, None
+    if version == 2:
+        return {int(product_id): [int(quantity), 0] for product_id, quantity in data['items'].items()}, None
+    return {
+        int(product_id): [int(quantity), int(price)]
+        for product_id, (quantity, price) in data['items'].items()
+    }, data['cv']
+
+
+def encode_cart(lines, totals, version):
+    return {
+        'v': CART_SCHEMA_VERSION,
+        'cv': version,
+        'items': {str(product_id): line for product_id, line in lines.items()},
+        'subtotal': totals.subtotal_minor,
+        'count': totals.item_count,
+    }
+
+
+class CartTotals:
+    """
+    Totals of a cart, kept in integer minor units.
+    """
+    def __init__(self, subtotal_minor=0, item_count=0, line_count=0):
+        self.subtotal_minor = subtotal_minor
+        self.item_count = item_count
+        self.line_count = line_count
+
+    def __eq__(self, other):
+        if not isinstance(other, CartTotals):
+            return NotImplemented
+        return (self.subtotal_minor, self.item_count, self.line_count) == (
+            other.subtotal_minor, other.item_count, other.line_count
+        )
+
+    def __repr__(self):
+        return f'<CartTotals {self.total_price} ({self.item_count} items, {self.line_count} lines)>'
+
+    @property
+    def total_price(self):
+        return from_minor(self.subtotal_minor)
+
+    def as_json(self):
+        return {
+            'total_price': float(self.total_price),
+            'item_count': self.item_count,
+            'line_count': self.line_count,
+        }
+
+
+class CartLine:
+    """
+    A cart entry joined with the product data needed to display it.
+    """
+    def __init__(self, product, quantity):
+        self.product_id = product.pk
+        self.name = product.name
+        self.price = product.price
+        self.image_url = product.image_url
+        self.image_digest = product.image_digest
+        self.quantity = quantity
+        # Units that could be reserved, when fewer than quantity.
+        self.available = None
+
+    @property
+    def subtotal(self):
+        return self.price * self.quantity
+
+
+class Cart:
+    """
+    A shopping cart, decoded from whatever the configured cart storage holds.
+
+    Each line holds a quantity and the unit price in minor units; names and
+    images are never stored. Running totals are stored with the lines and
+    adjusted in constant time by every mutation, instead of being re-summed
+    on each request.
+
+    Unit prices are stamped with the catalog version they were read at. When
+    the catalog has changed since, the cart is repriced with one batched
+    query before it is used, so totals never reflect stale prices.
+
+    Mutations only change the in-memory cart; save() marks it for
+    CartMiddleware to persist once the view returns. Each mutation is also
+    recorded in changes, for storages that write only what changed.
+
+    products, if given, maps product ids to Product objects the storage
+    already loaded with the cart, which lines() then uses instead of
+    querying them again.
+    """
+    def __init__(self, data=None, products=None):
+        self.modified = False
+        self.changes = {}
+        # Set by get_cart(): returns the reservation holder of the cart's
+        # owner. Carts without one reserve no stock.
+        self.holder = None
+        # (product_id, delta) of the reservations changed for this cart.
+        self.held = []
+        self._products = products
+        self._lines, self._version = decode_cart(data)
+        if data and data.get('v') == CART_SCHEMA_VERSION:
+            self.totals = CartTotals(data['subtotal'], data['count'], len(self._lines))
+        else:
+            self.totals = self.recompute()
+        # Read before any prices are, so a price change committed in between
+        # leaves the cart stamped with the older version.
+        self._catalog_version = catalog_version()
+        if self._lines and self._version != self._catalog_version:
+            self.reprice()
+        elif data and data.get('v') != CART_SCHEMA_VERSION:
+            # Rewrite carts stored in an older format on first read.
+            self.save()
+
+    def __contains__(self, product_id):
+        return product_id in self._lines
+
+    def __len__(self):
+        return len(self._lines)
+
+    @property
+    def items(self):
+        """
+        Returns {product_id: quantity}.
+        """
+        return {product_id: quantity for product_id, (quantity, _) in self._lines.items()}
+
+    def quantity(self, product_id):
+        line = self._lines.get(product_id)
+        return line[0] if line else 0
+
+    def line_subtotal(self, product_id):
+        quantity, price = self._lines[product_id]
+        return from_minor(quantity * price)
+
+    def encode(self):
+        return encode_cart(self._lines, self.totals, self._version)
+
+    def save(self):
+        self.modified = True
+
+    def checkpoint(self):
+        """
+        Returns the cart's current state, for rollback().
+        """
+        return (
+            {product_id: list(line) for product_id, line in self._lines.items()},
+            CartTotals(self.totals.subtotal_minor, self.totals.item_count, self.totals.line_count),
+            self._version,
+            {product_id: list(change) for product_id, change in self.changes.items()},
+            self.modified,
+        )
+
+    def rollback(self, checkpoint):
+        """
+        Undoes every change made since checkpoint() returned checkpoint,
+        including whether the cart is to be saved. A cart repriced or
+        migrated on load is still saved as it was loaded.
+        """
+        lines, totals, self._version, changes, self.modified = checkpoint
+        self._lines = {product_id: list(line) for product_id, line in lines.items()}
+        self.totals = CartTotals(totals.subtotal_minor, totals.item_count, totals.line_count)
+        self.changes = {product_id: list(change) for product_id, change in changes.items()}
+
+    def _adjust(self, product_id, delta):
+        """
+        Changes a line's quantity by delta, removing it when it reaches zero,
+        and applies the same change to the running totals.
+        """
+        line = self._lines[product_id]
+        delta = max(delta, -line[0])
+        line[0] += delta
+        self.totals.subtotal_minor += delta * line[1]
+        self.totals.item_count += delta
+        if line[0] == 0:
+            del self._lines[product_id]
+            self.totals.line_count -= 1
+        return line[0]
+
+    def _record(self, product_id, delta=0, quantity=None):
+        """
+        Notes a change to a line in changes, as {product_id: [quantity, delta]}:
+        the line is set to quantity (None to keep the stored one), then
+        adjusted by delta. Successive changes to one line are merged.
+        """
+        change = self.changes.setdefault(product_id, [None, 0])
+        if quantity is not None:
+            change[:] = [quantity, 0]
+        else:
+            change[1] += delta
+
+    def add(self, product_id, unit_price, quantity=1):
+        """
+        Adds quantity units of a product, creating the line if needed.
+        unit_price should have been read after the cart was loaded.
+        """
+        if not self._lines:
+            self._version = self._catalog_version
+        if product_id not in self._lines:
+            self._lines[product_id] = [0, to_minor(unit_price)]
+            self.totals.line_count += 1
+        self._record(product_id, quantity)
+        return self._adjust(product_id, quantity)
+
+    def increase(self, product_id, quantity=1):
+        self._record(product_id, quantity)
+        return self._adjust(product_id, quantity)
+
+    def decrease(self, product_id, quantity=1):
+        self._record(product_id, -quantity)
+        return self._adjust(product_id, -quantity)
+
+    def set_quantity(self, product_id, quantity):
+        self._record(product_id, quantity=quantity)
+        return self._adjust(product_id, quantity - self._lines[product_id][0])
+
+    def remove(self, product_id):
+        self._record(product_id, quantity=0)
+        return self._adjust(product_id, -self._lines[product_id][0])
+
+    def clear(self):
+        """
+        Removes every line, leaving their stock reservations alone, e.g.
+        once they were handed to an order.
+        """
+        for product_id in list(self._lines):
+            self.remove(product_id)
+        self.save()
+
+    def recompute(self):
+        """
+        Returns totals summed from scratch over every line.
+        """
+        return CartTotals(
+            subtotal_minor=sum(quantity * price for quantity, price in self._lines.values()),
+            item_count=sum(quantity for quantity, _ in self._lines.values()),
+            line_count=len(self._lines),
+        )
+
+    def _apply_prices(self, prices):
+        """
+        Replaces unit prices with {product_id: price}, dropping lines whose
+        product no longer exists.
+        """
+        for product_id in list(self._lines):
+            if product_id in prices:
+                self._lines[product_id][1] = to_minor(prices[product_id])
+            else:
+                del self._lines[product_id]
+        self._version = self._catalog_version
+        self.totals = self.recompute()
+        self.save()
+
+    def reprice(self):
+        self._apply_prices(dict(Product.objects.filter(pk__in=self._lines).values_list('pk', 'price')))
+
+    def lines(self):
+        """
+        Returns the cart's lines in the order items were added, resolving
+        product data with a single id__in query. Items whose product no
+        longer exists are dropped.
+        """
+        if not self._lines:
+            return []
+        if self._products is not None and self._lines.keys() <= self._products.keys():
+            return self._lines_from(self._products)
+        return self._lines_from(self._line_products().in_bulk(self._lines))
+
+    async def alines(self):
+        """
+        Async version of lines().
+        """
+        if not self._lines:
+            return []
+        if self._products is not None and self._lines.keys() <= self._products.keys():
+            return self._lines_from(self._products)
+        return self._lines_from(await self._line_products().ain_bulk(self._lines))
+
+    def _line_products(self):
+        return Product.objects.only('id', 'name', 'price', 'image_url', 'image_hash', 'image_source_url')
+
+    def _lines_from(self, products):
+        if any(
+            product_id not in products or to_minor(products[product_id].price) != price
+            for product_id, (_, price) in self._lines.items()
+        ):
+            self._apply_prices({product_id: product.price for product_id, product in products.items()})
+        return [CartLine(products[product_id], quantity) for product_id, (quantity, _) in self._lines.items()]
+
+
+class ProductIdSet:
+    """
+    An in-process snapshot of every product id, for existence checks that
+    would otherwise cost a query per cart click.
+
+    Ids are held in a sorted array (8 bytes each) rather than a set, so a
+    million-product catalog costs a few megabytes per worker. The snapshot is
+    loaded once and kept until invalidate() is called, which this process
+    does when it adds or removes products, or until version(), if given,
+    returns something new. Product updates leave it alone.
+
+    An id missing from the snapshot is checked with exists(product_id), a
+    single pk lookup, and remembered if found, so products added by other
+    processes cost one query each rather than a reload. Products deleted by
+    other processes stay in the snapshot; carts drop them anyway when they
+    are repriced after the deletion moves the catalog version on.
+
+    query, if given, returns a flat values_list of the ids to hold instead,
+    ordered by id. Without exists, ids missing from the snapshot are absent.
+    """
+    def __init__(self, query=None, exists=None, version=None):
+        self._query = query or (lambda: Product.objects.order_by('pk').values_list('pk', flat=True))
+        self._exists = exists
+        self._get_version = version
+        self._lock = threading.Lock()
+        self._ids = None
+        self._found = set()
+        self._version = None
+
+    def invalidate(self):
+        with self._lock:
+            self._ids = self._version = None
+            self._found = set()
+
+    def _snapshot(self):
+        version = self._get_version() if self._get_version else None
+        ids = self._ids
+        if ids is not None and self._version == version:
+            return ids
+        ids = array('q', self._query().iterator(chunk_size=10000))
+        with self._lock:
+            self._ids, self._version, self._found = ids, version, set()
+        return ids
+
+    def contains(self, product_id):
+        ids = self._snapshot()
+        index = bisect_left(ids, product_id)
+        if (index < len(ids) and ids[index] == product_id) or product_id in self._found:
+            return True
+        if self._exists is None or not self._exists(product_id):
+            return False
+        with self._lock:
+            self._found.add(product_id)
+        return True
+
+
+product_ids = ProductIdSet(exists=lambda pk: Product.objects.filter(pk=pk).exists())
+
+
+def get_cart(request):
+    """
+    Returns the request's cart, loading it from the configured storage once.
+    """
+    if not hasattr(request, '_cart'):
+        from .cart_storage import get_cart_storage
+        from .inventory import holder
+        request._cart = get_cart_storage().load_cart(request)
+        request._cart.holder = partial(holder, request)
+    return request._cart
+
+
+async def aget_cart(request):
+    """
+    Async version of get_cart().
+    """
+    if not hasattr(request, '_cart'):
+        from .cart_storage import get_cart_storage
+        from .inventory import holder
+        request._cart = await get_cart_storage().aload_cart(request)
+        request._cart.holder = partial(holder, request)
+    return request._cart
+
+
+class CartError(Exception):
+    """
+    A cart operation that cannot be applied; status_code is the HTTP status
+    the views report it with.
+    """
+    status_code = 400
+
+
+class ProductNotInCart(CartError):
+    status_code = 404
+
+    def __init__(self, product_id):
+        super().__init__('Product not in cart')
+        self.product_id = product_id
+
+
+class OutOfStock(CartError):
+    status_code = 409
+
+    def __init__(self, product_id, available):
+        super().__init__(f'Only {available} left in stock' if available else 'Out of stock')
+        self.product_id = product_id
+        self.available = available
+
+
+CART_OPERATIONS = ('set', 'increase', 'decrease', 'remove')
+
+
+def hold(cart, product_id, delta):
+    """
+    Reserves delta more units of a stock-tracked product for the cart, or
+    releases -delta units, before the cart itself changes (see
+    products.inventory). Raises OutOfStock.
+    """
+    if not delta or cart.holder is None:
+        return
+    from .inventory import release, reserve, tracked_product_ids
+    if not tracked_product_ids.contains(product_id):
+        return
+    if delta > 0:
+        reserve(cart.holder(), product_id, delta)
+    else:
+        release(cart.holder(), product_id, -delta)
+    cart.held.append((product_id, delta))
+
+
+def undo_holds(cart):
+    """
+    Reverts the reservation changes made for the cart in this request, for
+    a change to the cart that is not kept. Units released meanwhile may have
+    been taken by someone else; the cart page reserves them again if it can.
+    """
+    from .inventory import release, reserve
+    for product_id, delta in reversed(cart.held):
+        if delta > 0:
+            release(cart.holder(), product_id, delta)
+        else:
+            try:
+                reserve(cart.holder(), product_id, -delta)
+            except OutOfStock:
+                pass
+    cart.held = []
+
+
+def add_product(cart, product_id, quantity=1):
+    """
+    Adds a product to the cart and returns (its new quantity, its name).
+
+    Products already in the cart are checked against the product id snapshot
+    and need no query, and their name is None; only a product new to the
+    cart is read, and then only for its price and name. Raises
+    Product.DoesNotExist for unknown products and OutOfStock when the units
+    cannot be reserved.
+    """
+    if product_id in cart:
+        if not product_ids.contains(product_id):
+            raise Product.DoesNotExist
+        hold(cart, product_id, quantity)
+        return cart.increase(product_id, quantity), None
+    price, name = Product.objects.values_list('price', 'name').get(pk=product_id)
+    hold(cart, product_id, quantity)
+    return cart.add(product_id, price, quantity), name
+
+
+async def aadd_product(cart, product_id, quantity=1):
+    """
+    Async version of add_product().
+    """
+    if product_id in cart:
+        if not await sync_to_async(product_ids.contains)(product_id):
+            raise Product.DoesNotExist
+        await sync_to_async(hold)(cart, product_id, quantity)
+        return cart.increase(product_id, quantity), None
+    price, name = await Product.objects.values_list('price', 'name').aget(pk=product_id)
+    await sync_to_async(hold)(cart, product_id, quantity)
+    return cart.add(product_id, price, quantity), name
+
+
+def apply_operation(cart, op, product_id, quantity=1):
+    """
+    Applies one of CART_OPERATIONS to a line already in the cart and returns
+    the line's new quantity (0 once removed). Raises ProductNotInCart, and
+    OutOfStock when more units cannot be reserved.
+    """
+    if product_id not in cart or not product_ids.contains(product_id):
+        raise ProductNotInCart(product_id)
+    hold(cart, product_id, _delta(cart, op, product_id, quantity))
+    return _apply(cart, op, product_id, quantity)
+
+
+async def aapply_operation(cart, op, product_id, quantity=1):
+    """
+    Async version of apply_operation().
+    """
+    if product_id not in cart or not await sync_to_async(product_ids.contains)(product_id):
+        raise ProductNotInCart(product_id)
+    await sync_to_async(hold)(cart, product_id, _delta(cart, op, product_id, quantity))
+    return _apply(cart, op, product_id, quantity)
+
+
+def _delta(cart, op, product_id, quantity):
+    current = cart.quantity(product_id)
+    if op == 'set':
+        return quantity - current
+    if op == 'increase':
+        return quantity
+    if op == 'decrease':
+        return -min(quantity, current)
+    if op == 'remove':
+        return -current
+    raise CartError(f'Unknown cart operation: {op}')
+
+
+def _apply(cart, op, product_id, quantity):
+    if op == 'set':
+        return cart.set_quantity(product_id, quantity)
+    if op == 'increase':
+        return cart.increase(product_id, quantity)
+    if op == 'decrease':
+        return cart.decrease(product_id, quantity)
+    if op == 'remove':
+        return cart.remove(product_id)
+    raise CartError(f'Unknown cart operation: {op}')
@@ -0,0 +1,356 @@
+import atexit
+import logging
+import threading
+from functools import lru_cache
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.base import UpdateError
+from django.contrib.sessions.models import Session
+from django.core import signing
+from django.core.cache import caches
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .cache import catalog_version
+from .cart import CART_SESSION_KEY, Cart, CartTotals, encode_cart, to_minor
+from .db import retry_on_lock
+from .models import Cart as CartRecord, CartItem
+
+logger = logging.getLogger(__name__)
+
+
+class CartStorage:
+    """
+    Where a cart's encoded state lives between requests.
+
+    load() returns the stored state (or None) for a request, and aload() is
+    its async version for async views. save() persists a new state and may
+    need the response, e.g. to set a cookie.
+
+    Views get their products.cart.Cart from load_cart() (or aload_cart()),
+    and CartMiddleware hands it back to save_cart() once the view has run;
+    by default these wrap load() and save(), and storages that can do
+    better than whole-state reads and writes override them instead.
+    """
+    def load(self, request):
+        raise NotImplementedError
+
+    async def aload(self, request):
+        return await sync_to_async(self.load)(request)
+
+    def save(self, request, response, data):
+        raise NotImplementedError
+
+    def load_cart(self, request):
+        return Cart(self.load(request))
+
+    async def aload_cart(self, request):
+        data = await self.aload(request)
+        # Loading may reprice the cart, which has no async ORM equivalent.
+        return await sync_to_async(Cart)(data)
+
+    def save_cart(self, request, response, cart):
+        self.save(request, response, cart.encode())
+
+
+class SessionCartStorage(CartStorage):
+    """
+    Keeps the cart in the Django session, which is saved to the session
+    backend (the django_session table by default) after every change.
+    """
+    def load(self, request):
+        return request.session.get(CART_SESSION_KEY)
+
+    async def aload(self, request):
+        return await request.session.aget(CART_SESSION_KEY)
+
+    def save(self, request, response, data):
+        request.session[CART_SESSION_KEY] = data
+
+
+class SignedCookieCartStorage(SessionCartStorage):
+    """
+    Keeps the cart in a signed, compressed cookie so that cart changes cost no
+    server-side write at all.
+
+    Carts whose cookie would exceed CART_COOKIE_MAX_BYTES are kept in the
+    session instead. The signature only prevents tampering: the contents are
+    readable by the client, which is fine for product ids and quantities.
+    """
+    salt = 'products.cart'
+
+    def _load_cookie(self, request):
+        value = request.COOKIES.get(settings.CART_COOKIE_NAME)
+        if value:
+            try:
+                return signing.loads(value, salt=self.salt, max_age=settings.SESSION_COOKIE_AGE)
+            except signing.BadSignature:
+                pass
+        return None
+
+    def load(self, request):
+        data = self._load_cookie(request)
+        return data if data is not None else super().load(request)
+
+    async def aload(self, request):
+        data = self._load_cookie(request)
+        return data if data is not None else await super().aload(request)
+
+    def save(self, request, response, data):
+        value = signing.dumps(data, salt=self.salt, compress=True)
+        if data['items'] and len(value) <= settings.CART_COOKIE_MAX_BYTES:
+            response.set_cookie(
+                settings.CART_COOKIE_NAME,
+                value,
+                max_age=settings.SESSION_COOKIE_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite='Lax',
+            )
+            if CART_SESSION_KEY in request.session:
+                del request.session[CART_SESSION_KEY]
+            return
+        response.delete_cookie(settings.CART_COOKIE_NAME, samesite='Lax')
+        if data['items']:
+            super().save(request, response, data)
+        elif CART_SESSION_KEY in request.session:
+            del request.session[CART_SESSION_KEY]
+
+
+class WriteBehindQueue:
+    """
+    Collects cart states per session and writes them to the session store
+    from a background thread.
+
+    Repeated changes to one cart between flushes are coalesced into a single
+    write, so a burst of clicks costs one database write instead of one each.
+
+    A flush changes only the cart key of each session, reading the session
+    and writing it back in one transaction. The session is still saved
+    whole, though: a request that loaded its session before a flush and
+    saves it after puts back the cart it had, the usual last-writer-wins of
+    Django sessions. Only the session copy is affected; the cache, which
+    carts are read from, keeps the newer cart, and its next change is
+    written behind again.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def put(self, session_key, data):
+        with self._lock:
+            self._pending[session_key] = data
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='cart-write-behind', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._wakeup.wait(self.interval):
+            self.flush()
+            # Database connections are per thread; don't hold this one open
+            # between flushes.
+            connections.close_all()
+
+    def flush(self):
+        """
+        Writes every pending cart to the session store. Returns how many were written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        session_store = import_module(settings.SESSION_ENGINE).SessionStore
+        written = 0
+        for session_key, data in pending.items():
+            try:
+                written += self._write(session_store, session_key, data)
+            except UpdateError:
+                pass
+            except Exception:
+                logger.exception('Write-behind of cart for a session failed; requeueing')
+                with self._lock:
+                    self._pending.setdefault(session_key, data)
+        return written
+
+    @staticmethod
+    @retry_on_lock(model=Session)
+    def _write(session_store, session_key, data):
+        # Under SQLITE_TUNING the transaction takes the write lock before the
+        # session is read, so no other save can land between the two.
+        with transaction.atomic(using=router.db_for_write(Session)):
+            session = session_store(session_key=session_key)
+            session[CART_SESSION_KEY] = data
+            if session.session_key is None:
+                # The session expired or was deleted since; saving now would
+                # create a new, orphaned one. Drop the cart.
+                return False
+            session.save(must_create=False)
+        return True
+
+
+class CacheCartStorage(SessionCartStorage):
+    """
+    Keeps the cart in the cache, with the session as a write-behind copy.
+
+    Reads and writes go to the CART_CACHE_ALIAS cache; the durable copy in the
+    session is refreshed by a background thread at most every
+    CART_WRITE_BEHIND_SECONDS. With several worker processes the cache must
+    be shared between them (file, memcached, redis), otherwise each worker
+    sees its own cart.
+    """
+    def __init__(self):
+        self.queue = WriteBehindQueue(settings.CART_WRITE_BEHIND_SECONDS)
+        atexit.register(self.queue.flush)
+
+    @property
+    def cache(self):
+        return caches[settings.CART_CACHE_ALIAS]
+
+    def load(self, request):
+        session_key = request.session.session_key
+        if session_key is None:
+            return None
+        data = self.cache.get(f'cart:{session_key}')
+        if data is None:
+            data = super().load(request)
+            if data is not None:
+                self.cache.set(f'cart:{session_key}', data, settings.SESSION_COOKIE_AGE)
+        return data
+
+    async def aload(self, request):
+        session_key = request.session.session_key
+        if session_key is None:
+            return None
+        data = await self.cache.aget(f'cart:{session_key}')
+        if data is None:
+            data = await super().aload(request)
+            if data is not None:
+                await self.cache.aset(f'cart:{session_key}', data, settings.SESSION_COOKIE_AGE)
+        return data
+
+    def save(self, request, response, data):
+        if request.session.session_key is None:
+            # The cart is keyed by session, so a first-time visitor's
+            # session row is created once, here.
+            request.session.save()
+        session_key = request.session.session_key
+        self.cache.set(f'cart:{session_key}', data, settings.SESSION_COOKIE_AGE)
+        self.queue.put(session_key, data)
+
+
+class DatabaseCartStorage(CartStorage):
+    """
+    Keeps carts in the Cart and CartItem tables, owned by the logged-in user
+    or else by the session, so they outlive both.
+
+    A request writes only the lines it changed, adjusting each in place
+    (UPDATE ... SET quantity = quantity + n) rather than rewriting the
+    cart, so clicks in two tabs at once both count. Changes to several
+    lines are written in one transaction. The cart is read with a single
+    query joining its items to their products, which also serves the cart
+    page, and is always priced at the current catalog.
+    """
+    def _owner(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return {'user_id': user.pk}
+        if request.session.session_key is not None:
+            return {'session_key': request.session.session_key}
+        return None
+
+    def load_cart(self, request):
+        owner = self._owner(request)
+        if owner is None:
+            return Cart()
+        # Read before any prices are; see Cart.
+        version = catalog_version()
+        items = (
+            CartItem.objects
+            .filter(**{f'cart__{field}': value for field, value in owner.items()})
+            .select_related('product')
+            .only(
+                'cart_id', 'quantity', 'product__id', 'product__name', 'product__price', 'product__image_url',
+                'product__image_hash', 'product__image_source_url',
+            )
+            .order_by('pk')
+        )
+        lines, products, cart_id = {}, {}, None
+        for item in items:
+            cart_id = item.cart_id
+            lines[item.product_id] = [item.quantity, to_minor(item.product.price)]
+            products[item.product_id] = item.product
+        totals = CartTotals(
+            subtotal_minor=sum(quantity * price for quantity, price in lines.values()),
+            item_count=sum(quantity for quantity, _ in lines.values()),
+            line_count=len(lines),
+        )
+        cart = Cart(encode_cart(lines, totals, version), products=products)
+        # Saves a lookup when the cart is written.
+        cart.record_id = cart_id
+        return cart
+
+    async def aload_cart(self, request):
+        return await sync_to_async(self.load_cart)(request)
+
+    def load(self, request):
+        return self.load_cart(request).encode()
+
+    def save_cart(self, request, response, cart):
+        if not cart.changes:
+            return
+        if self._owner(request) is None:
+            # The cart is keyed by session, so a first-time visitor's
+            # session row is created once, here.
+            request.session.save()
+        cart.record_id = self._write(self._owner(request), getattr(cart, 'record_id', None), cart.changes)
+        cart.changes = {}
+
+    @retry_on_lock(model=CartItem)
+    def _write(self, owner, cart_id, changes):
+        with transaction.atomic():
+            if cart_id is None:
+                cart_id = CartRecord.objects.get_or_create(**owner)[0].pk
+            for product_id, (quantity, delta) in changes.items():
+                items = CartItem.objects.filter(cart_id=cart_id, product_id=product_id)
+                if quantity is not None:
+                    quantity += delta
+                    if quantity <= 0:
+                        items.delete()
+                    elif not items.update(quantity=quantity):
+                        self._insert(items, cart_id, product_id, quantity, on_conflict=quantity)
+                elif delta > 0:
+                    if not items.update(quantity=F('quantity') + delta):
+                        self._insert(items, cart_id, product_id, delta, on_conflict=F('quantity') + delta)
+                elif delta < 0:
+                    items.update(quantity=Greatest(F('quantity') + delta, 0))
+                    items.filter(quantity=0).delete()
+            CartRecord.objects.filter(pk=cart_id).update(updated_at=timezone.now())
+        return cart_id
+
+    def _insert(self, items, cart_id, product_id, quantity, on_conflict):
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+        except IntegrityError:
+            # Another request added the line since this one looked.
+            items.update(quantity=on_conflict)
+
+
+@lru_cache
+def _load_storage(path):
+    return import_string(path)()
+
+
+def get_cart_storage():
+    """
+    Returns the storage backend configured by the CART_STORAGE setting.
+    """
+    return _load_storage(settings.CART_STORAGE)
@@ -0,0 +1,49 @@
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, router
+
+
+def is_lock_error(exc):
+    """
+    Returns True for SQLite's "database is locked" / "database is busy" errors.
+    """
+    message = str(exc).lower()
+    return isinstance(exc, OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def retry_on_lock(func=None, *, using=None, model=None):
+    """
+    Retries a database write that failed because SQLite was locked, with
+    exponential backoff and jitter, up to DATABASE_LOCK_RETRIES times.
+
+    The busy timeout already makes each statement wait for the lock; this
+    covers the writes that still time out under heavy contention. Nothing is
+    retried inside an enclosing atomic block, since that transaction is
+    already broken and only its owner can restart it. The database is the
+    write database for model, or using.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if using is not None:
+                alias = using
+            elif model is not None:
+                alias = router.db_for_write(model)
+            else:
+                alias = DEFAULT_DB_ALIAS
+            attempts = settings.DATABASE_LOCK_RETRIES
+            for attempt in range(attempts + 1):
+                try:
+                    return func(*args, **kwargs)
+                except OperationalError as e:
+                    if attempt == attempts or not is_lock_error(e) or connections[alias].in_atomic_block:
+                        raise
+                    time.sleep(settings.DATABASE_LOCK_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
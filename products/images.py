@@ -0,0 +1,214 @@
+"""
+Resized product images.
+
+The original named by Product.image_url is downloaded once and resized to
+each of PRODUCT_IMAGE_WIDTHS, in WebP and JPEG, into the default storage.
+Files are named after the original's content, so a new original gets new
+names and a written file never changes: they are served with a one-year
+immutable Cache-Control (see views.product_image; a web server serving
+MEDIA_ROOT/images/ should send the same header).
+
+Resizing is CPU-bound, so ingest() runs it in a process pool when given
+one, while originals download in threads. A product saved with a new
+image is ingested by an ingest_product job, off the request. Needs Pillow;
+without it products keep showing their original image_url.
+"""
+import hashlib
+import io
+import logging
+import re
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import F, Q
+
+from .models import Product
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# format: (Pillow format, file extension, content type, save options)
+FORMATS = {
+    'webp': ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Part of every file name; bump it when the encoding above changes, so
+# cached copies of the old files are not reused.
+VERSION = 1
+
+VARIANT_NAME = re.compile(r'images/v\d+/[0-9a-f]{2}/[0-9a-f]{32}-\d+\.(?:webp|jpg)')
+
+ONE_YEAR = 60 * 60 * 24 * 365
+
+FETCH_THREADS = 8
+
+# The Product fields ingest() reads and writes.
+INGEST_FIELDS = ('id', 'image_url', 'image_hash', 'image_source_url')
+
+
+class ImageError(ValueError):
+    pass
+
+
+def available():
+    return Image is not None
+
+
+def variant_name(digest, width, format):
+    return f'images/v{VERSION}/{digest[:2]}/{digest}-{width}.{FORMATS[format][1]}'
+
+
+def variant_url(digest, width, format):
+    return default_storage.url(variant_name(digest, width, format))
+
+
+def content_type(name):
+    extension = name.rsplit('.', 1)[-1]
+    return next(content_type for _, ext, content_type, _ in FORMATS.values() if ext == extension)
+
+
+def needs_ingest(product):
+    return bool(product.image_url) and product.image_url != product.image_source_url
+
+
+def pending_batches(batch_size):
+    """
+    Yields lists of up to batch_size products whose image_url was not
+    ingested yet, in primary key order.
+    """
+    queryset = (
+        Product.objects.only(*INGEST_FIELDS)
+        .exclude(Q(image_url__isnull=True) | Q(image_url=''))
+        .filter(Q(image_source_url__isnull=True) | ~Q(image_url=F('image_source_url')))
+        .order_by('pk')
+    )
+    last = 0
+    while batch := list(queryset.filter(pk__gt=last)[:batch_size]):
+        yield batch
+        last = batch[-1].pk
+
+
+def fetch_original(url, timeout=10):
+    """
+    Downloads an original image, refusing ones over PRODUCT_IMAGE_MAX_BYTES.
+    """
+    limit = settings.PRODUCT_IMAGE_MAX_BYTES
+    request = urllib.request.Request(url, headers={'User-Agent': 'ecom-demo image ingest'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        data = response.read(limit + 1)
+    if len(data) > limit:
+        raise ImageError(f'larger than {limit} bytes')
+    return data
+
+
+def render_variants(data, widths):
+    """
+    Returns {(width, format): encoded bytes} for an original image. Never
+    upscales: widths past the original's are encoded at its own size.
+    Runs in pool worker processes, so takes and returns only plain data.
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        # Lets JPEG decode at a fraction of full size when that is enough.
+        original.draft('RGB', (max(widths), max(widths)))
+        image = ImageOps.exif_transpose(original)
+        if image.mode != 'RGB':
+            background = Image.new('RGB', image.size, 'white')
+            rgba = image.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+        variants = {}
+        for width in sorted(widths, reverse=True):
+            size = (min(width, image.width), max(1, round(image.height * min(width, image.width) / image.width)))
+            resized = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+            for format, (pillow_format, _, _, options) in FORMATS.items():
+                output = io.BytesIO()
+                resized.save(output, pillow_format, **options)
+                variants[width, format] = output.getvalue()
+    return variants
+
+
+def _render(job):
+    # Errors are returned, not raised, so one bad image does not cost the
+    # rest of a pool.map() batch.
+    data, widths = job
+    try:
+        return render_variants(data, widths)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        return ImageError(f'not a usable image ({exc})')
+
+
+def _fetch(url):
+    try:
+        return fetch_original(url)
+    except (OSError, ValueError) as exc:
+        return ImageError(f'download failed ({exc})')
+
+
+def _stored(digest, widths):
+    return all(default_storage.exists(variant_name(digest, width, format)) for width in widths for format in FORMATS)
+
+
+def ingest(products, pool=None):
+    """
+    Downloads the new originals of products (those whose image_url was not
+    ingested yet), stores their resized variants and records image_hash and
+    image_source_url. Resizing runs in pool (a concurrent.futures executor)
+    if given, else in this process. Returns (ingested, failed); failures are
+    logged and retried by the next ingest.
+    """
+    if Image is None:
+        return 0, 0
+    pending = [product for product in products if needs_ingest(product)]
+    if not pending:
+        return 0, 0
+    widths = list(settings.PRODUCT_IMAGE_WIDTHS)
+    with ThreadPoolExecutor(min(FETCH_THREADS, len(pending))) as fetchers:
+        originals = list(fetchers.map(_fetch, [product.image_url for product in pending]))
+
+    ingested, failed, jobs = [], 0, []
+    for product, data in zip(pending, originals):
+        if isinstance(data, ImageError):
+            logger.warning('Image of product %s (%s): %s', product.pk, product.image_url, data)
+            failed += 1
+            continue
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        if _stored(digest, widths):
+            ingested.append((product, digest))
+        else:
+            jobs.append((product, digest, data))
+
+    results = (pool.map if pool is not None else map)(_render, [(data, widths) for _, _, data in jobs])
+    for (product, digest, _), variants in zip(jobs, results):
+        if isinstance(variants, ImageError):
+            logger.warning('Image of product %s (%s): %s', product.pk, product.image_url, variants)
+            failed += 1
+            continue
+        for (width, format), content in variants.items():
+            name = variant_name(digest, width, format)
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(content))
+        ingested.append((product, digest))
+
+    for product, digest in ingested:
+        product.image_hash = digest
+        product.image_source_url = product.image_url
+    Product.objects.bulk_update([product for product, _ in ingested], ['image_hash', 'image_source_url'])
+    return len(ingested), failed
+
+
+def ingest_product(product_id):
+    """
+    Job: resizes the new image of a product saved with one. Raises if it
+    failed, so the job is retried.
+    """
+    _, failed = ingest(Product.objects.filter(pk=product_id).only(*INGEST_FIELDS))
+    if failed:
+        raise ImageError(f'Image of product {product_id} could not be ingested')
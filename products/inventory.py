@@ -0,0 +1,214 @@
+"""
+Stock and reservations.
+
+A product is stock-tracked once set_stock() gives it Stock rows. Putting
+it in a cart reserves units: they are taken out of Stock with a single
+conditional UPDATE (SET quantity = quantity - n WHERE quantity >= n), so
+concurrent carts can never oversell and no count is read only to be
+written back. The units are recorded in a Reservation for the cart's
+holder, which expires STOCK_RESERVATION_SECONDS after the cart last changed
+or its page was viewed; maintenance.expire_reservations() puts expired
+units back into stock.
+
+The stock of a hot product can be split over several shard rows. Each
+reservation takes from a random shard holding enough units, so on
+databases with row locks concurrent reservations rarely wait for the same
+row. SQLite locks the whole database for every write, so there shards save
+nothing and only cost a little; they are meant for other databases.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Subquery, Sum
+from django.utils import timezone
+
+from .cache import bump_shared_version, shared_version
+from .cart import OutOfStock, ProductIdSet
+from .db import retry_on_lock
+from .models import Reservation, Stock
+
+
+def stock_version():
+    """
+    Returns the version of the set of stock-tracked products, shared by
+    every process through STOCK_VERSION_PATH.
+    """
+    return shared_version(settings.STOCK_VERSION_PATH)
+
+
+# Products with Stock rows; the cart skips reservations for the others
+# without a query. Each process keeps its own snapshot, keyed by the stock
+# version, which only set_stock() moves on, when it starts or stops tracking
+# a product. Product changes and catalog bumps leave it alone.
+tracked_product_ids = ProductIdSet(
+    lambda: Stock.objects.order_by('product_id').values_list('product_id', flat=True).distinct(),
+    version=stock_version,
+)
+
+
+def holder(request):
+    """
+    Returns the reservation holder of a request's cart: the logged-in user,
+    or else the session, which is created if needed.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    if request.session.session_key is None:
+        request.session.save()
+    return f'session:{request.session.session_key}'
+
+
+def _expiry():
+    return timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_SECONDS)
+
+
+def _random_shard(product_id, quantity=0):
+    return Subquery(
+        Stock.objects.filter(product_id=product_id, quantity__gte=quantity).order_by('?').values('pk')[:1]
+    )
+
+
+def set_stock(product_id, quantity, shards=1):
+    """
+    Makes quantity units of a product available, spread evenly over shards
+    rows, on top of those already reserved. None stops tracking its stock.
+    """
+    with transaction.atomic():
+        stock = Stock.objects.filter(product_id=product_id)
+        was_tracked = stock.exists()
+        stock.delete()
+        if quantity is not None:
+            Stock.objects.bulk_create(
+                Stock(product_id=product_id, shard=shard, quantity=quantity // shards + (shard < quantity % shards))
+                for shard in range(shards)
+            )
+        if was_tracked != (quantity is not None):
+            # After the commit, so no process reloads its snapshot too early.
+            transaction.on_commit(lambda: bump_shared_version(settings.STOCK_VERSION_PATH))
+
+
+def stock_levels(product_ids):
+    """
+    Returns {product_id: units available} for the tracked ones of product_ids.
+    """
+    return dict(
+        Stock.objects.filter(product_id__in=product_ids)
+        .values('product_id').annotate(available=Sum('quantity'))
+        .values_list('product_id', 'available')
+    )
+
+
+def take(product_id, quantity):
+    """
+    Takes quantity units of a product out of stock, from one shard when one
+    holds enough and else from several. Raises OutOfStock. Must run in a
+    transaction.
+    """
+    if Stock.objects.filter(pk=_random_shard(product_id, quantity), quantity__gte=quantity).update(
+        quantity=F('quantity') - quantity,
+    ):
+        return
+    shards = list(
+        Stock.objects.select_for_update().filter(product_id=product_id, quantity__gt=0)
+        .order_by('-quantity').values_list('pk', 'quantity')
+    )
+    available = sum(units for _, units in shards)
+    if available < quantity:
+        raise OutOfStock(product_id, available)
+    for pk, units in shards:
+        part = min(units, quantity)
+        if not Stock.objects.filter(pk=pk, quantity__gte=part).update(quantity=F('quantity') - part):
+            # Taken by another reservation since; the transaction is undone.
+            raise OutOfStock(product_id, available - quantity)
+        quantity -= part
+        if not quantity:
+            return
+
+
+def put_back(product_id, quantity):
+    """
+    Returns quantity units of a product to a random shard of its stock.
+    """
+    Stock.objects.filter(pk=_random_shard(product_id)).update(quantity=F('quantity') + quantity)
+
+
+@retry_on_lock(model=Reservation)
+def reserve(holder, product_id, quantity):
+    """
+    Takes quantity more units of a product for holder and renews the expiry
+    of its reservation. Raises OutOfStock.
+    """
+    with transaction.atomic():
+        take(product_id, quantity)
+        expires_at = _expiry()
+        reservations = Reservation.objects.filter(holder=holder, product_id=product_id)
+        if reservations.update(quantity=F('quantity') + quantity, expires_at=expires_at):
+            return
+        try:
+            with transaction.atomic():
+                Reservation.objects.create(holder=holder, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        except IntegrityError:
+            # Another request of the same holder reserved it since.
+            reservations.update(quantity=F('quantity') + quantity, expires_at=expires_at)
+
+
+@retry_on_lock(model=Reservation)
+def release(holder, product_id, quantity):
+    """
+    Returns up to quantity units of holder's reservation of a product to
+    stock, and how many that was.
+    """
+    with transaction.atomic():
+        reservation = (
+            Reservation.objects.select_for_update().filter(holder=holder, product_id=product_id)
+            .values_list('pk', 'quantity').first()
+        )
+        if reservation is None:
+            return 0
+        pk, reserved = reservation
+        quantity = min(quantity, reserved)
+        if quantity == reserved:
+            Reservation.objects.filter(pk=pk).delete()
+        else:
+            Reservation.objects.filter(pk=pk).update(quantity=F('quantity') - quantity)
+        put_back(product_id, quantity)
+    return quantity
+
+
+def renew(holder, wanted):
+    """
+    Brings holder's reservations up to wanted, {product_id: quantity} of
+    tracked products: renews their expiry and reserves what is missing, for
+    example after they expired. Returns {product_id: units held or still
+    available} for those that could not be reserved in full.
+    """
+    reservations = Reservation.objects.filter(holder=holder, product_id__in=wanted)
+    reservations.update(expires_at=_expiry())
+    held = dict(reservations.values_list('product_id', 'quantity'))
+    short = {}
+    for product_id, quantity in wanted.items():
+        missing = quantity - held.get(product_id, 0)
+        if missing <= 0:
+            continue
+        try:
+            reserve(holder, product_id, missing)
+        except OutOfStock as e:
+            short[product_id] = held.get(product_id, 0) + e.available
+    return short
+
+
+def hold_cart(cart):
+    """
+    Renews the reservations of a cart's stock-tracked lines (see renew()).
+    """
+    if cart.holder is None or not len(cart):
+        return {}
+    wanted = {
+        product_id: quantity for product_id, quantity in cart.items.items()
+        if tracked_product_ids.contains(product_id)
+    }
+    if not wanted:
+        return {}
+    return renew(cart.holder(), wanted)
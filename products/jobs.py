@@ -0,0 +1,146 @@
+"""
+A job queue kept in the database, for work that must not hold up a request.
+
+enqueue() adds a Job naming a function by its dotted path, normally inside
+the transaction that makes the job necessary, so the job exists if and only
+if that transaction commits. Workers (`manage.py run_jobs`) claim due jobs
+a few at a time and lease them for JOB_LEASE_SECONDS; the job of a worker
+that died is claimed again once its lease runs out. A job that raises is
+retried with exponential backoff, up to JOB_MAX_ATTEMPTS attempts, and then
+kept as failed. Finished jobs are kept for JOB_RETENTION_HOURS, so recent
+throughput can be read off the table, and then deleted by collect_garbage.
+
+A job may run more than once, so the functions must be idempotent.
+"""
+import logging
+import os
+import threading
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .db import retry_on_lock
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(name, run_after=None, **payload):
+    """
+    Adds a job calling the function at dotted path name with payload, which
+    must be JSON-serializable, at or after run_after (now by default).
+    """
+    return Job.objects.create(name=name, payload=payload, run_after=run_after or timezone.now())
+
+
+def worker_name():
+    return f'{os.uname().nodename}:{os.getpid()}:{threading.get_ident()}'
+
+
+def _due(now):
+    return Q(status=Job.PENDING, run_after__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+
+
+@retry_on_lock(model=Job)
+def claim(worker, limit):
+    """
+    Leases up to limit due jobs to worker, oldest first, and returns them.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        pks = list(
+            Job.objects.select_for_update(skip_locked=True).filter(_due(now))
+            .order_by('run_after', 'pk').values_list('pk', flat=True)[:limit]
+        )
+        if not pks:
+            return []
+        # Still due: another worker may have claimed some since, on
+        # databases without row locks.
+        Job.objects.filter(_due(now), pk__in=pks).update(
+            status=Job.RUNNING,
+            locked_by=worker,
+            locked_until=now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+            attempts=F('attempts') + 1,
+        )
+    return list(Job.objects.filter(pk__in=pks, status=Job.RUNNING, locked_by=worker).order_by('run_after', 'pk'))
+
+
+@lru_cache
+def _function(name):
+    return import_string(name)
+
+
+@retry_on_lock(model=Job)
+def _finish(job, **fields):
+    # Only while the job is still leased to this worker.
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by).update(locked_until=None, **fields)
+
+
+def run(job):
+    """
+    Runs a claimed job and records the outcome. Returns True if it succeeded.
+    """
+    try:
+        _function(job.name)(**job.payload)
+    except Exception as exc:
+        logger.exception('Job %s (%s) failed, attempt %d', job.pk, job.name, job.attempts)
+        error = f'{type(exc).__name__}: {exc}'
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            _finish(job, status=Job.FAILED, last_error=error, finished_at=timezone.now())
+        else:
+            backoff = settings.JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+            _finish(job, status=Job.PENDING, last_error=error, run_after=timezone.now() + timedelta(seconds=backoff))
+        return False
+    _finish(job, status=Job.DONE, finished_at=timezone.now())
+    return True
+
+
+def work(stop, batch_size=10, poll=1.0, drain=False, counts=None):
+    """
+    Claims and runs jobs until stop (a threading.Event) is set, waiting poll
+    seconds whenever none are due, or with drain until none are due.
+    counts, if given, is a dict of this thread's own whose 'done' and
+    'failed' are incremented.
+    """
+    worker = worker_name()
+    while not stop.is_set():
+        jobs = claim(worker, batch_size)
+        if not jobs:
+            if drain:
+                return
+            stop.wait(poll)
+            continue
+        for job in jobs:
+            ok = run(job)
+            if counts is not None:
+                counts['done' if ok else 'failed'] += 1
+
+
+def backlog(window=60):
+    """
+    Returns the queue's jobs by status, the age in seconds of the oldest
+    due job, and the jobs finished per second over the last window seconds.
+    """
+    now = timezone.now()
+    by_status = dict(Job.objects.values('status').annotate(count=Count('pk')).values_list('status', 'count'))
+    oldest = Job.objects.filter(status=Job.PENDING, run_after__lte=now).aggregate(oldest=Min('run_after'))['oldest']
+    finished = Job.objects.filter(status=Job.DONE, finished_at__gte=now - timedelta(seconds=window)).count()
+    return {
+        **{status: by_status.get(status, 0) for status, _ in Job.STATUS_CHOICES},
+        'oldest_due_seconds': (now - oldest).total_seconds() if oldest else 0.0,
+        'throughput': finished / window,
+    }
+
+
+def finished_jobs(now=None):
+    """
+    Returns the finished jobs older than JOB_RETENTION_HOURS.
+    """
+    now = now or timezone.now()
+    return Job.objects.filter(status=Job.DONE, finished_at__lt=now - timedelta(hours=settings.JOB_RETENTION_HOURS))
+
@@ -0,0 +1,198 @@
+"""
+Housekeeping for the tables that grow with traffic: expired sessions,
+abandoned carts, expired stock reservations and finished jobs, and the
+disk space they leave behind.
+
+Everything here runs while the site serves requests. Rows are deleted in
+small transactions so the SQLite write lock is never held for long, and
+a rate limit spaces the transactions out so requests get the lock in
+between.
+"""
+import time
+from collections import Counter
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DBSessionStore
+from django.contrib.sessions.models import Session
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from .db import retry_on_lock
+from .inventory import put_back
+from .jobs import finished_jobs
+from .models import Cart, Reservation
+
+
+class RateLimiter:
+    """
+    Sleeps as needed to keep work under rate units per second.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self._started = time.monotonic()
+        self._done = 0
+
+    def wait(self, units):
+        self._done += units
+        if self.rate:
+            ahead = self._done / self.rate - (time.monotonic() - self._started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def delete_in_batches(queryset, batch_size, limiter):
+    """
+    Deletes the rows of queryset batch_size at a time, each batch in its own
+    transaction, and returns how many rows were deleted (not counting
+    cascades).
+    """
+    model = queryset.model
+
+    @retry_on_lock(model=model)
+    def delete_batch():
+        with transaction.atomic(using=queryset.db):
+            pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if pks:
+                model._base_manager.using(queryset.db).filter(pk__in=pks).delete()
+            return len(pks)
+
+    deleted = 0
+    while True:
+        count = delete_batch()
+        deleted += count
+        if count < batch_size:
+            return deleted
+        limiter.wait(count)
+
+
+def database_sessions():
+    """
+    Returns True if sessions are kept in the django_session table.
+    """
+    return issubclass(import_module(settings.SESSION_ENGINE).SessionStore, DBSessionStore)
+
+
+def expired_sessions(now=None):
+    return Session.objects.filter(expire_date__lt=now or timezone.now())
+
+
+def abandoned_carts(now=None):
+    """
+    Returns the carts nobody can come back to: any left untouched for
+    CART_ABANDONED_DAYS and, with database sessions, those whose session
+    no longer exists.
+    """
+    now = now or timezone.now()
+    carts = Cart.objects.filter(updated_at__lt=now - timedelta(days=settings.CART_ABANDONED_DAYS))
+    if database_sessions():
+        carts |= Cart.objects.filter(session_key__isnull=False).exclude(
+            session_key__in=Session.objects.values('session_key'),
+        )
+    return carts
+
+
+def expire_reservations(batch_size, limiter, now=None):
+    """
+    Deletes expired stock reservations batch_size at a time, returning their
+    units to stock in the same transaction, and returns how many were
+    deleted. Reservations handed to an order never expire.
+    """
+    now = now or timezone.now()
+
+    @retry_on_lock(model=Reservation)
+    def expire_batch():
+        with transaction.atomic():
+            expired = list(
+                Reservation.objects.select_for_update().filter(expires_at__lt=now, order__isnull=True)
+                .values_list('pk', 'product_id', 'quantity')[:batch_size]
+            )
+            if expired:
+                Reservation.objects.filter(pk__in=[pk for pk, _, _ in expired]).delete()
+                units = Counter()
+                for _, product_id, quantity in expired:
+                    units[product_id] += quantity
+                for product_id, quantity in units.items():
+                    put_back(product_id, quantity)
+            return len(expired)
+
+    deleted = 0
+    while True:
+        count = expire_batch()
+        deleted += count
+        if count < batch_size:
+            return deleted
+        limiter.wait(count)
+
+
+def collect_garbage(batch_size=500, rate=5000):
+    """
+    Returns expired stock reservations to stock, then deletes expired
+    sessions, abandoned carts and finished jobs past their retention, at
+    most rate rows per second. Returns {'reservations': n, 'sessions': n,
+    'carts': n, 'jobs': n}; sessions is None when the session backend
+    expires its own.
+    """
+    limiter = RateLimiter(rate)
+    reservations = expire_reservations(batch_size, limiter)
+    sessions = None
+    if database_sessions():
+        # Sessions go first, so the carts they held count as orphaned.
+        sessions = delete_in_batches(expired_sessions(), batch_size, limiter)
+    else:
+        import_module(settings.SESSION_ENGINE).SessionStore.clear_expired()
+    carts = delete_in_batches(abandoned_carts(), batch_size, limiter)
+    jobs = delete_in_batches(finished_jobs(), batch_size, limiter)
+    return {'reservations': reservations, 'sessions': sessions, 'carts': carts, 'jobs': jobs}
+
+
+def _pragma(cursor, name):
+    cursor.execute(f'PRAGMA {name}')
+    return cursor.fetchone()[0]
+
+
+def database_pages(using=DEFAULT_DB_ALIAS):
+    """
+    Returns (page_size, page_count, freelist_count) of a SQLite database.
+    """
+    with connections[using].cursor() as cursor:
+        return tuple(_pragma(cursor, name) for name in ('page_size', 'page_count', 'freelist_count'))
+
+
+def incremental_vacuum(using=DEFAULT_DB_ALIAS, step=1024, pause=0.05):
+    """
+    Returns free pages to the file system step pages at a time, pausing
+    between steps, and returns how many pages were released.
+
+    Only works on databases in auto_vacuum=INCREMENTAL mode (new databases
+    are created in it, see SQLITE_PRAGMAS); returns None for others, which
+    need a full VACUUM once to switch.
+    """
+    released = 0
+    with connections[using].cursor() as cursor:
+        if _pragma(cursor, 'auto_vacuum') != 2:
+            return None
+        free = _pragma(cursor, 'freelist_count')
+        while free:
+            with transaction.atomic(using=using):
+                cursor.execute(f'PRAGMA incremental_vacuum({step})')
+                cursor.fetchall()
+            left = _pragma(cursor, 'freelist_count')
+            if left == free:
+                break
+            released += free - left
+            free = left
+            time.sleep(pause)
+    return released
+
+
+def full_vacuum(using=DEFAULT_DB_ALIAS, incremental=True):
+    """
+    Rebuilds the whole database file, switching it to incremental
+    auto-vacuum first if asked. Blocks writers until it finishes.
+    """
+    with connections[using].cursor() as cursor:
+        if incremental:
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
@@ -0,0 +1,39 @@
+import gzip
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from products import stylesheet
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates products/static/products/css/site.css from the utility classes used in the '
+        'templates. With --check, fails instead if the file is out of date or over CSS_BUDGET_BYTES.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Verify the stylesheet without writing it.')
+
+    def handle(self, *args, check, **options):
+        classes = stylesheet.collect_classes()
+        css = stylesheet.build(classes)
+        size = len(css.encode())
+        compressed = len(gzip.compress(css.encode(), 9))
+        if options['verbosity'] > 1:
+            self.stdout.write('Classes without CSS: ' + ', '.join(stylesheet.unknown_classes(classes)))
+
+        if size > settings.CSS_BUDGET_BYTES:
+            raise CommandError(
+                f'The stylesheet is {size} bytes, over the {settings.CSS_BUDGET_BYTES}-byte budget '
+                f'(CSS_BUDGET_BYTES).'
+            )
+        if check:
+            current = stylesheet.OUTPUT.read_text() if stylesheet.OUTPUT.exists() else None
+            if current != css:
+                raise CommandError(f'{stylesheet.OUTPUT} is out of date; run manage.py build_css.')
+            self.stdout.write(f'{stylesheet.OUTPUT.name} is up to date: {size} bytes, {compressed} gzipped.')
+            return
+        stylesheet.OUTPUT.parent.mkdir(parents=True, exist_ok=True)
+        stylesheet.OUTPUT.write_text(css)
+        self.stdout.write(f'Wrote {stylesheet.OUTPUT}: {size} bytes, {compressed} gzipped.')
@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.maintenance import collect_garbage, database_pages, full_vacuum, incremental_vacuum
+
+
+class Command(BaseCommand):
+    help = (
+        'Returns expired stock reservations to stock, deletes expired sessions, abandoned carts and '
+        'old finished jobs in small, rate-limited batches and returns freed space to the file '
+        'system, once or every --interval seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep running and collect this often, in seconds (default: collect once).',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows deleted per transaction.')
+        parser.add_argument('--rate', type=float, default=5000, help='At most this many rows deleted per second (0: no limit).')
+        parser.add_argument(
+            '--vacuum-every', type=float, default=3600,
+            help='Run an incremental vacuum at most this often, in seconds (0: after every collection).',
+        )
+        parser.add_argument(
+            '--full-vacuum', action='store_true',
+            help='Rebuild the database file with VACUUM, switching it to incremental auto-vacuum, '
+                 'then exit. Blocks writers while it runs; use in a quiet period.',
+        )
+
+    def handle(self, *args, interval, batch_size, rate, vacuum_every, **options):
+        if options['full_vacuum']:
+            self._full_vacuum()
+            return
+        last_vacuum = None
+        while True:
+            started = time.monotonic()
+            deleted = collect_garbage(batch_size=batch_size, rate=rate)
+            sessions = 'expired by the session backend' if deleted['sessions'] is None else deleted['sessions']
+            self.stdout.write(
+                f'Deleted {sessions} expired sessions and {deleted["carts"]} abandoned carts, '
+                f'released {deleted["reservations"]} expired stock reservations and deleted '
+                f'{deleted["jobs"]} finished jobs in {time.monotonic() - started:.1f}s'
+            )
+            if last_vacuum is None or time.monotonic() - last_vacuum >= vacuum_every:
+                self._incremental_vacuum()
+                last_vacuum = time.monotonic()
+            if not interval:
+                return
+            time.sleep(interval)
+
+    def _incremental_vacuum(self):
+        page_size, _, _ = database_pages()
+        released = incremental_vacuum()
+        if released is None:
+            self.stderr.write(
+                'The database is not in incremental auto-vacuum mode, so freed pages stay in the file. '
+                'Run `collect_garbage --full-vacuum` once to switch it.'
+            )
+        else:
+            self.stdout.write(f'Released {released} free pages ({released * page_size / 2**20:.1f} MiB)')
+
+    def _full_vacuum(self):
+        page_size, before, _ = database_pages()
+        full_vacuum()
+        _, after, _ = database_pages()
+        self.stdout.write(f'Vacuumed: {before} -> {after} pages ({(before - after) * page_size / 2**20:.1f} MiB reclaimed)')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from products.bulk import FORMATS, export_rows, guess_format, write_rows
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Writes every product to a CSV or JSON Lines file that import_products can read back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Default: standard output.')
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension, else CSV.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Rows fetched from the database at a time (default: 2000).',
+        )
+
+    def handle(self, *args, path, chunk_size, **options):
+        format = options['format'] or guess_format(path or '')
+        rows = export_rows(Product.objects.all(), chunk_size)
+        if path is None:
+            write_rows(self.stdout, rows, format)
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as output:
+            count = write_rows(output, rows, format)
+        self.stderr.write(f'Exported {count} products to {path}.')
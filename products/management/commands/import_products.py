@@ -0,0 +1,123 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products import images
+from products.bulk import FORMATS, RowError, batched, clean_row, guess_format, read_rows, upsert_batch
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates or updates products from a CSV or JSON Lines file with the columns '
+        'sku, name, description, price and image_url, matching existing products by sku.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per transaction (default: 1000).')
+        parser.add_argument(
+            '--checkpoint',
+            help='Progress file, rewritten after every batch (default: PATH.checkpoint). '
+                 'A later run resumes after the last committed batch.',
+        )
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint.')
+        parser.add_argument('--errors', help='Also write rejected rows, as JSON Lines, to this file.')
+        parser.add_argument(
+            '--max-errors', type=int, default=1000,
+            help='Stop after this many rejected rows in one run (default: 1000; 0 for no limit).',
+        )
+        parser.add_argument(
+            '--images', action='store_true',
+            help='Also download and resize new product images after each batch (needs Pillow).',
+        )
+        parser.add_argument(
+            '--image-workers', type=int, default=os.cpu_count(),
+            help='Processes resizing images with --images (default: one per CPU).',
+        )
+
+    def handle(self, *args, path, batch_size, restart, max_errors, **options):
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        if options['images'] and not images.available():
+            raise CommandError('--images needs Pillow: pip install Pillow')
+        format = options['format'] or guess_format(path)
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        # The totals so far, as of the last committed batch. errors_size is
+        # the length of the --errors file at that point.
+        progress = {'line': 0, 'created': 0, 'updated': 0, 'rejected': 0, 'images': 0, 'errors_size': None}
+        if not restart and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint:
+                progress.update(json.load(checkpoint))
+            self.stdout.write(f"Resuming after line {progress['line']} (from {checkpoint_path}).")
+
+        error_file = open(options['errors'], 'a') if options['errors'] else None
+        if error_file and progress['errors_size'] is not None and error_file.tell() > progress['errors_size']:
+            # Rows rejected after the checkpoint are read, and reported, again.
+            error_file.truncate(progress['errors_size'])
+        started = time.monotonic()
+        pool = ProcessPoolExecutor(options['image_workers']) if options['images'] else nullcontext()
+        try:
+            with open(path, newline='', encoding='utf-8-sig') as source, pool:
+                rows = self._clean(read_rows(source, format), progress, error_file, max_errors)
+                for batch in batched(rows, batch_size):
+                    created, updated = upsert_batch(row for _, row in batch)
+                    if options['images']:
+                        products = Product.objects.filter(sku__in=[row['sku'] for _, row in batch])
+                        progress['images'] += images.ingest(products.only(*images.INGEST_FIELDS), pool)[0]
+                    progress['line'] = batch[-1][0]
+                    progress['created'] += created
+                    progress['updated'] += updated
+                    if error_file:
+                        error_file.flush()
+                        progress['errors_size'] = error_file.tell()
+                    self._save_checkpoint(checkpoint_path, progress)
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f"  line {progress['line']}: {progress['created']} created, "
+                                          f"{progress['updated']} updated")
+        finally:
+            if error_file:
+                error_file.close()
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(
+            f"Imported {path} in {time.monotonic() - started:.1f}s: {progress['created']} created, "
+            f"{progress['updated']} updated, {progress['rejected']} rejected"
+            + (f", {progress['images']} images resized." if options['images'] else '.')
+        )
+
+    def _clean(self, rows, progress, error_file, max_errors):
+        """
+        Yields (line, values) for valid rows past the checkpoint, reporting
+        the others. Stops the import once max_errors rows were rejected in
+        this run.
+        """
+        rejected_before = progress['rejected']
+        for line, row in rows:
+            if line <= progress['line']:
+                continue
+            try:
+                yield line, clean_row(line, row)
+            except RowError as exc:
+                progress['rejected'] += 1
+                self.stderr.write(str(exc))
+                if error_file:
+                    error_file.write(json.dumps({'line': line, 'error': exc.message, 'row': row}, default=str) + '\n')
+                if max_errors and progress['rejected'] - rejected_before >= max_errors:
+                    raise CommandError(
+                        f'Stopped after {max_errors} rejected rows; rows up to line {progress["line"]} '
+                        f'are committed. Fix the file and run again to resume.'
+                    )
+
+    def _save_checkpoint(self, checkpoint_path, progress):
+        # Written to a temporary file and renamed, so a crash mid-write never
+        # leaves a truncated checkpoint behind.
+        temporary = f'{checkpoint_path}.tmp'
+        with open(temporary, 'w') as checkpoint:
+            json.dump(progress, checkpoint)
+        os.replace(temporary, checkpoint_path)
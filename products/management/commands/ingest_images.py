@@ -0,0 +1,39 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products import images
+
+
+class Command(BaseCommand):
+    help = (
+        'Downloads the product images not resized yet and writes their PRODUCT_IMAGE_WIDTHS '
+        'copies, in WebP and JPEG, resizing in a pool of processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Resizing processes (default: one per CPU).',
+        )
+        parser.add_argument('--batch-size', type=int, default=64, help='Products fetched and resized at a time (default: 64).')
+
+    def handle(self, *args, workers, batch_size, **options):
+        if not images.available():
+            raise CommandError('Resizing images needs Pillow: pip install Pillow')
+        if batch_size < 1 or workers < 1:
+            raise CommandError('--batch-size and --workers must be at least 1.')
+        started = time.monotonic()
+        ingested = failed = 0
+        with ProcessPoolExecutor(workers) as pool:
+            for batch in images.pending_batches(batch_size):
+                done, errors = images.ingest(batch, pool)
+                ingested += done
+                failed += errors
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'  up to product {batch[-1].pk}: {ingested} resized, {failed} failed')
+        self.stdout.write(
+            f'Resized {ingested} product images in {time.monotonic() - started:.1f}s; {failed} failed.'
+        )
@@ -0,0 +1,73 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from products import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs queued background jobs, such as order confirmations, in a pool of worker threads, '
+        'reporting throughput and backlog every --report seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Worker threads (default: 4).')
+        parser.add_argument('--batch-size', type=int, default=10, help='Jobs a worker claims at a time (default: 10).')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to wait when no job is due (default: 1).')
+        parser.add_argument('--drain', action='store_true', help='Exit once no job is due instead of waiting for more.')
+        parser.add_argument(
+            '--report', type=float, default=60,
+            help='Print throughput and backlog this often, in seconds (0: only on exit).',
+        )
+
+    def handle(self, *args, workers, batch_size, poll, drain, report, **options):
+        if workers < 1 or batch_size < 1:
+            raise CommandError('--workers and --batch-size must be at least 1.')
+        stop = threading.Event()
+        counts = [{'done': 0, 'failed': 0} for _ in range(workers)]
+        threads = [
+            threading.Thread(
+                target=self._work, args=(stop,), daemon=True,
+                kwargs={'batch_size': batch_size, 'poll': poll, 'drain': drain, 'counts': thread_counts},
+            )
+            for thread_counts in counts
+        ]
+        started = last_report = time.monotonic()
+        reported = 0
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.1)
+                if report and time.monotonic() - last_report >= report:
+                    reported = self._report(counts, reported, time.monotonic() - last_report)
+                    last_report = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        done = sum(thread_counts['done'] for thread_counts in counts)
+        failed = sum(thread_counts['failed'] for thread_counts in counts)
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'Ran {done + failed} jobs in {elapsed:.1f}s ({(done + failed) / elapsed:.1f}/s), {failed} failed')
+
+    def _work(self, stop, **options):
+        try:
+            jobs.work(stop, **options)
+        finally:
+            connections.close_all()
+
+    def _report(self, counts, reported, elapsed):
+        ran = sum(thread_counts['done'] + thread_counts['failed'] for thread_counts in counts)
+        backlog = jobs.backlog()
+        self.stdout.write(
+            f'{(ran - reported) / elapsed:.1f} jobs/s; {backlog["pending"]} pending '
+            f'(oldest due {backlog["oldest_due_seconds"]:.0f}s ago), {backlog["running"]} running, '
+            f'{backlog["failed"]} failed'
+        )
+        return ran
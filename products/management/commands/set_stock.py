@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products import inventory
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Sets how many units of a product can still be reserved by carts, or stops tracking its '
+        'stock, and shows its stock level.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('product', help='Product SKU, or id.')
+        parser.add_argument(
+            'quantity', nargs='?',
+            help="Units available, on top of those reserved; 'none' stops tracking. Omit to show the stock.",
+        )
+        parser.add_argument(
+            '--shards', type=int, default=1,
+            help='Rows to spread the stock over, for products many carts reserve at once (default: 1).',
+        )
+
+    def handle(self, *args, product, quantity, shards, **options):
+        product_id = (
+            Product.objects.filter(sku=product).values_list('pk', flat=True).first()
+            or (product.isdigit() and Product.objects.filter(pk=product).values_list('pk', flat=True).first())
+        )
+        if not product_id:
+            raise CommandError(f'No product with SKU or id {product}.')
+        if shards < 1:
+            raise CommandError('--shards must be at least 1.')
+        if quantity is not None:
+            if quantity.lower() == 'none':
+                quantity = None
+            elif not quantity.isdigit():
+                raise CommandError("quantity must be a number of units or 'none'.")
+            inventory.set_stock(product_id, None if quantity is None else int(quantity), shards)
+        available = inventory.stock_levels([product_id]).get(product_id)
+        if available is None:
+            self.stdout.write(f'Product {product_id}: stock not tracked')
+        else:
+            self.stdout.write(f'Product {product_id}: {available} units available')
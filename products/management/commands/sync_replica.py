@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.replication import sync_replica
+
+
+class Command(BaseCommand):
+    help = 'Copies the primary database onto the read replica, once or every --interval seconds.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep running and resync this often, in seconds (default: sync once).',
+        )
+
+    def handle(self, *args, interval, **options):
+        while True:
+            started = time.monotonic()
+            try:
+                replica = sync_replica()
+            except ValueError as exc:
+                raise CommandError(exc)
+            if options['verbosity'] > 1 or not interval:
+                self.stdout.write(f'Synced {replica!r} in {time.monotonic() - started:.3f}s')
+            if not interval:
+                return
+            time.sleep(interval)
@@ -0,0 +1,299 @@
+"""
+In-process request metrics: database queries and time, template rendering
+and session saves, recorded per view into log-linear histograms and served
+in the Prometheus text format by the metrics view.
+
+PerformanceMiddleware opens a RequestMetrics for each request. Queries are
+counted by a wrapper installed on every database connection, templates by
+the TimedDjangoTemplates backend and session saves by products.sessions;
+each reports to the current request through a context variable, so work
+done outside a request (or in a background thread) is not counted.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_metrics', default=None)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """
+    A histogram of non-negative integers in the style of HdrHistogram.
+
+    Values below 2**SUB_BITS are counted exactly; larger ones fall into
+    buckets 2**(SUB_BITS - 1) to an octave, so any recorded value is known to
+    within 1/64 of itself. Buckets are kept sparsely, so a histogram costs
+    a few hundred bytes whatever the range of its values, and recording is
+    constant time.
+    """
+    SUB_BITS = 7
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def _bucket(cls, value):
+        shift = max(value.bit_length() - cls.SUB_BITS, 0)
+        return (shift << cls.SUB_BITS) | (value >> shift)
+
+    @classmethod
+    def _highest_equivalent(cls, bucket):
+        shift = bucket >> cls.SUB_BITS
+        mantissa = bucket & ((1 << cls.SUB_BITS) - 1)
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value):
+        value = max(int(value), 0)
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """
+        Returns the value below which a fraction q (0-1) of the recorded
+        values fall, rounded up to the top of its bucket.
+        """
+        if not self.count:
+            return 0
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self._highest_equivalent(bucket), self.max)
+        return self.max
+
+
+class RequestMetrics:
+    """
+    What one request spent, in seconds, and the SQL statements it ran.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+        self.session_time = 0.0
+        self.statements = {}
+        self._template_depth = 0
+
+    def repeated_statement(self):
+        """
+        Returns (sql, times) for the statement run most often, or (None, 0).
+        """
+        if not self.statements:
+            return None, 0
+        sql = max(self.statements, key=self.statements.get)
+        return sql, self.statements[sql]
+
+
+def current():
+    """
+    Returns the RequestMetrics of the request being served, or None.
+    """
+    return _current.get()
+
+
+@contextmanager
+def collecting():
+    """
+    Collects metrics for the enclosed code, yielding its RequestMetrics.
+    """
+    request_metrics = RequestMetrics()
+    token = _current.set(request_metrics)
+    try:
+        yield request_metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed_session_save():
+    request_metrics = _current.get()
+    if request_metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_metrics.session_time += time.perf_counter() - start
+
+
+def time_query(execute, sql, params, many, context):
+    """
+    A database execute wrapper that counts statements for the current request.
+    """
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.query_time += time.perf_counter() - start
+        request_metrics.queries += 1
+        request_metrics.statements[sql] = request_metrics.statements.get(sql, 0) + 1
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    connection_created receiver that adds time_query to a new connection.
+    """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        request_metrics = _current.get()
+        if request_metrics is None:
+            return super().render(context, request)
+        # Templates rendered while another one renders are part of its time.
+        request_metrics._template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            request_metrics._template_depth -= 1
+            if not request_metrics._template_depth:
+                request_metrics.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing each render for the current request.
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+# (metric, help, unit) for each histogram kept per view; times are recorded
+# in microseconds and exported in seconds.
+VIEW_HISTOGRAMS = (
+    ('request_duration_seconds', 'Time to serve a request, through every middleware.', 1e-6),
+    ('db_queries', 'Database queries per request.', 1),
+    ('db_query_seconds', 'Time spent in database queries per request.', 1e-6),
+    ('template_render_seconds', 'Time spent rendering templates per request.', 1e-6),
+    ('session_save_seconds', 'Time spent saving the session per request.', 1e-6),
+)
+
+
+class MetricsRegistry:
+    """
+    Per-process histograms of RequestMetrics, by view name.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+        self._n_plus_one = {}
+
+    def observe(self, view, request_metrics, duration, n_plus_one=False):
+        values = (
+            duration * 1e6,
+            request_metrics.queries,
+            request_metrics.query_time * 1e6,
+            request_metrics.template_time * 1e6,
+            request_metrics.session_time * 1e6,
+        )
+        with self._lock:
+            histograms = self._views.get(view)
+            if histograms is None:
+                histograms = self._views[view] = [Histogram() for _ in VIEW_HISTOGRAMS]
+            for histogram, value in zip(histograms, values):
+                histogram.record(value)
+            if n_plus_one:
+                self._n_plus_one[view] = self._n_plus_one.get(view, 0) + 1
+
+    def histogram(self, view, metric):
+        names = [name for name, _, _ in VIEW_HISTOGRAMS]
+        with self._lock:
+            return self._views[view][names.index(metric)]
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+            self._n_plus_one.clear()
+
+    def prometheus(self, cache_stats=None, job_stats=None):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        Histograms are exported as summaries with QUANTILES. job_stats is
+        the job queue's products.jobs.backlog().
+        """
+        lines = []
+        with self._lock:
+            for index, (name, help_text, unit) in enumerate(VIEW_HISTOGRAMS):
+                lines.append(f'# HELP ecom_{name} {help_text}')
+                lines.append(f'# TYPE ecom_{name} summary')
+                for view, histograms in sorted(self._views.items()):
+                    histogram = histograms[index]
+                    label = f'view="{_escape(view)}"'
+                    for q in QUANTILES:
+                        lines.append(f'ecom_{name}{{{label},quantile="{q}"}} {_number(histogram.percentile(q) * unit)}')
+                    lines.append(f'ecom_{name}_sum{{{label}}} {_number(histogram.total * unit)}')
+                    lines.append(f'ecom_{name}_count{{{label}}} {histogram.count}')
+            lines.append('# HELP ecom_n_plus_one_total Requests that repeated one SQL statement past METRICS_N_PLUS_ONE_THRESHOLD.')
+            lines.append('# TYPE ecom_n_plus_one_total counter')
+            for view, count in sorted(self._n_plus_one.items()):
+                lines.append(f'ecom_n_plus_one_total{{view="{_escape(view)}"}} {count}')
+        if cache_stats is not None:
+            lines.append('# HELP ecom_catalog_cache_requests_total Catalog cache lookups by namespace and result.')
+            lines.append('# TYPE ecom_catalog_cache_requests_total counter')
+            for namespace, counts in sorted(cache_stats.items()):
+                for result, key in (('hit', 'hits'), ('miss', 'misses')):
+                    lines.append(
+                        f'ecom_catalog_cache_requests_total{{namespace="{_escape(namespace)}",result="{result}"}} {counts[key]}'
+                    )
+        if job_stats is not None:
+            lines.append('# HELP ecom_jobs Jobs in the queue by status.')
+            lines.append('# TYPE ecom_jobs gauge')
+            for status, count in job_stats.items():
+                if status not in ('oldest_due_seconds', 'throughput'):
+                    lines.append(f'ecom_jobs{{status="{_escape(status)}"}} {count}')
+            lines.append('# HELP ecom_jobs_oldest_due_seconds How long the oldest due job has been waiting for a worker.')
+            lines.append('# TYPE ecom_jobs_oldest_due_seconds gauge')
+            lines.append(f'ecom_jobs_oldest_due_seconds {_number(job_stats["oldest_due_seconds"])}')
+            lines.append('# HELP ecom_jobs_throughput Jobs finished per second over the last minute.')
+            lines.append('# TYPE ecom_jobs_throughput gauge')
+            lines.append(f'ecom_jobs_throughput {_number(job_stats["throughput"])}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+metrics = MetricsRegistry()
+
+
+def server_timing(request_metrics, duration):
+    """
+    Returns a Server-Timing header value for a request.
+    """
+    return ', '.join([
+        f'db;dur={request_metrics.query_time * 1000:.2f};desc="{request_metrics.queries} queries"',
+        f'tpl;dur={request_metrics.template_time * 1000:.2f}',
+        f'session;dur={request_metrics.session_time * 1000:.2f}',
+        f'total;dur={duration * 1000:.2f}',
+    ])
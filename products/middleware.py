@@ -0,0 +1,148 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from .cart_storage import get_cart_storage
+from .metrics import collecting, metrics, server_timing
+from .routers import _pinned_until
+
+logger = logging.getLogger(__name__)
+
+
+class PerformanceMiddleware:
+    """
+    Records each request's duration, database queries and time, template
+    render time and session save time into per-view histograms (see
+    products.metrics), and reports them in a Server-Timing header.
+
+    Must come first in MIDDLEWARE so that the time of every other
+    middleware, including the session save, is counted. Requests that run
+    one SQL statement METRICS_N_PLUS_ONE_THRESHOLD times or more are logged
+    as likely N+1 queries.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with collecting() as request_metrics:
+            response = self.get_response(request)
+        self._record(request, response, request_metrics, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with collecting() as request_metrics:
+            response = await self.get_response(request)
+        self._record(request, response, request_metrics, time.perf_counter() - start)
+        return response
+
+    def _record(self, request, response, request_metrics, duration):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else '<unresolved>'
+        sql, times = request_metrics.repeated_statement()
+        n_plus_one = times >= settings.METRICS_N_PLUS_ONE_THRESHOLD
+        if n_plus_one:
+            logger.warning('Possible N+1 queries in %s: %d runs of %s', view, times, sql)
+        metrics.observe(view, request_metrics, duration, n_plus_one)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = server_timing(request_metrics, duration)
+
+
+class CartMiddleware:
+    """
+    Persists the request's cart, if a view changed it, through the storage
+    backend selected by the CART_STORAGE setting.
+
+    Must come after SessionMiddleware so that carts kept in the session are
+    written before the session is saved. Works in both sync and async
+    middleware chains, so it does not force async views onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        cart = getattr(request, '_cart', None)
+        if cart is not None and cart.modified:
+            get_cart_storage().save_cart(request, response, cart)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        cart = getattr(request, '_cart', None)
+        if cart is not None and cart.modified:
+            await sync_to_async(get_cart_storage().save_cart)(request, response, cart)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """
+    Carries "read from the primary" across requests in a cookie, so that
+    after someone changes a product their next few page loads do not come from
+    a replica that has not caught up yet.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        pinned_until, token = self._pin(request)
+        try:
+            response = self.get_response(request)
+            self._set_cookie(response, pinned_until)
+        finally:
+            _pinned_until.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        pinned_until, token = self._pin(request)
+        try:
+            response = await self.get_response(request)
+            self._set_cookie(response, pinned_until)
+        finally:
+            _pinned_until.reset(token)
+        return response
+
+    def _pin(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(settings.REPLICA_STICKY_COOKIE_NAME, 0))
+        except ValueError:
+            pinned_until = 0.0
+        # The cookie can only send reads to the primary, never skip it, so
+        # it is not signed; it is capped so it cannot pin indefinitely.
+        pinned_until = min(pinned_until, time.time() + settings.REPLICA_STICKY_SECONDS)
+        return pinned_until, _pinned_until.set(pinned_until)
+
+    def _set_cookie(self, response, pinned_until):
+        if _pinned_until.get() > pinned_until:
+            pinned_until = _pinned_until.get()
+            response.set_cookie(
+                settings.REPLICA_STICKY_COOKIE_NAME,
+                f'{pinned_until:.3f}',
+                max_age=int(pinned_until - time.time()),
+                httponly=True,
+                samesite='Lax',
+            )
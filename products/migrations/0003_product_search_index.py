@@ -0,0 +1,54 @@
+from django.db import migrations
+
+# An external-content FTS5 index of products_product, kept in step by
+# triggers; see products.search. The SQL is inlined so that this migration
+# keeps working however products.search changes.
+CREATE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS products_product_fts_ai AFTER INSERT ON products_product BEGIN
+        INSERT INTO products_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_product_fts_ad AFTER DELETE ON products_product BEGIN
+        INSERT INTO products_product_fts(products_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_product_fts_au AFTER UPDATE OF name, description ON products_product BEGIN
+        INSERT INTO products_product_fts(products_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_catalog_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            [
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS products_product_fts USING fts5(
+                    name, description,
+                    content='products_product', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                )
+                """,
+                *CREATE_TRIGGERS,
+                "INSERT INTO products_product_fts(products_product_fts) VALUES ('rebuild')",
+            ],
+            [
+                'DROP TRIGGER IF EXISTS products_product_fts_ai',
+                'DROP TRIGGER IF EXISTS products_product_fts_ad',
+                'DROP TRIGGER IF EXISTS products_product_fts_au',
+                'DROP TABLE IF EXISTS products_product_fts',
+            ],
+        ),
+    ]
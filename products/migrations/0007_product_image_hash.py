@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_cart'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_source_url',
+            field=models.URLField(blank=True, editable=False, max_length=500, null=True),
+        ),
+    ]
@@ -1,23 +1,224 @@
+import uuid
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
+
+from .cache import schedule_catalog_bump
+
+class ProductQuerySet(models.QuerySet):
+    """
+    Bulk writes bypass model signals, so they invalidate the catalog cache here.
+    bulk_update() and queryset delete() are covered through update() and the
+    post_delete signal respectively. update() also stamps updated_at, which
+    auto_now only does for save().
+    """
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        rows = super().update(**kwargs)
+        if rows:
+            schedule_catalog_bump(self.db)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            schedule_catalog_bump(self.db)
+        return objs
 
 class Product(models.Model):
     """
     Represents a product in the e-commerce store.
     """
+    # Natural key for bulk imports; products created by hand may have none.
+    sku = models.CharField(max_length=64, unique=True, blank=True, null=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image_url = models.URLField(max_length=500, blank=True, null=True)
+    # Set by products.images.ingest: the content hash naming the resized
+    # copies of the image, and the image_url they were made from.
+    image_hash = models.CharField(max_length=32, blank=True, null=True, editable=False)
+    image_source_url = models.URLField(max_length=500, blank=True, null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Composite keys backing the keyset-paginated catalog orderings.
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # Lets a later save() tell whether the image changed.
+        product._loaded_image_url = product.__dict__.get('image_url')
+        return product
+
+    @property
+    def image_changed(self):
+        """
+        True if image_url was set or changed since the product was loaded.
+        """
+        return bool(self.image_url) and self.image_url != getattr(self, '_loaded_image_url', None)
+
+    @property
+    def image_digest(self):
+        """
+        The image_hash of the resized copies of the current image_url, or
+        None while the image has not been ingested.
+        """
+        if self.image_hash and self.image_source_url == self.image_url:
+            return self.image_hash
+        return None
+
+class Cart(models.Model):
+    """
+    A server-side shopping cart, owned by a user or, for anonymous visitors,
+    by a session. Used when CART_STORAGE is 'database'.
+    """
+    session_key = models.CharField(max_length=40, unique=True, blank=True, null=True)
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Touched by every change to the cart's items.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Cart {self.pk}"
+
 class CartItem(models.Model):
     """
     Represents an item in the user's shopping cart.
     """
+    cart = models.ForeignKey(Cart, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            # One line per product, which also indexes lookups by cart.
+            models.UniqueConstraint(fields=['cart', 'product'], name='cartitem_cart_product_uniq'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
+
+class Stock(models.Model):
+    """
+    Units of a product that can still be reserved, split over one or more
+    shard rows (see products.inventory). Products without any are not
+    stock-tracked and never run out.
+    """
+    product = models.ForeignKey(Product, related_name='stock', on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='stock_product_shard_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} (shard {self.shard})"
+
+class Reservation(models.Model):
+    """
+    Units of a product taken out of Stock for a cart, until expires_at.
+    holder is the cart's owner, 'user:<id>' or 'session:<key>', or once
+    checked out 'order:<id>'.
+    """
+    holder = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    # Set at checkout: the units are sold to the order and no longer expire.
+    order = models.ForeignKey('Order', blank=True, null=True, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['holder', 'product'], name='reservation_holder_product_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for {self.holder}"
+
+class Order(models.Model):
+    """
+    A checked-out cart, with the prices it was placed at. Placed by
+    products.orders.place_order, once per idempotency_key.
+    """
+    PLACED = 'placed'
+    CONFIRMED = 'confirmed'
+    STATUS_CHOICES = [(PLACED, 'Placed'), (CONFIRMED, 'Confirmed')]
+
+    # Public reference, used in URLs instead of the id.
+    number = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    # The Reservation holder of the cart it was placed from.
+    holder = models.CharField(max_length=64)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True, on_delete=models.SET_NULL)
+    email = models.EmailField(blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PLACED)
+    total = models.DecimalField(max_digits=12, decimal_places=2)
+    item_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    confirmed_at = models.DateTimeField(blank=True, null=True)
+    emailed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Order {self.number}"
+
+class OrderLine(models.Model):
+    """
+    A product of an Order, with its name and price at checkout.
+    """
+    order = models.ForeignKey(Order, related_name='lines', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, blank=True, null=True, on_delete=models.SET_NULL)
+    name = models.CharField(max_length=200)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.quantity} x {self.name}"
+
+    @property
+    def subtotal(self):
+        return self.unit_price * self.quantity
+
+class Job(models.Model):
+    """
+    A unit of background work, run by `manage.py run_jobs`; see products.jobs.
+    name is the dotted path of the function to call with payload.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    # The worker holding a running job, and until when.
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Workers look for due jobs by status and run_after.
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
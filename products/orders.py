@@ -0,0 +1,132 @@
+"""
+Checkout.
+
+place_order() turns a cart into an Order in one short transaction: the
+order and its lines are written, the cart's stock reservations are handed
+to the order so they no longer expire, and the rest of the work is queued
+as jobs (see products.jobs) to run after the response: finalize_order()
+settles the reserved stock and confirms the order, send_confirmation()
+emails the customer.
+
+Each checkout carries an idempotency key, which the cart page renders into
+its form and API clients send as an Idempotency-Key header. Repeating a
+checkout with the same key returns the order it placed the first time, so
+a double click or a retried request never places a second order.
+"""
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import IntegrityError, transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import jobs
+from .cart import CartError, OutOfStock
+from .inventory import hold_cart, put_back
+from .models import Order, OrderLine, Reservation
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+
+class EmptyCart(CartError):
+    def __init__(self):
+        super().__init__('Your cart is empty')
+
+
+class IdempotencyKeyReused(CartError):
+    status_code = 422
+
+    def __init__(self):
+        super().__init__('This idempotency key was used for another order')
+
+
+def place_order(cart, key, email='', user=None):
+    """
+    Places an order for the cart, once per idempotency key, and empties the
+    cart. Returns (order, created); created is False when key already placed
+    an order for the same holder. Raises EmptyCart, OutOfStock when a
+    stock-tracked line can no longer be held, and IdempotencyKeyReused.
+    """
+    holder = cart.holder()
+    existing = Order.objects.filter(idempotency_key=key).first()
+    if existing is not None:
+        return _replayed(existing, holder), False
+
+    lines = cart.lines()
+    if not lines:
+        raise EmptyCart
+    # Lines whose reservation expired are reserved again, if there is stock.
+    short = hold_cart(cart)
+    if short:
+        product_id, available = next(iter(short.items()))
+        raise OutOfStock(product_id, available)
+
+    try:
+        with transaction.atomic():
+            order = Order.objects.create(
+                idempotency_key=key,
+                holder=holder,
+                user=user,
+                email=email,
+                total=cart.totals.total_price,
+                item_count=cart.totals.item_count,
+            )
+            OrderLine.objects.bulk_create(
+                OrderLine(order=order, product_id=line.product_id, name=line.name, unit_price=line.price, quantity=line.quantity)
+                for line in lines
+            )
+            Reservation.objects.filter(holder=holder, product_id__in=[line.product_id for line in lines]).update(
+                holder=f'order:{order.pk}', order=order,
+            )
+            jobs.enqueue('products.orders.finalize_order', order_id=order.pk)
+            if email:
+                jobs.enqueue('products.orders.send_confirmation', order_id=order.pk)
+    except IntegrityError:
+        # A concurrent request with the same key placed it first, unless the
+        # error came from another constraint.
+        order = Order.objects.filter(idempotency_key=key).first()
+        if order is None:
+            raise
+        return _replayed(order, holder), False
+    cart.clear()
+    return order, True
+
+
+def _replayed(order, holder):
+    if order.holder != holder:
+        raise IdempotencyKeyReused
+    return order
+
+
+def finalize_order(order_id):
+    """
+    Job: turns an order's reservations into sales, returning any units
+    reserved beyond the quantities ordered to stock, and confirms the order.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(pk=order_id, status=Order.PLACED).first()
+        if order is None:
+            return
+        ordered = dict(order.lines.values_list('product_id', 'quantity'))
+        for product_id, quantity in Reservation.objects.filter(order=order).values_list('product_id', 'quantity'):
+            excess = quantity - ordered.get(product_id, 0)
+            if excess > 0:
+                put_back(product_id, excess)
+        Reservation.objects.filter(order=order).delete()
+        order.status = Order.CONFIRMED
+        order.confirmed_at = timezone.now()
+        order.save(update_fields=['status', 'confirmed_at'])
+
+
+def send_confirmation(order_id):
+    """
+    Job: emails the order's summary to its email address, once.
+    """
+    order = Order.objects.filter(pk=order_id, emailed_at__isnull=True).exclude(email='').first()
+    if order is None:
+        return
+    body = render_to_string('products/emails/order_confirmation.txt', {
+        'order': order,
+        'lines': order.lines.all(),
+    })
+    send_mail(f'Your order {order.number}', body, settings.DEFAULT_FROM_EMAIL, [order.email])
+    Order.objects.filter(pk=order.pk).update(emailed_at=timezone.now())
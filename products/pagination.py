@@ -0,0 +1,251 @@
+import base64
+import binascii
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a cursor cannot be decoded or does not match the ordering.
+    """
+
+
+# Public ordering name -> (sort field, descending). Every ordering is made
+# total by using the primary key as a tie-breaker, which is what makes
+# seeking past the last row of a page exact.
+ORDERINGS = {
+    'name': ('name', False),
+    '-name': ('name', True),
+    'price': ('price', False),
+    '-price': ('price', True),
+}
+DEFAULT_ORDERING = 'name'
+
+
+def get_page_size(value, default=None, maximum=None):
+    """
+    Returns a page size from a query-string value, clamped to maximum;
+    default and maximum are the catalog's unless given.
+    """
+    default = default or settings.CATALOG_PAGE_SIZE
+    maximum = maximum or settings.CATALOG_MAX_PAGE_SIZE
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return min(default, maximum)
+    return max(1, min(size, maximum))
+
+
+def encode_cursor(ordering, key, backwards=False):
+    """
+    Packs an ordering, the (value, id) key of a boundary row and a direction into an opaque token.
+    """
+    value, pk = key
+    payload = [ordering, str(value), pk, 1 if backwards else 0]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, ordering):
+    """
+    Unpacks a cursor produced by encode_cursor, returning ((value, id), backwards).
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        cursor_ordering, value, pk, backwards = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor('Malformed cursor')
+    if cursor_ordering != ordering or not isinstance(pk, int):
+        raise InvalidCursor('Cursor does not match the requested ordering')
+    field, _ = ORDERINGS[ordering]
+    if field == 'price':
+        try:
+            value = Decimal(value)
+        except InvalidOperation:
+            raise InvalidCursor('Malformed cursor')
+    return (value, pk), bool(backwards)
+
+
+class KeysetPage:
+    """
+    One page of keyset-paginated results with cursors for its neighbours.
+    """
+    def __init__(self, items, ordering, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.ordering = ordering
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetStream:
+    """
+    The rows of one forward page, fetched from the database chunk_size at a
+    time as they are iterated (with async for under ASGI) rather than all at
+    once. Once iterated, page is the KeysetPage of the rows seen, without
+    its items, for the links to its neighbours.
+    """
+    def __init__(self, paginator, queryset, key, chunk_size):
+        self.paginator = paginator
+        self.queryset = queryset
+        self.key = key
+        self.chunk_size = chunk_size
+        self.page = None
+
+    def _finish(self, first, last, has_more):
+        paginator = self.paginator
+        next_cursor = previous_cursor = None
+        if last is not None and has_more:
+            next_cursor = encode_cursor(paginator.ordering, paginator._key(last))
+        if first is not None and self.key is not None:
+            previous_cursor = encode_cursor(paginator.ordering, paginator._key(first), backwards=True)
+        self.page = KeysetPage([], paginator.ordering, next_cursor, previous_cursor)
+
+    def __iter__(self):
+        first = last = None
+        count, has_more = 0, False
+        # The queryset holds one extra row, which only tells whether there is more.
+        for row in self.queryset.iterator(chunk_size=self.chunk_size):
+            if count == self.paginator.page_size:
+                has_more = True
+                break
+            if first is None:
+                first = row
+            last = row
+            count += 1
+            yield row
+        self._finish(first, last, has_more)
+
+    async def __aiter__(self):
+        first = last = None
+        count, has_more = 0, False
+        # The queryset holds one extra row, which only tells whether there is more.
+        async for row in self.queryset.aiterator(chunk_size=self.chunk_size):
+            if count == self.paginator.page_size:
+                has_more = True
+                break
+            if first is None:
+                first = row
+            last = row
+            count += 1
+            yield row
+        self._finish(first, last, has_more)
+
+
+class KeysetPaginator:
+    """
+    Seek pagination over a queryset ordered by (field, id).
+
+    Unlike OFFSET pagination, each page is fetched with a range predicate on
+    the boundary row of the previous page, so the cost of a page does not
+    depend on how deep into the catalog it is, provided there is an index on
+    (field, id).
+
+    key, for querysets of values rather than models, returns the (field, id)
+    of a row.
+    """
+    def __init__(self, queryset, ordering=DEFAULT_ORDERING, page_size=None, key=None):
+        if ordering not in ORDERINGS:
+            ordering = DEFAULT_ORDERING
+        self.queryset = queryset
+        self.ordering = ordering
+        self.field, self.descending = ORDERINGS[ordering]
+        self.page_size = page_size or get_page_size(None)
+        if key is not None:
+            self._key = key
+
+    def _seek(self, queryset, key, forwards):
+        value, pk = key
+        # Moving forwards through a descending ordering (or backwards through
+        # an ascending one) means looking for smaller keys.
+        op = 'lt' if forwards == self.descending else 'gt'
+        # The redundant inclusive bound is what lets SQLite walk the (field, id)
+        # index in order from the cursor instead of sorting every match.
+        return queryset.filter(
+            Q(**{f'{self.field}__{op}e': value}),
+            Q(**{f'{self.field}__{op}': value}) | Q(**{f'pk__{op}': pk}),
+        )
+
+    def _order(self, queryset, forwards):
+        descending = self.descending if forwards else not self.descending
+        prefix = '-' if descending else ''
+        return queryset.order_by(f'{prefix}{self.field}', f'{prefix}pk')
+
+    def _key(self, obj):
+        return getattr(obj, self.field), obj.pk
+
+    def _query(self, cursor):
+        key, backwards = decode_cursor(cursor, self.ordering) if cursor else (None, False)
+        forwards = not backwards
+        queryset = self._order(self.queryset, forwards)
+        if key is not None:
+            queryset = self._seek(queryset, key, forwards)
+        # Fetch one extra row to learn whether there is more in this direction
+        # without a separate COUNT query.
+        return queryset[:self.page_size + 1], key, backwards
+
+    def _page(self, rows, key, backwards):
+        forwards = not backwards
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or backwards:
+                next_cursor = encode_cursor(self.ordering, self._key(rows[-1]))
+            if key is not None and (has_more or forwards):
+                previous_cursor = encode_cursor(self.ordering, self._key(rows[0]), backwards=True)
+        return KeysetPage(rows, self.ordering, next_cursor, previous_cursor)
+
+    def page(self, cursor=None):
+        """
+        Returns the page after (or, for a backwards cursor, before) the cursor.
+        Raises InvalidCursor for tokens that were not issued for this ordering.
+        """
+        queryset, key, backwards = self._query(cursor)
+        rows = list(queryset)
+        if backwards and len(rows) <= self.page_size:
+            # Walked back to the start: serve a full first page rather than
+            # the short remainder.
+            return self.page()
+        return self._page(rows, key, backwards)
+
+    async def apage(self, cursor=None):
+        """
+        Async version of page().
+        """
+        queryset, key, backwards = self._query(cursor)
+        rows = [row async for row in queryset]
+        if backwards and len(rows) <= self.page_size:
+            return await self.apage()
+        return self._page(rows, key, backwards)
+
+    def stream(self, cursor=None, chunk_size=100):
+        """
+        Returns the page after the cursor as a KeysetStream, or None for a
+        backwards cursor, whose rows are fetched in reverse order and so
+        cannot be sent as they arrive; use page() for those. Raises
+        InvalidCursor like page().
+        """
+        queryset, key, backwards = self._query(cursor)
+        if backwards:
+            return None
+        return KeysetStream(self, queryset, key, chunk_size)
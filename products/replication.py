@@ -0,0 +1,40 @@
+import sqlite3
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .cache import bump_catalog_version
+
+
+def copy_database(source_path, target_path, pages=-1):
+    """
+    Copies a SQLite database onto another with the online backup API.
+
+    The copy is a consistent snapshot of the source, taken without blocking
+    its writers under WAL, and connections reading the target see it switch
+    over between transactions.
+    """
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages)
+    finally:
+        target.close()
+        source.close()
+
+
+def sync_replica(replica=None):
+    """
+    Refreshes the read replica from the primary and returns its alias.
+
+    Stands in for real replication in development and single-host setups.
+    The catalog version is bumped afterwards: pages rendered from the replica
+    while it lagged behind a product change were cached under the version
+    that change bumped to, and must not outlive the catalog they show.
+    """
+    replica = replica or settings.READ_REPLICA_ALIAS
+    if not replica:
+        raise ValueError('No read replica is configured; set DATABASE_REPLICA_PATH.')
+    copy_database(settings.DATABASES[DEFAULT_DB_ALIAS]['NAME'], settings.DATABASES[replica]['NAME'])
+    bump_catalog_version()
+    return replica
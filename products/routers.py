@@ -0,0 +1,59 @@
+import contextvars
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Until when (a Unix timestamp) reads in the current request must go to the
+# primary. Set from a cookie by ReplicaPinMiddleware, and extended whenever
+# the request writes a replicated model.
+_pinned_until = contextvars.ContextVar('pinned_until', default=0.0)
+
+
+def pin_to_primary(seconds=None):
+    """
+    Sends this request's replicated reads to the primary for the next seconds
+    (REPLICA_STICKY_SECONDS by default), covering the replica's lag.
+    """
+    if seconds is None:
+        seconds = settings.REPLICA_STICKY_SECONDS
+    _pinned_until.set(max(_pinned_until.get(), time.time() + seconds))
+
+
+def is_pinned_to_primary():
+    return _pinned_until.get() > time.time()
+
+
+class PrimaryReplicaRouter:
+    """
+    Routes catalog reads to the read replica and everything else to the primary.
+
+    Only models listed in REPLICA_READ_MODELS are read from the replica, and
+    only when READ_REPLICA_ALIAS is configured; sessions, carts and the admin's
+    auth tables always use the primary. After a request writes a replicated
+    model, reads stay on the primary for REPLICA_STICKY_SECONDS so that the
+    person who made the change sees it.
+    """
+    def _replicated(self, model):
+        return model._meta.label in settings.REPLICA_READ_MODELS
+
+    def db_for_read(self, model, **hints):
+        replica = settings.READ_REPLICA_ALIAS
+        if replica and self._replicated(model) and not is_pinned_to_primary():
+            return replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if settings.READ_REPLICA_ALIAS and self._replicated(model):
+            pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, settings.READ_REPLICA_ALIAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary, schema included.
+        return db == DEFAULT_DB_ALIAS
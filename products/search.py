@@ -0,0 +1,142 @@
+import re
+
+from django.db import connections, router
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+FTS_TABLE = 'products_product_fts'
+
+# Column weights for bm25(): a match in the name counts ten times as much as
+# one in the description.
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# An external-content FTS5 table: it indexes products_product without
+# storing a second copy of the text. The triggers keep it in step with every
+# write, including bulk_create, queryset updates and raw SQL, which model
+# signals would miss. The prefix indexes make short prefix terms as cheap as
+# whole words.
+_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description,
+        content='products_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON products_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON products_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description ON products_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+_TERM = re.compile(r'\w+')
+
+
+def search_available(connection):
+    """
+    Returns whether the connection is SQLite with the FTS5 index installed.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def install_search_index(connection):
+    """
+    Creates the full-text index and its triggers where they are missing, and
+    fills a newly created index from the existing products. Safe to run
+    repeatedly; also restores the triggers after a migration has rebuilt
+    products_product, which drops them. Returns whether the index was built.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    created = not search_available(connection)
+    with connection.cursor() as cursor:
+        for statement in _SCHEMA:
+            cursor.execute(statement)
+        if created:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return created
+
+
+def uninstall_search_index(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def build_match(query):
+    """
+    Turns free text into an FTS5 query in which every word must match and
+    the last may be a prefix of a word, as while typing: 'red sho' becomes
+    '"red" "sho"*'. Returns '' if there are no words.
+
+    Only the last word is a prefix because a prefix term merges the postings
+    of every word it covers, while whole words let FTS5 skip through the
+    postings of common ones. Words are quoted, so FTS5 operators and column
+    filters typed by visitors are searched for literally.
+    """
+    terms = [f'"{term}"' for term in _TERM.findall(query.lower())]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_product_ids(query, limit, offset=0):
+    """
+    Returns the ids of products matching query, best matches first (by BM25).
+    """
+    match = build_match(query)
+    if not match:
+        return []
+    connection = connections[router.db_for_read(Product)]
+    if not search_available(connection):
+        return list(
+            Product.objects.filter(name__icontains=query)
+            .order_by('name', 'pk')
+            .values_list('pk', flat=True)[offset:offset + limit]
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}, %s, %s) LIMIT %s OFFSET %s',
+            [match, NAME_WEIGHT, DESCRIPTION_WEIGHT, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def matching_products(queryset, query):
+    """
+    Filters a Product queryset to full-text matches for query, keeping the
+    queryset's own ordering. Used where relevance order is not needed, such
+    as the admin changelist.
+    """
+    match = build_match(query)
+    if not match:
+        return queryset
+    if not search_available(connections[queryset.db]):
+        return queryset.filter(name__icontains=query)
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match],
+    ))
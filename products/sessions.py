@@ -0,0 +1,20 @@
+"""
+Database-backed sessions whose writes are retried when SQLite is locked,
+and timed for the request metrics.
+Selected with SESSION_ENGINE = 'products.sessions'.
+"""
+from django.contrib.sessions.backends.db import SessionStore as DBSessionStore
+from django.contrib.sessions.models import Session
+
+from .db import retry_on_lock
+from .metrics import timed_session_save
+
+
+class SessionStore(DBSessionStore):
+    def save(self, must_create=False):
+        with timed_session_save():
+            return self._save(must_create)
+
+    @retry_on_lock(model=Session)
+    def _save(self, must_create):
+        return super().save(must_create=must_create)
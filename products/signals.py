@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import schedule_catalog_bump
+from .cart import product_ids
+from .models import Product
+from . import images, jobs, search
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalog_cache(sender, using, **kwargs):
+    """
+    Moves the catalog cache to a new version whenever a product changes.
+    """
+    schedule_catalog_bump(using)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_ids(sender, using, created=False, **kwargs):
+    """
+    Drops this process's product id snapshot when products are added or removed.
+    """
+    if created or kwargs['signal'] is post_delete:
+        transaction.on_commit(product_ids.invalidate, using=using)
+
+
+@receiver(post_save, sender=Product)
+def ingest_image(sender, instance, using, **kwargs):
+    """
+    Queues a job resizing a saved product's new image, so the download stays
+    off the request. Bulk imports skip this and ingest their images in a
+    process pool instead.
+    """
+    update_fields = kwargs.get('update_fields')
+    if 'image_url' in instance.get_deferred_fields() or (update_fields is not None and 'image_url' not in update_fields):
+        return
+    if not (settings.PRODUCT_IMAGE_INGEST_ON_SAVE and images.available() and instance.image_changed):
+        return
+    instance._loaded_image_url = instance.image_url
+    jobs.enqueue('products.images.ingest_product', product_id=instance.pk)
+
+
+def install_search_index(sender, using, **kwargs):
+    """
+    Creates the product full-text index after migrate if it is missing.
+    """
+    if router.allow_migrate_model(using, Product):
+        search.install_search_index(connections[using])
@@ -0,0 +1,355 @@
+"""
+Builds the storefront stylesheet from the utility classes the templates use.
+
+This replaces the in-browser Tailwind compiler: the templates are scanned for
+class names, each known Tailwind utility is translated with the table below
+(Tailwind v3 values), and only those rules are emitted, minified. Class names
+that are not utilities, such as JavaScript hooks, are skipped.
+"""
+import re
+from pathlib import Path
+
+from django.apps import apps
+
+OUTPUT = Path(__file__).resolve().parent / 'static' / 'products' / 'css' / 'site.css'
+
+BREAKPOINTS = {'sm': '640px', 'md': '768px', 'lg': '1024px', 'xl': '1280px'}
+STATES = {'hover': ':hover', 'focus': ':focus'}
+
+COLORS = {
+    'gray': ['f9fafb', 'f3f4f6', 'e5e7eb', 'd1d5db', '9ca3af', '6b7280', '4b5563', '374151', '1f2937', '111827'],
+    'red': ['fef2f2', 'fee2e2', 'fecaca', 'fca5a5', 'f87171', 'ef4444', 'dc2626', 'b91c1c', '991b1b', '7f1d1d'],
+    'green': ['f0fdf4', 'dcfce7', 'bbf7d0', '86efac', '4ade80', '22c55e', '16a34a', '15803d', '166534', '14532d'],
+    'blue': ['eff6ff', 'dbeafe', 'bfdbfe', '93c5fd', '60a5fa', '3b82f6', '2563eb', '1d4ed8', '1e40af', '1e3a8a'],
+    'purple': ['faf5ff', 'f3e8ff', 'e9d5ff', 'd8b4fe', 'c084fc', 'a855f7', '9333ea', '7e22ce', '6b21a8', '581c87'],
+}
+SHADES = ['50', '100', '200', '300', '400', '500', '600', '700', '800', '900']
+
+FONT_SIZES = {
+    'xs': ('.75rem', '1rem'), 'sm': ('.875rem', '1.25rem'), 'base': ('1rem', '1.5rem'),
+    'lg': ('1.125rem', '1.75rem'), 'xl': ('1.25rem', '1.75rem'), '2xl': ('1.5rem', '2rem'),
+    '3xl': ('1.875rem', '2.25rem'), '4xl': ('2.25rem', '2.5rem'), '5xl': ('3rem', '1'),
+}
+FONT_WEIGHTS = {'normal': 400, 'medium': 500, 'semibold': 600, 'bold': 700, 'extrabold': 800}
+MAX_WIDTHS = {
+    'xs': '20rem', 'sm': '24rem', 'md': '28rem', 'lg': '32rem', 'xl': '36rem', '2xl': '42rem',
+    '3xl': '48rem', '4xl': '56rem', '5xl': '64rem', '6xl': '72rem', '7xl': '80rem', 'full': '100%',
+}
+RADII = {'none': '0', 'sm': '.125rem', '': '.25rem', 'md': '.375rem', 'lg': '.5rem', 'xl': '.75rem', 'full': '9999px'}
+SHADOWS = {
+    '': '0 1px 3px 0 rgb(0 0 0/.1),0 1px 2px -1px rgb(0 0 0/.1)',
+    'md': '0 4px 6px -1px rgb(0 0 0/.1),0 2px 4px -2px rgb(0 0 0/.1)',
+    'lg': '0 10px 15px -3px rgb(0 0 0/.1),0 4px 6px -4px rgb(0 0 0/.1)',
+    'xl': '0 20px 25px -5px rgb(0 0 0/.1),0 8px 10px -6px rgb(0 0 0/.1)',
+    'inner': 'inset 0 2px 4px 0 rgb(0 0 0/.05)',
+    'none': '0 0 #0000',
+}
+EASINGS = {'linear': 'linear', 'in': 'cubic-bezier(.4,0,1,1)', 'out': 'cubic-bezier(0,0,.2,1)',
+           'in-out': 'cubic-bezier(.4,0,.2,1)'}
+STATIC = {
+    'block': 'display:block', 'inline-block': 'display:inline-block', 'inline': 'display:inline',
+    'flex': 'display:flex', 'inline-flex': 'display:inline-flex', 'grid': 'display:grid',
+    'hidden': 'display:none', 'table': 'display:table',
+    'flex-row': 'flex-direction:row', 'flex-col': 'flex-direction:column', 'flex-wrap': 'flex-wrap:wrap',
+    'flex-1': 'flex:1 1 0%', 'flex-grow': 'flex-grow:1', 'flex-shrink-0': 'flex-shrink:0',
+    'items-start': 'align-items:flex-start', 'items-center': 'align-items:center', 'items-end': 'align-items:flex-end',
+    'justify-start': 'justify-content:flex-start', 'justify-center': 'justify-content:center',
+    'justify-end': 'justify-content:flex-end', 'justify-between': 'justify-content:space-between',
+    'col-span-full': 'grid-column:1/-1',
+    'text-left': 'text-align:left', 'text-center': 'text-align:center', 'text-right': 'text-align:right',
+    'uppercase': 'text-transform:uppercase', 'tracking-wider': 'letter-spacing:.05em',
+    'leading-relaxed': 'line-height:1.625', 'leading-tight': 'line-height:1.25',
+    'truncate': 'overflow:hidden;text-overflow:ellipsis;white-space:nowrap',
+    'whitespace-nowrap': 'white-space:nowrap',
+    'overflow-hidden': 'overflow:hidden', 'overflow-x-auto': 'overflow-x:auto',
+    'object-cover': 'object-fit:cover',
+    'min-h-screen': 'min-height:100vh', 'min-w-full': 'min-width:100%',
+    'border': 'border-width:1px', 'border-t': 'border-top-width:1px', 'border-b': 'border-bottom-width:1px',
+    'outline-none': 'outline:2px solid transparent;outline-offset:2px',
+    'transform': '',
+    'transition': 'transition-property:color,background-color,border-color,text-decoration-color,fill,stroke,'
+                  'opacity,box-shadow,transform,filter,backdrop-filter;'
+                  'transition-timing-function:cubic-bezier(.4,0,.2,1);transition-duration:.15s',
+}
+
+# Composed properties: transforms and shadows set custom properties so that
+# e.g. a scale and a translate, or a shadow and a focus ring, combine.
+TRANSFORM = ('transform:translate(var(--tw-translate-x,0),var(--tw-translate-y,0))'
+             ' scale(var(--tw-scale-x,1),var(--tw-scale-y,1))')
+BOX_SHADOW = 'box-shadow:var(--tw-ring-shadow,0 0 #0000),var(--tw-shadow,0 0 #0000)'
+
+BASE = """
+*,::before,::after{box-sizing:border-box;border:0 solid #e5e7eb}
+html{line-height:1.5;-webkit-text-size-adjust:100%;tab-size:4}
+body{margin:0;line-height:inherit;font-family:'Inter',sans-serif}
+h1,h2,h3,h4,h5,h6{font-size:inherit;font-weight:inherit}
+a{color:inherit;text-decoration:inherit}
+b,strong{font-weight:bolder}
+table{text-indent:0;border-color:inherit;border-collapse:collapse}
+button,input,select,textarea{font-family:inherit;font-size:100%;font-weight:inherit;line-height:inherit;color:inherit;margin:0;padding:0}
+button,[type=button],[type=submit]{-webkit-appearance:button;background-color:transparent;background-image:none}
+button,[role=button]{cursor:pointer}
+blockquote,dl,dd,h1,h2,h3,h4,h5,h6,hr,figure,p,pre{margin:0}
+ol,ul,menu{list-style:none;margin:0;padding:0}
+img,svg,video,canvas,iframe,embed,object{display:block;vertical-align:middle}
+img,video{max-width:100%;height:auto}
+input::placeholder{opacity:1;color:#9ca3af}
+[hidden]{display:none}
+"""
+
+# Utility names taking a value, e.g. 'px' in 'px-4'; longest first so that
+# 'ring-opacity-50' is not read as 'ring' with the value 'opacity-50'.
+_PREFIXES = sorted([
+    'p', 'px', 'py', 'pt', 'pr', 'pb', 'pl', 'm', 'mx', 'my', 'mt', 'mr', 'mb', 'ml',
+    'space-x', 'space-y', 'gap', 'gap-x', 'gap-y', 'w', 'h', 'max-w', 'grid-cols', 'line-clamp',
+    'text', 'font', 'bg', 'border', 'border-t', 'border-b', 'divide', 'ring', 'ring-opacity',
+    'opacity', 'rounded', 'shadow', 'duration', 'ease', 'scale', 'translate-x', 'translate-y',
+], key=len, reverse=True)
+_TEMPLATE_SYNTAX = re.compile(r'{%.*?%}|{{.*?}}|{#.*?#}', re.S)
+_CLASS_ATTRIBUTE = re.compile(r'\bclass="([^"]*)"')
+_CLASS_LIST_CALL = re.compile(r'classList\.(?:add|remove|toggle|contains|replace)\(([^)]*)\)')
+_STRING = re.compile(r'''['"`]([^'"`]*)['"`]''')
+
+
+def spacing(value):
+    if value == 'px':
+        return '1px'
+    if value == 'auto':
+        return 'auto'
+    if '/' in value:
+        numerator, denominator = value.split('/')
+        return f'{float(numerator) / float(denominator) * 100:g}%'
+    rem = float(value) / 4
+    return f'{rem:g}rem' if rem else '0px'
+
+
+def color(value):
+    """
+    Returns the hex colour for 'white', 'black' or '<name>-<shade>', or None.
+    """
+    if value in ('white', 'black'):
+        return '#fff' if value == 'white' else '#000'
+    name, _, shade = value.rpartition('-')
+    if name in COLORS and shade in SHADES:
+        return '#' + COLORS[name][SHADES.index(shade)]
+    return None
+
+
+def _rgb(hex_color):
+    hex_color = hex_color.lstrip('#')
+    if len(hex_color) == 3:
+        hex_color = ''.join(c * 2 for c in hex_color)
+    return ' '.join(str(int(hex_color[i:i + 2], 16)) for i in (0, 2, 4))
+
+
+_SIDES = {
+    '': ('',), 'x': ('-left', '-right'), 'y': ('-top', '-bottom'),
+    't': ('-top',), 'r': ('-right',), 'b': ('-bottom',), 'l': ('-left',),
+}
+_CHILDREN = '>:not([hidden])~:not([hidden])'
+
+
+def declarations(utility):
+    """
+    Returns (declarations, selector suffix) for a utility class without
+    variants, or None if it is not a known utility.
+    """
+    if utility in STATIC:
+        if utility == 'transform':
+            return TRANSFORM, ''
+        return STATIC[utility], ''
+    negative = utility.startswith('-')
+    utility = utility.lstrip('-')
+    for name in _PREFIXES:
+        if utility == name:
+            value = ''
+            break
+        if utility.startswith(name + '-'):
+            value = utility[len(name) + 1:]
+            break
+    else:
+        return None
+    if negative and name not in ('m', 'mx', 'my', 'mt', 'mr', 'mb', 'ml', 'space-x', 'space-y',
+                                 'translate-x', 'translate-y'):
+        return None
+    sign = '-' if negative else ''
+    try:
+        if name in ('p', 'px', 'py', 'pt', 'pr', 'pb', 'pl', 'm', 'mx', 'my', 'mt', 'mr', 'mb', 'ml') and value:
+            property = 'padding' if name[0] == 'p' else 'margin'
+            amount = sign + spacing(value)
+            return ';'.join(f'{property}{side}:{amount}' for side in _SIDES[name[1:]]), ''
+        if name in ('space-x', 'space-y') and value:
+            side = 'left' if name == 'space-x' else 'top'
+            return f'margin-{side}:{sign}{spacing(value)}', _CHILDREN
+        if name in ('gap', 'gap-x', 'gap-y') and value:
+            property = {'gap': 'gap', 'gap-x': 'column-gap', 'gap-y': 'row-gap'}[name]
+            return f'{property}:{spacing(value)}', ''
+        if name in ('w', 'h') and value:
+            property = 'width' if name == 'w' else 'height'
+            amount = {'full': '100%', 'screen': '100vw' if name == 'w' else '100vh'}.get(value) or spacing(value)
+            return f'{property}:{amount}', ''
+        if name == 'max-w' and value in MAX_WIDTHS:
+            return f'max-width:{MAX_WIDTHS[value]}', ''
+        if name == 'grid-cols' and value.isdigit():
+            return f'grid-template-columns:repeat({value},minmax(0,1fr))', ''
+        if name == 'line-clamp' and value.isdigit():
+            return f'overflow:hidden;display:-webkit-box;-webkit-box-orient:vertical;-webkit-line-clamp:{value}', ''
+        if name == 'text' and value in FONT_SIZES:
+            size, line_height = FONT_SIZES[value]
+            return f'font-size:{size};line-height:{line_height}', ''
+        if name == 'font' and value in FONT_WEIGHTS:
+            return f'font-weight:{FONT_WEIGHTS[value]}', ''
+        if name in ('text', 'bg', 'border', 'divide', 'ring'):
+            hex_color = color(value)
+            if hex_color is None:
+                if name == 'divide' and value in ('x', 'y'):
+                    side = 'left' if value == 'x' else 'top'
+                    return f'border-{side}-width:1px', _CHILDREN
+                if name == 'ring' and value.isdigit():
+                    return (f'--tw-ring-shadow:0 0 0 {value}px var(--tw-ring-color,rgb(59 130 246/.5));'
+                            f'{BOX_SHADOW}'), ''
+                return None
+            if name == 'text':
+                return f'color:{hex_color}', ''
+            if name == 'bg':
+                return f'background-color:{hex_color}', ''
+            if name == 'border':
+                return f'border-color:{hex_color}', ''
+            if name == 'divide':
+                return f'border-color:{hex_color}', _CHILDREN
+            return f'--tw-ring-color:rgb({_rgb(hex_color)}/var(--tw-ring-opacity,1))', ''
+        if name == 'ring-opacity' and value.isdigit():
+            return f'--tw-ring-opacity:{int(value) / 100:g}', ''
+        if name == 'opacity' and value.isdigit():
+            return f'opacity:{int(value) / 100:g}', ''
+        if name == 'rounded' and value in RADII:
+            return f'border-radius:{RADII[value]}', ''
+        if name == 'shadow' and value in SHADOWS:
+            return f'--tw-shadow:{SHADOWS[value]};{BOX_SHADOW}', ''
+        if name == 'duration' and value.isdigit():
+            return f'transition-duration:{value}ms', ''
+        if name == 'ease' and value in EASINGS:
+            return f'transition-timing-function:{EASINGS[value]}', ''
+        if name == 'scale' and value.isdigit():
+            scale = f'{int(value) / 100:g}'
+            return f'--tw-scale-x:{scale};--tw-scale-y:{scale};{TRANSFORM}', ''
+        if name in ('translate-x', 'translate-y') and value:
+            axis = name[-1]
+            return f'--tw-translate-{axis}:{sign}{spacing(value)};{TRANSFORM}', ''
+        if name == 'border' and value.isdigit():
+            return f'border-width:{value}px', ''
+        if name in ('border-t', 'border-b') and value.isdigit():
+            side = 'top' if name == 'border-t' else 'bottom'
+            return f'border-{side}-width:{value}px', ''
+    except (ValueError, ZeroDivisionError):
+        return None
+    return None
+
+
+def escape(class_name):
+    return re.sub(r'([^a-zA-Z0-9_-])', r'\\\1', class_name)
+
+
+def parse(class_name):
+    """
+    Splits 'md:hover:bg-gray-200' into (breakpoint, state, utility), or
+    returns None if it is not a known utility with known variants.
+    """
+    *variants, utility = class_name.split(':')
+    breakpoint = state = None
+    for variant in variants:
+        if variant in BREAKPOINTS and breakpoint is None and state is None:
+            breakpoint = variant
+        elif variant in STATES and state is None:
+            state = variant
+        else:
+            return None
+    if utility == 'container':
+        return (breakpoint, state, utility) if not variants else None
+    if declarations(utility) is None:
+        return None
+    return breakpoint, state, utility
+
+
+def _rule(class_name, state, utility):
+    declaration, suffix = declarations(utility)
+    return f'.{escape(class_name)}{STATES[state] if state else ""}{suffix}{{{declaration}}}'
+
+
+def build(classes):
+    """
+    Returns minified CSS for the given class names, with the base styles
+    first and utilities ordered as Tailwind orders them: unprefixed, then
+    state variants, then each breakpoint from smallest to largest.
+    """
+    groups = {None: [], **{breakpoint: [] for breakpoint in BREAKPOINTS}}
+    container = False
+    for class_name in sorted(classes):
+        parsed = parse(class_name)
+        if parsed is None:
+            continue
+        breakpoint, state, utility = parsed
+        if utility == 'container':
+            container = True
+            continue
+        groups[breakpoint].append((state is not None, class_name, state, utility))
+
+    css = [minify(BASE)]
+    if container:
+        css.append('.container{width:100%}')
+    for breakpoint, rules in groups.items():
+        body = ''.join(_rule(class_name, state, utility) for _, class_name, state, utility in sorted(rules))
+        if container and breakpoint:
+            body = f'.container{{max-width:{BREAKPOINTS[breakpoint]}}}' + body
+        if breakpoint and body:
+            body = f'@media (min-width:{BREAKPOINTS[breakpoint]}){{{body}}}'
+        css.append(body)
+    return ''.join(css) + '\n'
+
+
+def minify(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s*([{};,>~])\s*', r'\1', css)
+    css = re.sub(r'\s+', ' ', css)
+    return css.replace(';}', '}').strip()
+
+
+def extract_classes(source):
+    """
+    Returns the class names in a template: those in class="..." attributes,
+    with template tags removed, and those passed to element.classList methods.
+    """
+    source = _TEMPLATE_SYNTAX.sub(' ', source)
+    classes = set()
+    for attribute in _CLASS_ATTRIBUTE.findall(source):
+        classes.update(attribute.split())
+    for arguments in _CLASS_LIST_CALL.findall(source):
+        for string in _STRING.findall(arguments):
+            classes.update(string.split())
+    return classes
+
+
+def template_files():
+    """
+    Yields every template file of the installed project apps (not Django's own).
+    """
+    for app_config in apps.get_app_configs():
+        if app_config.name.startswith('django.'):
+            continue
+        directory = Path(app_config.path) / 'templates'
+        if directory.is_dir():
+            yield from sorted(path for path in directory.rglob('*.html'))
+
+
+def collect_classes(files=None):
+    classes = set()
+    for path in template_files() if files is None else files:
+        classes |= extract_classes(Path(path).read_text(encoding='utf-8'))
+    return classes
+
+
+def unknown_classes(classes):
+    """
+    Returns the class names that produce no CSS, for reporting.
+    """
+    return sorted(class_name for class_name in classes if parse(class_name) is None)
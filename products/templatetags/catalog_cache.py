@@ -0,0 +1,95 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from products.cache import catalog_key, catalog_version, get_cache, get_or_render_fragment, stats
+from products.reversing import url_builder
+
+register = template.Library()
+
+
+class CatalogFragmentNode(template.Node):
+    def __init__(self, nodelist, namespace, parts):
+        self.nodelist = nodelist
+        self.namespace = namespace
+        self.parts = parts
+
+    def render(self, context):
+        namespace = self.namespace.resolve(context)
+        parts = [part.resolve(context) for part in self.parts]
+
+        return get_or_render_fragment(namespace, parts, lambda: self.nodelist.render(context))
+
+
+@register.tag
+def catalog_fragment(parser, token):
+    """
+    Caches the enclosed markup until the catalog version changes.
+
+    Usage::
+
+        {% catalog_fragment "product_detail" product.pk %}
+            ...
+        {% endcatalog_fragment %}
+
+    The first argument names the fragment, the rest identify it within that
+    name. The markup is shared by every visitor, so it must not contain a
+    {% csrf_token %}.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires at least one argument.")
+    nodelist = parser.parse(('endcatalog_fragment',))
+    parser.delete_first_token()
+    return CatalogFragmentNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        [parser.compile_filter(bit) for bit in bits[2:]],
+    )
+
+
+def render_cards(products, engine, autoescape=True):
+    """
+    Returns the product cards of products, each cached separately by
+    product id and catalog version. engine is the template Engine to load the
+    card template from on a cache miss.
+    """
+    cache = get_cache()
+    version = catalog_version()
+    keys = {product.pk: catalog_key('card', product.pk, version=version) for product in products}
+    cached = cache.get_many(keys.values())
+    missing = {}
+    if len(cached) < len(keys):
+        card = engine.get_template('products/_product_card.html')
+        detail_url, add_to_cart_url = url_builder('product_detail'), url_builder('add_to_cart')
+    parts = []
+    for product in products:
+        key = keys[product.pk]
+        content = cached.get(key)
+        stats.record('card', content is not None)
+        if content is None:
+            content = missing[key] = card.render(template.Context({
+                'product': product,
+                'detail_url': detail_url(product.pk),
+                'add_to_cart_url': add_to_cart_url(product.pk),
+            }, autoescape=autoescape))
+        parts.append(content)
+    if missing:
+        cache.set_many(missing)
+    return '\n'.join(parts)
+
+
+@register.simple_tag(takes_context=True)
+def product_cards(context, products):
+    """
+    Renders a product card (products/_product_card.html) for each product,
+    caching every card separately by product id and catalog version.
+
+    Usage::
+
+        {% product_cards products %}
+
+    All of the page's cards are fetched from the cache in one round trip, and
+    only the missing ones are rendered. A card is shared by every page that
+    lists its product, whatever the sort order, page or search.
+    """
+    return mark_safe(render_cards(products, context.template.engine, context.autoescape))
@@ -0,0 +1,41 @@
+from django import template
+from django.conf import settings
+
+from products.images import variant_url
+
+register = template.Library()
+
+
+@register.filter
+def image_src(item, width):
+    """
+    Returns the URL of item's image (a Product or cart line) resized to the
+    smallest of PRODUCT_IMAGE_WIDTHS at least width wide, as JPEG, or its
+    original image_url if it was not resized.
+
+    Usage::
+
+        <img src="{{ product|image_src:400 }}">
+    """
+    digest = item.image_digest
+    if digest is None:
+        return item.image_url or ''
+    widths = sorted(settings.PRODUCT_IMAGE_WIDTHS)
+    width = next((w for w in widths if w >= int(width)), widths[-1])
+    return variant_url(digest, width, 'jpeg')
+
+
+@register.filter
+def image_srcset(item, format):
+    """
+    Returns a srcset of every resized copy of item's image in format ('webp'
+    or 'jpeg'), or an empty string if it was not resized.
+
+    Usage::
+
+        <source type="image/webp" srcset="{{ product|image_srcset:'webp' }}" sizes="...">
+    """
+    digest = item.image_digest
+    if digest is None:
+        return ''
+    return ', '.join(f'{variant_url(digest, width, format)} {width}w' for width in sorted(settings.PRODUCT_IMAGE_WIDTHS))
@@ -1,6 +1,37 @@
+import json
+import random
+import re
+from decimal import Decimal
+
 import pytest
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from products.models import Product
+from products import cache as catalog_cache
+
+@pytest.fixture(autouse=True)
+def clear_caches(settings, tmp_path):
+    """
+    Fixture to start every test with empty caches and a catalog version of
+    its own, since the database is rolled back between tests but cached
+    pages are not. Saving a product queues no image job unless a test asks.
+    """
+    settings.CATALOG_VERSION_PATH = tmp_path / 'catalog-version'
+    settings.PRODUCT_IMAGE_INGEST_ON_SAVE = False
+    settings.STOCK_VERSION_PATH = tmp_path / 'stock-version'
+    from products.cart import product_ids
+    from products.cart_storage import _load_storage
+    from products.inventory import tracked_product_ids
+    from products.metrics import metrics
+    for cache in caches.all():
+        cache.clear()
+    catalog_cache.stats.reset()
+    metrics.reset()
+    product_ids.invalidate()
+    tracked_product_ids.invalidate()
+    _load_storage.cache_clear()
 
 @pytest.fixture
 def product_fixture():
@@ -32,6 +63,18 @@ def multiple_products_fixture():
     )
     return product_a, product_b
 
+def cart_items(client):
+    """
+    Returns the {product_id: quantity} contents of the client's cart, read
+    through the configured cart storage.
+    """
+    from django.test import RequestFactory
+    from products.cart_storage import get_cart_storage
+    request = RequestFactory().get('/')
+    request.COOKIES = {key: morsel.value for key, morsel in client.cookies.items()}
+    request.session = client.session
+    return get_cart_storage().load_cart(request).items
+
 @pytest.fixture
 def client():
     """
@@ -97,14 +140,14 @@ def test_add_to_cart_view(client, product_fixture):
     assert response.redirect_chain[0][1] == 302 
    
     assert 'cart' in client.session
-    cart = client.session['cart']
-    assert str(product_fixture.id) in cart
-    assert cart[str(product_fixture.id)]['quantity'] == 1
+    cart = cart_items(client)
+    assert product_fixture.id in cart
+    assert cart[product_fixture.id] == 1
 
     response = client.post(reverse('add_to_cart', args=[product_fixture.pk]), follow=True)
     assert response.status_code == 200
-    cart = client.session['cart']
-    assert cart[str(product_fixture.id)]['quantity'] == 2 
+    cart = cart_items(client)
+    assert cart[product_fixture.id] == 2 
 
 @pytest.mark.django_db
 def test_view_cart_view(client, multiple_products_fixture):
@@ -147,15 +190,15 @@ def test_update_cart_quantity_increase(client, product_fixture):
     Test increasing product quantity in the cart.
     """
     client.post(reverse('add_to_cart', args=[product_fixture.pk]))
-    cart = client.session['cart']
-    assert cart[str(product_fixture.id)]['quantity'] == 1
+    cart = cart_items(client)
+    assert cart[product_fixture.id] == 1
 
     response = client.post(reverse('update_cart_quantity', args=[product_fixture.pk]), {'action': 'increase'})
     assert response.status_code == 200
     json_response = response.json()
     assert json_response['status'] == 'success'
     assert json_response['new_quantity'] == 2
-    assert client.session['cart'][str(product_fixture.id)]['quantity'] == 2
+    assert cart_items(client)[product_fixture.id] == 2
     assert json_response['total_price'] == pytest.approx(float(product_fixture.price) * 2)
 
 @pytest.mark.django_db
@@ -165,15 +208,15 @@ def test_update_cart_quantity_decrease(client, product_fixture):
     """
     client.post(reverse('add_to_cart', args=[product_fixture.pk]))
     client.post(reverse('add_to_cart', args=[product_fixture.pk]))
-    cart = client.session['cart']
-    assert cart[str(product_fixture.id)]['quantity'] == 2
+    cart = cart_items(client)
+    assert cart[product_fixture.id] == 2
 
     response = client.post(reverse('update_cart_quantity', args=[product_fixture.pk]), {'action': 'decrease'})
     assert response.status_code == 200
     json_response = response.json()
     assert json_response['status'] == 'success'
     assert json_response['new_quantity'] == 1
-    assert client.session['cart'][str(product_fixture.id)]['quantity'] == 1
+    assert cart_items(client)[product_fixture.id] == 1
     assert json_response['total_price'] == pytest.approx(float(product_fixture.price) * 1)
 
 @pytest.mark.django_db
@@ -182,15 +225,15 @@ def test_update_cart_quantity_decrease_to_zero_removes_item(client, product_fixt
     Test decreasing product quantity to zero removes it from the cart.
     """
     client.post(reverse('add_to_cart', args=[product_fixture.pk]))
-    cart = client.session['cart']
-    assert cart[str(product_fixture.id)]['quantity'] == 1
+    cart = cart_items(client)
+    assert cart[product_fixture.id] == 1
 
     response = client.post(reverse('update_cart_quantity', args=[product_fixture.pk]), {'action': 'decrease'})
     assert response.status_code == 200
     json_response = response.json()
     assert json_response['status'] == 'success'
     assert json_response['new_quantity'] == 0 
-    assert str(product_fixture.id) not in client.session['cart']
+    assert product_fixture.id not in cart_items(client)
     assert json_response['total_price'] == 0.0
 
 @pytest.mark.django_db
@@ -199,13 +242,13 @@ def test_remove_from_cart_view(client, product_fixture):
     Test removing a product entirely from the cart.
     """
     client.post(reverse('add_to_cart', args=[product_fixture.pk]))
-    assert str(product_fixture.id) in client.session['cart']
+    assert product_fixture.id in cart_items(client)
 
     response = client.post(reverse('remove_from_cart', args=[product_fixture.pk]))
     assert response.status_code == 200
     json_response = response.json()
     assert json_response['status'] == 'success'
-    assert str(product_fixture.id) not in client.session['cart']
+    assert product_fixture.id not in cart_items(client)
     assert json_response['total_price'] == 0.0
 
 @pytest.mark.django_db
@@ -216,3 +259,2126 @@ def test_remove_from_cart_non_existent_item(client):
     json_response = response.json()
     assert json_response['status'] == 'error'
     assert json_response['message'] == 'Product not in cart'
+
+@pytest.fixture
+def catalog_fixture():
+    """
+    Fixture to create a small catalog with duplicate prices and names, so that
+    pagination has to rely on the id tie-breaker.
+    """
+    return [
+        Product.objects.create(name=name, description="x" * 500, price=price)
+        for name, price in [
+            ("Mug", 5.00), ("Lamp", 25.00), ("Desk", 150.00), ("Mug", 5.00),
+            ("Chair", 75.00), ("Pen", 1.50), ("Lamp", 25.00),
+        ]
+    ]
+
+def _walk_catalog(client, sort, direction='next', cursor=None, page_size=2):
+    """
+    Follows cursors through the product list, returning pages of product ids.
+    """
+    pages = []
+    while True:
+        params = {'sort': sort, 'page_size': page_size}
+        if cursor:
+            params['cursor'] = cursor
+        response = client.get(reverse('product_list'), params)
+        assert response.status_code == 200
+        pages.append([product.pk for product in response.context['products']])
+        page = response.context['page']
+        cursor = page.next_cursor if direction == 'next' else page.previous_cursor
+        if cursor is None:
+            return pages, page
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('sort, key', [
+    ('price', lambda p: (p.price, p.pk)),
+    ('-price', lambda p: (-p.price, -p.pk)),
+    ('name', lambda p: (p.name, p.pk)),
+])
+def test_product_list_keyset_pagination(client, catalog_fixture, sort, key):
+    """
+    Test that following next cursors visits every product exactly once, in
+    order, and that previous cursors walk the same pages back.
+    """
+    for product in catalog_fixture:
+        product.refresh_from_db()
+    expected = [p.pk for p in sorted(catalog_fixture, key=key)]
+
+    pages, last_page = _walk_catalog(client, sort)
+    assert [pk for page in pages for pk in page] == expected
+    assert all(len(page) == 2 for page in pages[:-1])
+
+    back_pages, first_page = _walk_catalog(client, sort, 'previous', last_page.previous_cursor)
+    assert back_pages[-1] == pages[0]
+    assert not first_page.has_previous
+
+@pytest.mark.django_db
+def test_product_list_loads_only_grid_columns(client, catalog_fixture):
+    """
+    Test that the product list defers the full description and renders a
+    database-truncated one instead.
+    """
+    response = client.get(reverse('product_list'))
+    product = response.context['products'][0]
+    assert 'description' in product.get_deferred_fields()
+    assert len(product.short_description) == 160
+    assert "x" * 161 not in response.content.decode('utf-8')
+
+@pytest.mark.django_db
+def test_product_list_page_size_is_clamped(client, settings, catalog_fixture):
+    """
+    Test that requested page sizes are capped by CATALOG_MAX_PAGE_SIZE.
+    """
+    settings.CATALOG_MAX_PAGE_SIZE = 3
+    response = client.get(reverse('product_list'), {'page_size': 1000})
+    assert len(response.context['products']) == 3
+    assert response.context['page'].has_next
+
+@pytest.mark.django_db
+def test_product_list_invalid_cursor(client, catalog_fixture):
+    """
+    Test that tampered cursors, and cursors issued for another ordering, are rejected.
+    """
+    response = client.get(reverse('product_list'), {'sort': 'price', 'page_size': 2})
+    cursor = response.context['page'].next_cursor
+
+    assert client.get(reverse('product_list'), {'cursor': 'not-a-cursor'}).status_code == 400
+    assert client.get(reverse('product_list'), {'sort': 'name', 'cursor': cursor}).status_code == 400
+
+@pytest.fixture(params=['locmem', 'file'])
+def catalog_cache_backend(request, settings, tmp_path):
+    """
+    Fixture to run a test against both supported catalog cache backends.
+    """
+    if request.param == 'file':
+        settings.CACHES = {
+            **settings.CACHES,
+            'catalog': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': str(tmp_path / 'catalog'),
+            },
+        }
+    return request.param
+
+@pytest.mark.django_db
+def test_catalog_pages_are_served_from_cache(client, catalog_cache_backend, product_fixture, django_assert_num_queries):
+    """
+    Test that repeat anonymous views of catalog pages skip the database.
+    """
+    for url in [reverse('product_list'), reverse('product_detail', args=[product_fixture.pk])]:
+        first = client.get(url)
+        with django_assert_num_queries(0):
+            second = client.get(url)
+        assert second.status_code == 200
+        assert product_fixture.name in second.content.decode('utf-8')
+        assert len(second.content) == len(first.content)
+    assert catalog_cache.stats.snapshot()['page'] == {'hits': 2, 'misses': 2}
+
+@pytest.mark.django_db
+def test_product_changes_invalidate_catalog_cache(client, catalog_cache_backend, product_fixture, django_capture_on_commit_callbacks):
+    """
+    Test that saving, bulk-updating and deleting products bumps the catalog
+    version so that stale pages are never served.
+    """
+    url = reverse('product_list')
+    client.get(url)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        product_fixture.name = "Renamed Product"
+        product_fixture.save()
+    assert "Renamed Product" in client.get(url).content.decode('utf-8')
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Product.objects.filter(pk=product_fixture.pk).update(name="Bulk Renamed")
+    assert "Bulk Renamed" in client.get(url).content.decode('utf-8')
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Product.objects.all().delete()
+    assert "No products available yet." in client.get(url).content.decode('utf-8')
+    assert catalog_cache.stats.snapshot()['page'] == {'hits': 0, 'misses': 4}
+
+@pytest.mark.django_db
+def test_catalog_version_bump_waits_for_commit(product_fixture, django_capture_on_commit_callbacks):
+    """
+    Test that the catalog version only moves once the write is committed.
+    """
+    version = catalog_cache.catalog_version()
+    with django_capture_on_commit_callbacks() as callbacks:
+        product_fixture.save()
+        assert catalog_cache.catalog_version() == version
+    for callback in callbacks:
+        callback()
+    assert catalog_cache.catalog_version() > version
+
+@pytest.mark.django_db
+def test_catalog_version_is_shared_between_processes(client, product_fixture, settings):
+    """
+    Test that a product change bumped by another process, which only
+    replaces the shared version file, invalidates this process's cached
+    pages and moves their Last-Modified on.
+    """
+    from pathlib import Path
+    url = reverse('product_list')
+    first = client.get(url)
+    # What a bump in another worker leaves behind.
+    version = catalog_cache.catalog_version()
+    Path(settings.CATALOG_VERSION_PATH).write_text(str(version + 5_000_000))
+    assert catalog_cache.catalog_version() == version + 5_000_000
+    second = client.get(url)
+    assert catalog_cache.stats.snapshot()['page'] == {'hits': 0, 'misses': 2}
+    assert second['Last-Modified'] != first['Last-Modified']
+    assert client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code == 200
+
+@pytest.mark.django_db
+def test_cached_catalog_page_forms_get_csrf_token_from_endpoint(product_fixture):
+    """
+    Test that a page served from cache carries no CSRF token or cookie, and
+    that the token from the csrf endpoint, or the cookie it sets, lets the
+    visitor post its forms.
+    """
+    from django.test import Client
+    Client().get(reverse('product_list'))
+
+    visitor = Client(enforce_csrf_checks=True)
+    response = visitor.get(reverse('product_list'))
+    assert 'name="csrfmiddlewaretoken" value=""' in response.content.decode('utf-8')
+    assert 'csrftoken' not in response.cookies
+    assert catalog_cache.stats.snapshot()['page']['hits'] == 1
+
+    add_url = reverse('add_to_cart', args=[product_fixture.pk])
+    assert visitor.post(add_url).status_code == 403
+    response = visitor.get(reverse('csrf_token'))
+    assert 'no-cache' in response['Cache-Control']
+    assert visitor.post(add_url, {'csrfmiddlewaretoken': response.json()['token']}).status_code == 302
+    assert visitor.post(add_url, {'csrfmiddlewaretoken': visitor.cookies['csrftoken'].value}).status_code == 302
+
+@pytest.mark.django_db
+def test_product_detail_fragment_is_cached_for_signed_in_users(client, product_fixture, django_user_model):
+    """
+    Test that signed-in users bypass the page cache but still reuse the
+    cached product fragment.
+    """
+    client.force_login(django_user_model.objects.create_user('staff', password='pw'))
+    url = reverse('product_detail', args=[product_fixture.pk])
+    first = client.get(url).content.decode('utf-8')
+    second = client.get(url).content.decode('utf-8')
+    assert product_fixture.name in second
+    assert 'page' not in catalog_cache.stats.snapshot()
+    assert catalog_cache.stats.snapshot()['product_detail'] == {'hits': 1, 'misses': 1}
+
+@pytest.mark.django_db
+def test_cart_session_is_compact(client, multiple_products_fixture):
+    """
+    Test that the session cart holds quantities, unit prices in minor units
+    and running totals, but no copied product details.
+    """
+    product_a, product_b = multiple_products_fixture
+    client.post(reverse('add_to_cart', args=[product_a.pk]))
+    client.post(reverse('add_to_cart', args=[product_b.pk]))
+    client.post(reverse('add_to_cart', args=[product_b.pk]))
+
+    cart = client.session['cart']
+    assert cart['v'] == 3
+    assert cart['items'] == {str(product_a.pk): [1, 1000], str(product_b.pk): [2, 2000]}
+    assert (cart['subtotal'], cart['count']) == (5000, 3)
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('legacy_cart', [
+    lambda pk: {str(pk): {'name': 'Old Name', 'price': '1.00', 'quantity': 3, 'image_url': None}},
+    lambda pk: {'v': 2, 'items': {str(pk): 3}},
+])
+def test_legacy_cart_session_is_migrated_on_read(client, product_fixture, legacy_cart):
+    """
+    Test that carts stored in older formats are displayed with current
+    prices and rewritten in the current format.
+    """
+    session = client.session
+    session['cart'] = legacy_cart(product_fixture.pk)
+    session.save()
+
+    response = client.get(reverse('view_cart'))
+    assert response.context['total_price'] == Decimal('59.97')
+    assert product_fixture.name in response.content.decode('utf-8')
+    cart = client.session['cart']
+    assert cart['v'] == 3
+    assert cart['items'] == {str(product_fixture.pk): [3, 1999]}
+
+@pytest.mark.django_db
+def test_view_cart_uses_current_prices_in_one_query(client, multiple_products_fixture):
+    """
+    Test that the cart page resolves every line with one product query and
+    reflects price changes made after the item was added.
+    """
+    product_a, product_b = multiple_products_fixture
+    client.post(reverse('add_to_cart', args=[product_a.pk]))
+    client.post(reverse('add_to_cart', args=[product_b.pk]))
+    Product.objects.filter(pk=product_a.pk).update(price=12.50)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse('view_cart'))
+    product_queries = [q for q in queries if 'products_product' in q['sql']]
+    assert len(product_queries) == 1
+    assert float(response.context['total_price']) == pytest.approx(12.50 + float(product_b.price))
+
+@pytest.mark.parametrize('seed', range(5))
+def test_cart_running_totals_match_full_recompute(seed):
+    """
+    Property test: after any random sequence of cart mutations, the running
+    totals equal totals summed from scratch, and stay exact where float
+    arithmetic would drift.
+    """
+    from products.cart import Cart, CartTotals
+    rng = random.Random(seed)
+    prices = {pk: Decimal(rng.randint(1, 99999)) / 100 for pk in range(1, 21)}
+    cart = Cart({})
+    expected = {}
+
+    for _ in range(500):
+        product_id = rng.choice(list(prices))
+        op = rng.choice(['add', 'increase', 'decrease', 'set', 'remove'])
+        if op == 'add':
+            quantity = rng.randint(1, 5)
+            cart.add(product_id, prices[product_id], quantity)
+            expected[product_id] = expected.get(product_id, 0) + quantity
+        elif product_id in cart:
+            if op == 'increase':
+                expected[product_id] += 1
+                cart.increase(product_id)
+            elif op == 'decrease':
+                expected[product_id] -= 1
+                cart.decrease(product_id)
+            elif op == 'set':
+                expected[product_id] = rng.randint(0, 10)
+                cart.set_quantity(product_id, expected[product_id])
+            else:
+                expected[product_id] = 0
+                cart.remove(product_id)
+            if expected[product_id] == 0:
+                del expected[product_id]
+
+        assert cart.totals == cart.recompute()
+        assert cart.items == expected
+
+    assert cart.totals.total_price == sum((prices[pk] * qty for pk, qty in expected.items()), Decimal('0'))
+    assert cart.totals == CartTotals(
+        sum(int(prices[pk] * 100) * qty for pk, qty in expected.items()),
+        sum(expected.values()),
+        len(expected),
+    )
+
+@pytest.mark.django_db
+def test_cart_totals_are_decimal_exact(client):
+    """
+    Test that totals which drift under float arithmetic come out exact.
+    """
+    product = Product.objects.create(name="Dime", description="", price=Decimal('0.10'))
+    client.post(reverse('add_to_cart', args=[product.pk]))
+    for _ in range(2):
+        response = client.post(reverse('update_cart_quantity', args=[product.pk]), {'action': 'increase'})
+    assert 0.1 + 0.1 + 0.1 != 0.3
+    assert response.json()['total_price'] == 0.3
+    assert response.json()['new_subtotal'] == 0.3
+    assert client.get(reverse('view_cart')).context['total_price'] == Decimal('0.30')
+
+@pytest.mark.django_db
+def test_cart_is_repriced_after_catalog_change(client, product_fixture, django_capture_on_commit_callbacks):
+    """
+    Test that a price change made after an item was added is picked up by the
+    next cart mutation rather than the stored unit price being used.
+    """
+    client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+    with django_capture_on_commit_callbacks(execute=True):
+        Product.objects.filter(pk=product_fixture.pk).update(price=Decimal('5.00'))
+
+    response = client.post(reverse('update_cart_quantity', args=[product_fixture.pk]), {'action': 'increase'})
+    assert response.json()['total_price'] == 10.0
+    assert client.session['cart']['items'][str(product_fixture.pk)] == [2, 500]
+
+def post_batch(client, operations):
+    """
+    Posts a list of operations to the cart batch endpoint as JSON.
+    """
+    return client.post(reverse('cart_batch'), json.dumps(operations), content_type='application/json')
+
+@pytest.mark.django_db
+def test_cart_batch_applies_operations_with_one_session_write(client, multiple_products_fixture):
+    """
+    Test that a batch of operations is applied in order, reports each line
+    and the new totals, and writes the session once.
+    """
+    product_a, product_b = multiple_products_fixture
+    client.post(reverse('add_to_cart', args=[product_a.pk]))
+    client.post(reverse('add_to_cart', args=[product_b.pk]))
+
+    with CaptureQueriesContext(connection) as queries:
+        response = post_batch(client, [
+            {'op': 'increase', 'product_id': product_a.pk, 'quantity': 4},
+            {'op': 'decrease', 'product_id': product_a.pk},
+            {'op': 'set', 'product_id': product_b.pk, 'quantity': 3},
+        ])
+    session_writes = [q for q in queries if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')]
+    assert len(session_writes) == 1
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data['status'] == 'success'
+    assert data['results'] == [
+        {'product_id': product_a.pk, 'new_quantity': 5, 'new_subtotal': 40.0},
+        {'product_id': product_a.pk, 'new_quantity': 4, 'new_subtotal': 40.0},
+        {'product_id': product_b.pk, 'new_quantity': 3, 'new_subtotal': 60.0},
+    ]
+    assert (data['total_price'], data['item_count'], data['line_count']) == (100.0, 7, 2)
+    assert cart_items(client) == {product_a.pk: 4, product_b.pk: 3}
+
+@pytest.mark.django_db
+def test_cart_batch_remove_and_set_zero(client, multiple_products_fixture):
+    """
+    Test that remove and set-to-zero operations drop lines from the cart.
+    """
+    product_a, product_b = multiple_products_fixture
+    client.post(reverse('add_to_cart', args=[product_a.pk]))
+    client.post(reverse('add_to_cart', args=[product_b.pk]))
+
+    data = post_batch(client, [
+        {'op': 'remove', 'product_id': product_a.pk},
+        {'op': 'set', 'product_id': product_b.pk, 'quantity': 0},
+    ]).json()
+    assert [result['new_quantity'] for result in data['results']] == [0, 0]
+    assert data['total_price'] == 0.0
+    assert cart_items(client) == {}
+
+@pytest.mark.django_db
+def test_cart_batch_is_all_or_nothing(client, product_fixture):
+    """
+    Test that a batch containing a failing operation leaves the cart unchanged.
+    """
+    client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+
+    response = post_batch(client, [
+        {'op': 'increase', 'product_id': product_fixture.pk, 'quantity': 2},
+        {'op': 'increase', 'product_id': 999},
+    ])
+    assert response.status_code == 404
+    assert response.json() == {'status': 'error', 'message': 'Product not in cart', 'index': 1}
+    assert cart_items(client) == {product_fixture.pk: 1}
+
+@pytest.mark.django_db
+def test_failed_cart_batch_is_not_saved_after_a_reprice(client, multiple_products_fixture, cart_storage_mode):
+    """
+    Test that a failing batch leaves the cart and its stock as they were
+    when loading the cart repriced it, which marks it to be saved.
+    """
+    from products.inventory import set_stock
+    product_a, product_b = multiple_products_fixture
+    set_stock(product_a.pk, 10)
+    client.post(reverse('add_to_cart', args=[product_a.pk]))
+    catalog_cache.bump_catalog_version()
+
+    response = post_batch(client, [
+        {'op': 'increase', 'product_id': product_a.pk, 'quantity': 5},
+        {'op': 'increase', 'product_id': product_b.pk},
+    ])
+    assert response.status_code == 404
+    assert cart_items(client) == {product_a.pk: 1}
+    assert _available(product_a) == 9
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('body', [
+    [],
+    {'op': 'increase', 'product_id': 1},
+    [{'op': 'explode', 'product_id': 1}],
+    [{'op': 'increase', 'product_id': '1'}],
+    [{'op': 'decrease', 'product_id': 1, 'quantity': 0}],
+    [{'op': 'set', 'product_id': 1, 'quantity': -1}],
+    [{'op': 'increase', 'product_id': 1, 'quantity': 2 ** 63}],
+])
+def test_cart_batch_rejects_malformed_operations(client, body):
+    """
+    Test that malformed batches are rejected before the cart is touched.
+    """
+    response = post_batch(client, body)
+    assert response.status_code == 400
+    assert response.json()['status'] == 'error'
+
+@pytest.mark.django_db
+def test_cart_batch_requires_post(client):
+    """
+    Test that the batch endpoint only accepts POST.
+    """
+    assert client.get(reverse('cart_batch')).status_code == 400
+    assert client.post(reverse('cart_batch'), 'not json', content_type='application/json').status_code == 400
+
+def _product_queries(queries):
+    return [q for q in queries if 'products_product' in q['sql']]
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('request_cart, product_query_count', [
+    (lambda client, pk: client.post(reverse('add_to_cart', args=[pk])), 0),
+    (lambda client, pk: client.post(reverse('update_cart_quantity', args=[pk]), {'action': 'increase'}), 0),
+    (lambda client, pk: client.post(reverse('update_cart_quantity', args=[pk]), {'action': 'decrease'}), 0),
+    (lambda client, pk: client.post(reverse('remove_from_cart', args=[pk])), 0),
+    (lambda client, pk: post_batch(client, [{'op': 'set', 'product_id': pk, 'quantity': 4}]), 0),
+    (lambda client, pk: client.get(reverse('view_cart')), 1),
+])
+def test_cart_endpoint_query_counts(client, product_fixture, request_cart, product_query_count):
+    """
+    Query-count regression test: once a product is in the cart, cart
+    endpoints answer from the session and the product id snapshot without
+    reading the product table; only the cart page resolves product details.
+    """
+    client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+    client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+
+    with CaptureQueriesContext(connection) as queries:
+        response = request_cart(client, product_fixture.pk)
+    assert response.status_code in (200, 302)
+    assert len(_product_queries(queries)) == product_query_count
+    # Session read and write, with the savepoints around the write.
+    assert len(queries) <= product_query_count + 4
+
+@pytest.mark.django_db
+def test_add_new_product_to_cart_reads_only_its_price_and_name(client, product_fixture):
+    """
+    Query-count regression test: adding a product new to the cart costs one
+    query, for its price and the name an XHR response reports.
+    """
+    with CaptureQueriesContext(connection) as queries:
+        data = client.post(reverse('add_to_cart', args=[product_fixture.pk]), headers={'x-requested-with': 'XMLHttpRequest'}).json()
+    assert data['message'] == f'{product_fixture.name} added to cart!'
+    product_queries = _product_queries(queries)
+    assert len(product_queries) == 1
+    assert product_queries[0]['sql'].startswith(
+        'SELECT "products_product"."price" AS "price", "products_product"."name" AS "name" FROM'
+    )
+
+@pytest.mark.django_db
+def test_add_unknown_product_to_cart_is_404(client):
+    """
+    Test that adding a product that does not exist returns 404.
+    """
+    assert client.post(reverse('add_to_cart', args=[999])).status_code == 404
+
+@pytest.mark.django_db
+def test_product_id_snapshot_is_invalidated_on_delete(product_fixture, django_capture_on_commit_callbacks):
+    """
+    Test that the product id snapshot forgets deleted products and learns
+    new ones.
+    """
+    from products.cart import product_ids
+    deleted_pk = product_fixture.pk
+    assert product_ids.contains(deleted_pk)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        product_fixture.delete()
+        new_product = Product.objects.create(name="New", description="", price=1)
+    assert not product_ids.contains(deleted_pk)
+    assert product_ids.contains(new_product.pk)
+
+@pytest.mark.django_db
+def test_product_id_snapshot_survives_updates(multiple_products_fixture, django_capture_on_commit_callbacks, django_assert_num_queries):
+    """
+    Test that product updates and catalog version bumps keep the snapshot,
+    and that a product added by another process costs one pk lookup, once.
+    """
+    from products.cart import product_ids
+    product_a, _ = multiple_products_fixture
+    assert product_ids.contains(product_a.pk)
+    with django_capture_on_commit_callbacks(execute=True):
+        product_a.price = 5
+        product_a.save()
+    catalog_cache.bump_catalog_version()
+    with django_assert_num_queries(0):
+        assert product_ids.contains(product_a.pk)
+
+    # Inserted without signals, as by another process.
+    other = Product.objects.bulk_create([Product(name='Other', description='', price=1)])[0]
+    with django_assert_num_queries(1):
+        assert product_ids.contains(other.pk)
+    with django_assert_num_queries(0):
+        assert product_ids.contains(other.pk)
+    assert not product_ids.contains(other.pk + 1000)
+
+@pytest.fixture(params=['session', 'cookie', 'cache', 'database'])
+def cart_storage_mode(request, settings):
+    """
+    Fixture to run a test under each cart storage backend.
+    """
+    settings.CART_STORAGE = settings.CART_STORAGE_BACKENDS[request.param]
+    settings.CART_WRITE_BEHIND_SECONDS = 3600
+    return request.param
+
+def _session_writes(queries):
+    return [q for q in queries if 'django_session' in q['sql'] and q['sql'].startswith(('INSERT', 'UPDATE'))]
+
+@pytest.mark.django_db
+def test_cart_flow_is_identical_across_storage_modes(client, multiple_products_fixture, cart_storage_mode):
+    """
+    Test that the cart views behave the same whichever storage holds the cart.
+    """
+    product_a, product_b = multiple_products_fixture
+    client.post(reverse('add_to_cart', args=[product_a.pk]))
+    client.post(reverse('add_to_cart', args=[product_b.pk]))
+    data = client.post(reverse('update_cart_quantity', args=[product_a.pk]), {'action': 'increase'}).json()
+    assert data['total_price'] == 40.0
+
+    data = post_batch(client, [{'op': 'set', 'product_id': product_b.pk, 'quantity': 3}]).json()
+    assert data['total_price'] == 80.0
+    assert cart_items(client) == {product_a.pk: 2, product_b.pk: 3}
+
+    response = client.get(reverse('view_cart'))
+    assert response.context['total_price'] == Decimal('80.00')
+
+    client.post(reverse('remove_from_cart', args=[product_a.pk]))
+    client.post(reverse('remove_from_cart', args=[product_b.pk]))
+    assert cart_items(client) == {}
+    assert "Your cart is empty." in client.get(reverse('view_cart')).content.decode('utf-8')
+
+@pytest.mark.django_db
+def test_cookie_cart_storage_writes_no_session(client, product_fixture, settings):
+    """
+    Test that carts kept in a signed cookie cost no session writes, and that
+    a tampered cookie is ignored.
+    """
+    settings.CART_STORAGE = settings.CART_STORAGE_BACKENDS['cookie']
+    with CaptureQueriesContext(connection) as queries:
+        client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+        client.post(reverse('update_cart_quantity', args=[product_fixture.pk]), {'action': 'increase'})
+    assert _session_writes(queries) == []
+    assert settings.CART_COOKIE_NAME in client.cookies
+    assert cart_items(client) == {product_fixture.pk: 2}
+
+    client.cookies[settings.CART_COOKIE_NAME] = client.cookies[settings.CART_COOKIE_NAME].value[:-2] + 'xx'
+    assert cart_items(client) == {}
+
+@pytest.mark.django_db
+def test_cookie_cart_storage_falls_back_to_session_for_large_carts(client, settings):
+    """
+    Test that a cart too large for a cookie is kept in the session instead.
+    """
+    settings.CART_STORAGE = settings.CART_STORAGE_BACKENDS['cookie']
+    settings.CART_COOKIE_MAX_BYTES = 200
+    products = Product.objects.bulk_create(
+        Product(name=f"Product {i}", description="", price=i + 1) for i in range(30)
+    )
+    for product in products:
+        client.post(reverse('add_to_cart', args=[product.pk]))
+
+    assert client.cookies[settings.CART_COOKIE_NAME].value == ''
+    assert 'cart' in client.session
+    assert len(cart_items(client)) == 30
+
+@pytest.mark.django_db
+def test_cache_cart_storage_writes_behind(client, product_fixture, settings):
+    """
+    Test that carts kept in the cache are written to the session only when
+    the write-behind queue flushes, with repeated changes coalesced and the
+    rest of the session kept.
+    """
+    from products.cart_storage import get_cart_storage
+    settings.CART_STORAGE = settings.CART_STORAGE_BACKENDS['cache']
+    settings.CART_WRITE_BEHIND_SECONDS = 3600
+    storage = get_cart_storage()
+
+    client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(5):
+            client.post(reverse('update_cart_quantity', args=[product_fixture.pk]), {'action': 'increase'})
+    assert _session_writes(queries) == []
+    assert cart_items(client) == {product_fixture.pk: 6}
+    assert 'cart' not in client.session
+    # Saved by another request since the cart changed.
+    session = client.session
+    session['recently_viewed'] = [product_fixture.pk]
+    session.save()
+
+    with CaptureQueriesContext(connection) as queries:
+        assert storage.queue.flush() == 1
+    assert len(_session_writes(queries)) == 1
+    assert client.session['cart']['items'] == {str(product_fixture.pk): [6, 1999]}
+    assert client.session['recently_viewed'] == [product_fixture.pk]
+
+    # A cache miss falls back to the session copy.
+    caches[settings.CART_CACHE_ALIAS].clear()
+    assert cart_items(client) == {product_fixture.pk: 6}
+
+@pytest.mark.django_db
+def test_sqlite_connections_are_tuned():
+    """
+    Test that new SQLite connections get the configured PRAGMAs.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA synchronous')
+        assert cursor.fetchone()[0] == 1  # NORMAL
+        cursor.execute('PRAGMA cache_size')
+        assert cursor.fetchone()[0] == -64 * 1024
+    assert connection.transaction_mode == 'IMMEDIATE'
+
+@pytest.mark.django_db(transaction=True)
+def test_retry_on_lock_retries_locked_writes(settings):
+    """
+    Test that writes failing with "database is locked" are retried, and that
+    other errors, and errors inside an atomic block, are not.
+    """
+    from django.db import OperationalError, transaction
+    from products.db import retry_on_lock
+    settings.DATABASE_LOCK_RETRY_BACKOFF = 0
+    calls = []
+
+    @retry_on_lock
+    def flaky_write(error='database is locked', failures=2):
+        calls.append(error)
+        if len(calls) <= failures:
+            raise OperationalError(error)
+        return 'written'
+
+    assert flaky_write() == 'written'
+    assert len(calls) == 3
+
+    calls.clear()
+    with pytest.raises(OperationalError):
+        flaky_write(failures=10)
+    assert len(calls) == settings.DATABASE_LOCK_RETRIES + 1
+
+    calls.clear()
+    with pytest.raises(OperationalError):
+        flaky_write(error='no such table: x')
+    assert len(calls) == 1
+
+    calls.clear()
+    with pytest.raises(OperationalError), transaction.atomic():
+        flaky_write()
+    assert len(calls) == 1
+
+
+@pytest.fixture
+def replica_router(settings):
+    """
+    Fixture for a router with a read replica configured. Tests use one
+    database, so only routing decisions are checked, not queries.
+    """
+    from products.routers import PrimaryReplicaRouter
+    settings.READ_REPLICA_ALIAS = 'replica'
+    return PrimaryReplicaRouter()
+
+def test_router_sends_catalog_reads_to_replica(replica_router):
+    """
+    Test that only catalog reads use the replica, and all writes use the primary.
+    """
+    from django.contrib.sessions.models import Session
+    from products.models import CartItem
+    assert replica_router.db_for_read(Product) == 'replica'
+    assert replica_router.db_for_read(Session) == 'default'
+    assert replica_router.db_for_read(CartItem) == 'default'
+    assert replica_router.db_for_write(Session) == 'default'
+    assert replica_router.allow_migrate('replica', 'products') is False
+
+def test_router_without_replica_uses_primary(settings):
+    """
+    Test that nothing is routed to a replica unless one is configured.
+    """
+    from products.routers import PrimaryReplicaRouter, is_pinned_to_primary
+    settings.READ_REPLICA_ALIAS = None
+    router = PrimaryReplicaRouter()
+    assert router.db_for_read(Product) == 'default'
+    assert router.db_for_write(Product) == 'default'
+    assert not is_pinned_to_primary()
+
+def test_router_reads_own_writes(replica_router):
+    """
+    Test that after a product write, reads in the same request and in
+    requests carrying the sticky cookie go to the primary.
+    """
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from products.middleware import ReplicaPinMiddleware
+
+    def edit_product(request):
+        assert replica_router.db_for_read(Product) == 'replica'
+        assert replica_router.db_for_write(Product) == 'default'
+        assert replica_router.db_for_read(Product) == 'default'
+        return HttpResponse()
+
+    response = ReplicaPinMiddleware(edit_product)(RequestFactory().post('/admin/'))
+    cookie = response.cookies['read_primary_until']
+    assert 0 < cookie['max-age'] <= 15
+    # The pin does not leak out of the request.
+    assert replica_router.db_for_read(Product) == 'replica'
+
+    def read_product(request):
+        assert replica_router.db_for_read(Product) == 'default'
+        return HttpResponse()
+
+    request = RequestFactory().get('/')
+    request.COOKIES['read_primary_until'] = cookie.value
+    response = ReplicaPinMiddleware(read_product)(request)
+    assert 'read_primary_until' not in response.cookies
+
+@pytest.mark.django_db
+@pytest.mark.filterwarnings('ignore:Overriding setting DATABASES')
+def test_sync_replica_copies_database_and_bumps_catalog(tmp_path, settings):
+    """
+    Test that the replication stand-in copies the primary onto the replica
+    and invalidates pages cached while the replica lagged.
+    """
+    import sqlite3
+    from products.replication import sync_replica
+    primary, replica = tmp_path / 'primary.sqlite3', tmp_path / 'replica.sqlite3'
+    with sqlite3.connect(primary) as db:
+        db.execute('CREATE TABLE t (x)')
+        db.execute('INSERT INTO t VALUES (1)')
+    settings.DATABASES = {
+        **settings.DATABASES,
+        'default': {**settings.DATABASES['default'], 'NAME': str(primary)},
+        'replica': {**settings.DATABASES['default'], 'NAME': str(replica)},
+    }
+    settings.READ_REPLICA_ALIAS = 'replica'
+    version = catalog_cache.catalog_version()
+    assert sync_replica() == 'replica'
+    assert catalog_cache.catalog_version() > version
+    with sqlite3.connect(replica) as db:
+        assert db.execute('SELECT x FROM t').fetchall() == [(1,)]
+
+
+@pytest.fixture
+def search_products():
+    """
+    Fixture to create products whose names and descriptions overlap.
+    """
+    return [
+        Product.objects.create(name='Blue Shoe', description='A comfortable running shoe.', price=50),
+        Product.objects.create(name='Red Hat', description='Goes well with a blue scarf.', price=15),
+        Product.objects.create(name='Green Scarf', description='Wool.', price=20),
+    ]
+
+def _search_names(client, query, **params):
+    response = client.get(reverse('search'), {'q': query, **params})
+    assert response.status_code == 200
+    return [product.name for product in response.context['products']]
+
+@pytest.mark.django_db
+def test_search_ranks_name_matches_first(client, search_products):
+    """
+    Test that a term in the name outranks the same term in a description.
+    """
+    assert _search_names(client, 'blue') == ['Blue Shoe', 'Red Hat']
+
+@pytest.mark.django_db
+def test_search_matches_prefixes_of_every_word(client, search_products):
+    """
+    Test that the last word is matched as a prefix and all words must match.
+    """
+    assert _search_names(client, 'sca') == ['Green Scarf', 'Red Hat']
+    assert _search_names(client, 'green sca') == ['Green Scarf']
+    assert _search_names(client, 'gre scarf') == []
+    assert _search_names(client, 'purple') == []
+
+@pytest.mark.django_db
+def test_search_treats_operators_literally(client, search_products):
+    """
+    Test that FTS5 syntax typed into the search box is not interpreted.
+    """
+    assert _search_names(client, 'name: "blue" OR NEAR(') == []
+    assert _search_names(client, 'blue*') == ['Blue Shoe', 'Red Hat']
+    assert _search_names(client, '') == []
+
+@pytest.mark.django_db
+def test_search_index_follows_writes(client, search_products):
+    """
+    Test that the index tracks saves, deletes, bulk creates and queryset
+    updates, which bypass model signals.
+    """
+    shoe, hat, scarf = search_products
+    shoe.name = 'Yellow Shoe'
+    shoe.save()
+    Product.objects.filter(pk=hat.pk).update(description='Plain.')
+    scarf.delete()
+    Product.objects.bulk_create([Product(name='Blue Mug', description='', price=5)])
+    assert _search_names(client, 'blue') == ['Blue Mug']
+    assert _search_names(client, 'yellow') == ['Yellow Shoe']
+
+@pytest.mark.django_db
+def test_search_paginates(client):
+    """
+    Test that results are split into numbered pages.
+    """
+    Product.objects.bulk_create(Product(name=f'Lamp {i}', description='', price=i) for i in range(5))
+    first = _search_names(client, 'lamp', page_size=2)
+    response = client.get(reverse('search'), {'q': 'lamp', 'page_size': 2, 'page': 3})
+    assert len(first) == 2
+    assert len(response.context['products']) == 1
+    assert response.context['has_previous'] and not response.context['has_next']
+
+@pytest.mark.django_db
+def test_search_uses_full_text_index(search_products):
+    """
+    Test that the search query is answered by the FTS5 index in a single query.
+    """
+    from products.search import search_product_ids
+    with CaptureQueriesContext(connection) as queries:
+        assert search_product_ids('shoe', 10) == [search_products[0].pk]
+    assert any('MATCH' in query['sql'] for query in queries.captured_queries)
+
+@pytest.mark.django_db
+def test_admin_search_uses_full_text_index(admin_client, search_products):
+    """
+    Test that the admin changelist search goes through the full-text index.
+    """
+    with CaptureQueriesContext(connection) as queries:
+        response = admin_client.get('/admin/products/product/', {'q': 'scarf'})
+    assert response.status_code == 200
+    assert {product.name for product in response.context['cl'].result_list} == {'Green Scarf', 'Red Hat'}
+    assert not any('LIKE' in query['sql'] for query in queries.captured_queries)
+
+
+def _import(path, *args):
+    from io import StringIO
+    from django.core.management import call_command
+    stdout, stderr = StringIO(), StringIO()
+    call_command('import_products', str(path), *args, stdout=stdout, stderr=stderr)
+    return stdout.getvalue(), stderr.getvalue()
+
+@pytest.mark.django_db
+def test_import_products_upserts_by_sku(tmp_path):
+    """
+    Test that importing creates new products, updates existing ones by sku,
+    and reports invalid rows without stopping.
+    """
+    Product.objects.create(sku='A-1', name='Old name', description='', price=1)
+    source = tmp_path / 'products.csv'
+    source.write_text(
+        'sku,name,description,price,image_url\n'
+        'A-1,Lamp,Bright,12.50,\n'
+        'B-2,Chair,,30,http://example.com/chair.jpg\n'
+        'C-3,Table,,not a price,\n'
+        ',Nameless,,5,\n'
+    )
+    stdout, stderr = _import(source, '--batch-size', '1')
+    assert '1 created, 1 updated, 2 rejected' in stdout
+    assert 'line 4: price' in stderr and 'line 5: sku is required' in stderr
+    assert dict(Product.objects.values_list('sku', 'name')) == {'A-1': 'Lamp', 'B-2': 'Chair'}
+    assert Product.objects.get(sku='A-1').price == Decimal('12.50')
+    assert not (tmp_path / 'products.csv.checkpoint').exists()
+
+@pytest.mark.django_db
+def test_import_products_resumes_from_checkpoint(tmp_path):
+    """
+    Test that an import stopped part-way resumes after its last committed batch.
+    """
+    from django.core.management.base import CommandError
+    source = tmp_path / 'products.jsonl'
+    source.write_text(
+        '{"sku": "A", "name": "A", "price": "1"}\n'
+        '{"sku": "B", "name": "B", "price": "2"}\n'
+        'not json\n'
+        '{"sku": "C", "name": "C", "price": "3"}\n'
+    )
+    with pytest.raises(CommandError):
+        _import(source, '--batch-size', '2', '--max-errors', '1')
+    assert json.loads((tmp_path / 'products.jsonl.checkpoint').read_text())['line'] == 2
+    source.write_text(source.read_text().replace('not json', '{"sku": "A", "name": "Ignored", "price": "9"}'))
+    stdout, _ = _import(source, '--batch-size', '2')
+    assert 'Resuming after line 2' in stdout
+    assert dict(Product.objects.values_list('sku', 'name')) == {'A': 'Ignored', 'B': 'B', 'C': 'C'}
+
+@pytest.mark.django_db
+def test_import_products_resume_counts_each_row_once(tmp_path):
+    """
+    Test that rows rejected after the checkpoint of a stopped import are
+    counted and written to the errors file once, and that --max-errors
+    applies to each run.
+    """
+    from django.core.management.base import CommandError
+    source = tmp_path / 'products.jsonl'
+    errors = tmp_path / 'errors.jsonl'
+    source.write_text(
+        '{"sku": "A", "name": "A", "price": "1"}\n'
+        'not json\n'
+        '{"sku": "B", "name": "B", "price": "2"}\n'
+        '{"sku": "X", "price": "3"}\n'
+        '{"sku": "C", "name": "C", "price": "3"}\n'
+    )
+    with pytest.raises(CommandError):
+        _import(source, '--batch-size', '2', '--max-errors', '2', '--errors', str(errors))
+    stdout, _ = _import(source, '--batch-size', '2', '--max-errors', '2', '--errors', str(errors))
+    assert '3 created, 0 updated, 2 rejected' in stdout
+    assert [json.loads(line)['line'] for line in errors.read_text().splitlines()] == [2, 4]
+    assert set(Product.objects.values_list('sku', flat=True)) == {'A', 'B', 'C'}
+
+@pytest.mark.django_db
+def test_export_products_round_trips(tmp_path):
+    """
+    Test that an export can be imported back without changing anything.
+    """
+    from django.core.management import call_command
+    Product.objects.create(sku='A-1', name='Lamp, "bright"', description='Line one\nline two', price='12.50')
+    Product.objects.create(sku='B-2', name='Chair', description='', price=30, image_url='http://example.com/c.jpg')
+    for format in ('csv', 'jsonl'):
+        path = tmp_path / f'export.{format}'
+        call_command('export_products', str(path), '--chunk-size', '1', stderr=None)
+        stdout, stderr = _import(path)
+        assert '0 created, 0 updated, 0 rejected' in stdout, stderr
+
+
+@pytest.mark.django_db
+def test_url_builder_matches_reverse():
+    """
+    Test that URLs built from a reversed prefix equal reverse()'s.
+    """
+    from django.urls import NoReverseMatch
+    from products.reversing import url_builder
+    detail_url = url_builder('product_detail')
+    for pk in (1, 42, 10 ** 12):
+        assert detail_url(pk) == reverse('product_detail', args=[pk])
+    assert url_builder('add_to_cart')(7) == reverse('add_to_cart', args=[7])
+    with pytest.raises(NoReverseMatch):
+        url_builder('view_cart')
+
+@pytest.mark.django_db
+def test_product_cards_are_cached_across_pages(client, multiple_products_fixture):
+    """
+    Test that each product card is rendered once and reused by other
+    listings, with working links.
+    """
+    product_a, _ = multiple_products_fixture
+    response = client.get(reverse('product_list'))
+    content = response.content.decode()
+    assert f'href="{reverse("product_detail", args=[product_a.pk])}"' in content
+    assert f'action="{reverse("add_to_cart", args=[product_a.pk])}"' in content
+    assert catalog_cache.stats.snapshot()['card'] == {'hits': 0, 'misses': 2}
+
+    response = client.get(reverse('product_list'), {'sort': '-price'})
+    assert catalog_cache.stats.snapshot()['card'] == {'hits': 2, 'misses': 2}
+
+@pytest.mark.django_db
+def test_product_cards_follow_product_changes(client, product_fixture, django_capture_on_commit_callbacks):
+    """
+    Test that editing a product replaces its cached card.
+    """
+    client.get(reverse('product_list'))
+    with django_capture_on_commit_callbacks(execute=True):
+        product_fixture.name = 'Renamed Product'
+        product_fixture.save()
+    response = client.get(reverse('product_list'), {'sort': 'price'})
+    assert 'Renamed Product' in response.content.decode()
+
+
+def test_stylesheet_translates_utilities():
+    """
+    Test that utility classes, with breakpoint and state variants, become
+    the matching CSS rules and that other class names are skipped.
+    """
+    from products import stylesheet
+    css = stylesheet.build({'p-4', 'md:w-1/2', 'hover:-translate-y-0.5', 'focus:ring-purple-500', 'js-hook'})
+    assert '.p-4{padding:1rem}' in css
+    assert '@media (min-width:768px){.container' not in css
+    assert '@media (min-width:768px){.md\\:w-1\\/2{width:50%}}' in css
+    assert '.hover\\:-translate-y-0\\.5:hover{--tw-translate-y:-0.125rem;' in css
+    assert '.focus\\:ring-purple-500:focus{--tw-ring-color:rgb(168 85 247/' in css
+    assert 'js-hook' not in css
+
+def test_stylesheet_extracts_classes_from_templates():
+    """
+    Test that classes are read from class attributes around template tags
+    and from classList calls in scripts.
+    """
+    from products import stylesheet
+    source = (
+        '<a class="px-3 {% if active %}bg-purple-600{% else %}bg-white{% endif %}">'
+        "<script>row.classList.add('opacity-50');</script>"
+    )
+    assert stylesheet.extract_classes(source) == {'px-3', 'bg-purple-600', 'bg-white', 'opacity-50'}
+
+@pytest.mark.django_db
+def test_built_stylesheet_is_current_and_within_budget():
+    """
+    Test that site.css matches the templates and is under CSS_BUDGET_BYTES,
+    so a template change without `manage.py build_css` fails here.
+    """
+    from django.core.management import call_command
+    call_command('build_css', '--check')
+
+@pytest.mark.django_db
+def test_pages_use_the_built_stylesheet(client):
+    """
+    Test that pages link the local stylesheet instead of the Tailwind CDN.
+    """
+    content = client.get(reverse('product_list')).content.decode()
+    assert '/static/products/css/site.css' in content
+    assert 'cdn.tailwindcss.com' not in content
+
+def test_collectstatic_hashes_and_precompresses(tmp_path, settings):
+    """
+    Test that collected CSS gets a content-hashed name and a gzip copy.
+    """
+    import gzip
+    from django.core.management import call_command
+    from django.templatetags.static import static
+    settings.STATIC_ROOT = tmp_path
+    call_command('collectstatic', interactive=False, verbosity=0)
+    url = static('products/css/site.css')
+    assert url != '/static/products/css/site.css'
+    hashed = tmp_path / url.removeprefix('/static/')
+    assert gzip.decompress((tmp_path / f'{hashed}.gz').read_bytes()) == hashed.read_bytes()
+
+
+@pytest.mark.django_db
+def test_catalog_pages_answer_conditional_gets(client, product_fixture, django_assert_num_queries):
+    """
+    Test that revalidating an unchanged catalog page returns 304 without
+    rendering or querying, with shared-cacheable headers.
+    """
+    for url in [reverse('product_list'), reverse('product_detail', args=[product_fixture.pk]), '/search/?q=test']:
+        first = client.get(url)
+        assert first['ETag'] and first['Last-Modified']
+        assert first['Cache-Control'] == 'public, max-age=0, must-revalidate'
+        assert 'Cookie' in first['Vary']
+        with django_assert_num_queries(0):
+            second = client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        assert second.status_code == 304
+        assert second.content == b''
+        assert client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code == 304
+
+@pytest.mark.django_db
+def test_catalog_pages_are_shared_cacheable_for_anonymous_visitors(client, product_fixture, settings, django_user_model):
+    """
+    Test that a first visit gets a public page without a CSRF cookie, and
+    that a signed-in user's page is private.
+    """
+    settings.CATALOG_MAX_AGE = 60
+    url = reverse('product_list')
+    response = client.get(url)
+    assert not response.cookies
+    assert response['Cache-Control'] == 'public, max-age=60, must-revalidate'
+
+    client.force_login(django_user_model.objects.create_user('shopper', password='pw'))
+    assert client.get(url)['Cache-Control'] == 'private, max-age=60, must-revalidate'
+
+@pytest.mark.django_db
+def test_catalog_etags_change_with_products(client, product_fixture, django_capture_on_commit_callbacks):
+    """
+    Test that changing a product, even through a queryset update, changes
+    the ETags of the list and of its page.
+    """
+    list_url = reverse('product_list')
+    detail_url = reverse('product_detail', args=[product_fixture.pk])
+    etags = {url: client.get(url)['ETag'] for url in (list_url, detail_url)}
+    with django_capture_on_commit_callbacks(execute=True):
+        Product.objects.filter(pk=product_fixture.pk).update(price=5)
+    for url, etag in etags.items():
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+
+@pytest.mark.django_db
+def test_product_etag_survives_other_product_changes(client, multiple_products_fixture, django_capture_on_commit_callbacks):
+    """
+    Test that a product page stays valid when a different product changes.
+    """
+    product_a, product_b = multiple_products_fixture
+    url = reverse('product_detail', args=[product_a.pk])
+    etag = client.get(url)['ETag']
+    with django_capture_on_commit_callbacks(execute=True):
+        product_b.name = 'Renamed'
+        product_b.save()
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+@pytest.mark.django_db
+def test_cart_responses_are_not_cacheable(client, product_fixture):
+    """
+    Test that responses carrying cart state are marked private and not stored.
+    """
+    client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+    for response in [
+        client.get(reverse('view_cart')),
+        client.post(reverse('update_cart_quantity', args=[product_fixture.pk]), {'action': 'increase'}),
+    ]:
+        assert 'no-store' in response['Cache-Control']
+        assert 'private' in response['Cache-Control']
+
+
+@pytest.fixture
+def asgi_client(settings):
+    """
+    Fixture for a test client that goes through the ASGI handler, with the
+    async URLconf that ecom_demo/asgi.py selects, wrapped so sync tests can
+    call it.
+    """
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+    settings.ROOT_URLCONF = 'ecom_demo.async_urls'
+
+    class SyncAsyncClient:
+        def __init__(self):
+            self.client = AsyncClient()
+
+        def __getattr__(self, name):
+            value = getattr(self.client, name)
+            if name in ('get', 'post'):
+                return async_to_sync(value)
+            return value
+
+    return SyncAsyncClient()
+
+@pytest.mark.django_db
+def test_async_urlconf_routes_to_async_views(asgi_client):
+    """
+    Test that the ASGI URLconf serves every catalog and cart route with a
+    coroutine view and a complete async middleware chain.
+    """
+    from asgiref.sync import iscoroutinefunction
+    from django.core.handlers.asgi import ASGIHandler
+    from django.urls import resolve
+    for name in ['product_list', 'search', 'view_cart', 'cart_batch']:
+        assert iscoroutinefunction(resolve(reverse(name)).func)
+    assert iscoroutinefunction(resolve(reverse('product_detail', args=[1])).func)
+    assert iscoroutinefunction(ASGIHandler()._middleware_chain)
+
+@pytest.mark.django_db
+def test_async_catalog_views_match_sync_views(client, asgi_client, multiple_products_fixture):
+    """
+    Test that the async catalog views render the same products as the sync
+    ones, and answer conditional GETs from the cache without queries.
+    """
+    product_a, product_b = multiple_products_fixture
+    for params in [{}, {'sort': '-price', 'page_size': 1}]:
+        expected = [p.pk for p in client.get(reverse('product_list'), params).context['products']]
+        catalog_cache.bump_catalog_version()
+        response = asgi_client.get(reverse('product_list'), params)
+        assert response.status_code == 200
+        assert [p.pk for p in response.context['products']] == expected
+    assert asgi_client.get(reverse('product_list'), {'cursor': 'bogus'}).status_code == 400
+
+    response = asgi_client.get(reverse('product_detail', args=[product_a.pk]))
+    assert response.context['product'] == product_a
+    assert asgi_client.get(reverse('product_detail', args=[0])).status_code == 404
+
+    response = asgi_client.get(reverse('search'), {'q': 'product b'})
+    assert [p.pk for p in response.context['products']] == [product_b.pk]
+
+    etag = response['ETag']
+    with CaptureQueriesContext(connection) as queries:
+        assert asgi_client.get(reverse('search'), {'q': 'product b'}, headers={'if-none-match': etag}).status_code == 304
+        cached = asgi_client.get(reverse('search'), {'q': 'product b'})
+    assert len(queries) == 0
+    assert product_b.name in cached.content.decode('utf-8')
+
+@pytest.mark.django_db
+def test_async_cart_flow_is_identical_across_storage_modes(asgi_client, multiple_products_fixture, cart_storage_mode):
+    """
+    Test that the async cart views behave like the sync ones under each cart
+    storage backend.
+    """
+    product_a, product_b = multiple_products_fixture
+    response = asgi_client.post(reverse('add_to_cart', args=[product_a.pk]))
+    assert response.status_code == 302
+    data = asgi_client.post(reverse('add_to_cart', args=[product_b.pk]), headers={'x-requested-with': 'XMLHttpRequest'}).json()
+    assert data['message'] == 'Product B added to cart!'
+    assert asgi_client.post(reverse('add_to_cart', args=[0])).status_code == 404
+    data = asgi_client.post(reverse('update_cart_quantity', args=[product_a.pk]), {'action': 'increase'}).json()
+    assert data['total_price'] == 40.0
+
+    data = asgi_client.post(
+        reverse('cart_batch'),
+        json.dumps([{'op': 'set', 'product_id': product_b.pk, 'quantity': 3}]),
+        content_type='application/json',
+    ).json()
+    assert data['total_price'] == 80.0
+    assert cart_items(asgi_client) == {product_a.pk: 2, product_b.pk: 3}
+
+    response = asgi_client.get(reverse('view_cart'))
+    assert response.context['total_price'] == Decimal('80.00')
+    assert 'no-store' in response['Cache-Control']
+
+    asgi_client.post(reverse('remove_from_cart', args=[product_a.pk]))
+    asgi_client.post(reverse('remove_from_cart', args=[product_b.pk]))
+    assert cart_items(asgi_client) == {}
+    assert asgi_client.post(reverse('remove_from_cart', args=[product_a.pk])).status_code == 404
+
+
+def test_histogram_percentiles_are_within_bucket_precision():
+    """
+    Test that histogram percentiles stay within 1/64 of the exact values,
+    and that small values are exact.
+    """
+    from products.metrics import Histogram
+    histogram = Histogram()
+    values = list(range(1, 100001))
+    random.Random(1).shuffle(values)
+    for value in values:
+        histogram.record(value)
+    for q in (0.5, 0.9, 0.99):
+        exact = q * 100000
+        assert exact <= histogram.percentile(q) <= exact * (1 + 1 / 64)
+    assert histogram.percentile(1) == histogram.max == 100000
+    assert histogram.total == sum(values)
+
+    small = Histogram()
+    for value in (3, 5, 7):
+        small.record(value)
+    assert small.percentile(0.5) == 5
+    assert len(histogram.counts) < 1000
+
+@pytest.mark.django_db
+def test_performance_middleware_records_views(client, product_fixture):
+    """
+    Test that each request's queries, template time and session save time
+    are recorded under its view name and reported in Server-Timing.
+    """
+    from products.metrics import metrics
+    response = client.get(reverse('product_list'))
+    assert 'db;dur=' in response['Server-Timing'] and 'total;dur=' in response['Server-Timing']
+    client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+
+    queries = metrics.histogram('product_list', 'db_queries')
+    assert queries.count == 1 and queries.max >= 1
+    assert metrics.histogram('product_list', 'template_render_seconds').max > 0
+    assert metrics.histogram('add_to_cart', 'session_save_seconds').max > 0
+    assert metrics.histogram('add_to_cart', 'template_render_seconds').max == 0
+
+@pytest.mark.django_db
+def test_performance_middleware_flags_repeated_queries(rf, settings, caplog):
+    """
+    Test that a request running one statement past the threshold is logged
+    and counted as a likely N+1.
+    """
+    from django.http import HttpResponse
+    from products.metrics import metrics
+    from products.middleware import PerformanceMiddleware
+    settings.METRICS_N_PLUS_ONE_THRESHOLD = 5
+
+    def view(request):
+        for pk in range(5):
+            Product.objects.filter(pk=pk).first()
+        return HttpResponse()
+
+    PerformanceMiddleware(view)(rf.get('/'))
+    assert 'Possible N+1 queries in <unresolved>: 5 runs' in caplog.text
+    assert 'ecom_n_plus_one_total{view="<unresolved>"} 1' in metrics.prometheus()
+
+@pytest.mark.django_db
+def test_metrics_endpoint_is_protected(client, admin_client, settings):
+    """
+    Test that /metrics needs a staff login or the bearer token, and serves
+    view histograms and cache counters in the Prometheus format.
+    """
+    settings.METRICS_TOKEN = 'scrape-token'
+    client.get(reverse('product_list'))
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'authorization': 'Bearer wrong'}).status_code == 403
+
+    response = client.get('/metrics', headers={'authorization': 'Bearer scrape-token'})
+    assert response.status_code == 200
+    assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+    body = response.content.decode()
+    assert '# TYPE ecom_request_duration_seconds summary' in body
+    assert 'ecom_db_queries_count{view="product_list"} 1' in body
+    assert 'ecom_request_duration_seconds{view="product_list",quantile="0.99"}' in body
+    assert 'ecom_catalog_cache_requests_total{namespace="page",result="miss"} 1' in body
+    assert admin_client.get('/metrics').status_code == 200
+
+@pytest.mark.django_db
+def test_performance_middleware_counts_async_view_queries(asgi_client, product_fixture):
+    """
+    Test that queries run by async views, in sync_to_async threads, are
+    counted for their request.
+    """
+    from products.metrics import metrics
+    response = asgi_client.get(reverse('product_detail', args=[product_fixture.pk]))
+    assert response.status_code == 200
+    assert metrics.histogram('product_detail', 'db_queries').max >= 1
+    assert 'Server-Timing' in response
+
+@pytest.mark.django_db
+def test_database_carts_do_not_lose_concurrent_updates(client, multiple_products_fixture, settings):
+    """
+    Test that two tabs changing one database cart at once both count, since
+    each writes only its own changes, as in-place updates.
+    """
+    from django.test import RequestFactory
+    from products.cart_storage import get_cart_storage
+    from products.models import CartItem
+    settings.CART_STORAGE = settings.CART_STORAGE_BACKENDS['database']
+    product_a, product_b = multiple_products_fixture
+    client.post(reverse('add_to_cart', args=[product_a.pk]))
+
+    storage = get_cart_storage()
+    tabs = []
+    for _ in range(2):
+        request = RequestFactory().post('/')
+        request.session = client.session
+        tabs.append((request, storage.load_cart(request)))
+    tabs[0][1].increase(product_a.pk)
+    tabs[0][1].add(product_b.pk, product_b.price)
+    tabs[1][1].increase(product_a.pk, 2)
+    tabs[1][1].add(product_b.pk, product_b.price)
+    with CaptureQueriesContext(connection) as queries:
+        for request, cart in tabs:
+            storage.save_cart(request, None, cart)
+
+    assert cart_items(client) == {product_a.pk: 4, product_b.pk: 2}
+    assert any('"quantity" + ' in q['sql'] for q in queries)
+    assert CartItem.objects.count() == 2
+
+@pytest.mark.django_db
+def test_database_cart_page_reads_cart_in_one_query(client, multiple_products_fixture, settings):
+    """
+    Test that the cart page loads the cart's lines and their products with
+    one joined query.
+    """
+    settings.CART_STORAGE = settings.CART_STORAGE_BACKENDS['database']
+    product_a, product_b = multiple_products_fixture
+    client.post(reverse('add_to_cart', args=[product_a.pk]))
+    client.post(reverse('add_to_cart', args=[product_b.pk]))
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse('view_cart'))
+    assert [line.name for line in response.context['cart_items']] == ['Product A', 'Product B']
+    assert response.context['total_price'] == Decimal('30.00')
+    cart_queries = [q['sql'] for q in queries if 'products_' in q['sql']]
+    assert len(cart_queries) == 1
+    assert 'JOIN "products_product"' in cart_queries[0]
+
+@pytest.mark.django_db
+def test_database_carts_belong_to_logged_in_users(admin_client, admin_user, product_fixture, settings):
+    """
+    Test that a logged-in user's database cart follows them to a new session.
+    """
+    from django.test import Client
+    settings.CART_STORAGE = settings.CART_STORAGE_BACKENDS['database']
+    admin_client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+
+    other_device = Client()
+    other_device.force_login(admin_user)
+    data = other_device.post(
+        reverse('update_cart_quantity', args=[product_fixture.pk]), {'action': 'increase'},
+    ).json()
+    assert data['new_quantity'] == 2
+    assert Product.objects.get().cartitem_set.get().quantity == 2
+
+@pytest.mark.django_db
+def test_collect_garbage_deletes_expired_sessions_and_abandoned_carts(product_fixture, settings):
+    """
+    Test that collect_garbage removes expired sessions, carts of sessions
+    that are gone and carts untouched for CART_ABANDONED_DAYS, in batches,
+    and leaves live ones alone.
+    """
+    from datetime import timedelta
+    from io import StringIO
+    from django.contrib.sessions.models import Session
+    from django.core.management import call_command
+    from django.utils import timezone
+    from products.models import Cart, CartItem
+    now = timezone.now()
+    for i in range(5):
+        Session.objects.create(session_key=f'expired{i}', session_data='', expire_date=now - timedelta(days=1))
+    Session.objects.create(session_key='live', session_data='', expire_date=now + timedelta(days=1))
+    live = Cart.objects.create(session_key='live')
+    orphaned = Cart.objects.create(session_key='expired0')
+    stale = Cart.objects.create(user=None)
+    Cart.objects.filter(pk=stale.pk).update(updated_at=now - timedelta(days=settings.CART_ABANDONED_DAYS + 1))
+    for cart in (live, orphaned, stale):
+        CartItem.objects.create(cart=cart, product=product_fixture)
+
+    out = StringIO()
+    call_command('collect_garbage', batch_size=2, rate=0, stdout=out, stderr=StringIO())
+    assert 'Deleted 5 expired sessions and 2 abandoned carts' in out.getvalue()
+    assert list(Session.objects.values_list('session_key', flat=True)) == ['live']
+    assert list(Cart.objects.all()) == [live]
+    assert CartItem.objects.get().cart == live
+
+@pytest.mark.django_db(transaction=True)
+def test_incremental_vacuum_releases_free_pages():
+    """
+    Test that freed pages are returned in steps without a full VACUUM.
+    """
+    from django.contrib.sessions.models import Session
+    from django.utils import timezone
+    from products.maintenance import database_pages, incremental_vacuum
+    Session.objects.bulk_create(
+        Session(session_key=f'{i:040d}', session_data='x' * 2000, expire_date=timezone.now()) for i in range(500)
+    )
+    Session.objects.all().delete()
+    _, pages, free = database_pages()
+    assert free > 10
+
+    assert incremental_vacuum(step=4, pause=0) == free
+    _, pages_after, free_after = database_pages()
+    assert free_after == 0
+    assert pages_after == pages - free
+
+@pytest.mark.django_db
+def test_warm_prepares_urls_templates_and_catalog(client, multiple_products_fixture):
+    """
+    Test that warm() compiles the templates and caches the first catalog
+    page, without leaving metrics from its own requests behind.
+    """
+    from products.boot import warm
+    from products.metrics import metrics
+    timings = warm()
+    assert set(timings) == {'urls', 'templates', 'catalog'}
+    assert not metrics._views
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse('product_list'))
+    assert response.status_code == 200
+    assert 'Product A' in response.content.decode()
+    assert not any('products_product' in query['sql'] for query in queries.captured_queries)
+
+@pytest.mark.django_db
+def test_storefront_settings_serve_catalog_and_cart(client, settings, product_fixture):
+    """
+    Test that the storefront profile, without authentication or messages
+    middleware, serves the catalog, the cart and token-protected metrics.
+    """
+    from ecom_demo import settings_storefront
+    settings.MIDDLEWARE = settings_storefront.MIDDLEWARE
+    settings.TEMPLATES = settings_storefront.TEMPLATES
+    settings.METRICS_TOKEN = 'scrape-token'
+    assert 'django.contrib.auth.middleware.AuthenticationMiddleware' not in settings.MIDDLEWARE
+    assert 'django.contrib.admin' not in settings_storefront.INSTALLED_APPS
+
+    assert client.get(reverse('product_list')).status_code == 200
+    assert client.get(reverse('product_detail', args=[product_fixture.pk])).status_code == 200
+    client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+    response = client.get(reverse('view_cart'))
+    assert response.status_code == 200
+    assert product_fixture.name in response.content.decode()
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'authorization': 'Bearer scrape-token'}).status_code == 200
+
+@pytest.fixture
+def image_server(settings, tmp_path):
+    """
+    Fixture serving generated original images over HTTP from a temporary
+    directory, with MEDIA_ROOT in another. Yields a function returning the
+    URL of an image file name; 'missing.png' is a 404.
+    """
+    import functools
+    import http.server
+    import threading
+    Image = pytest.importorskip('PIL.Image')
+    originals = tmp_path / 'originals'
+    originals.mkdir()
+    Image.new('RGBA', (1200, 900), (200, 40, 40, 128)).save(originals / 'lamp.png')
+    Image.new('RGB', (300, 200), 'navy').save(originals / 'small.jpg')
+    (originals / 'broken.jpg').write_bytes(b'not an image')
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    handler = functools.partial(QuietHandler, directory=str(originals))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield lambda name: f'http://127.0.0.1:{server.server_port}/{name}'
+    server.shutdown()
+    server.server_close()
+
+@pytest.mark.django_db
+def test_ingest_images_writes_resized_copies(image_server, settings):
+    """
+    Test that ingest_images resizes each new image to every width in WebP
+    and JPEG under content-addressed names, records failures without
+    stopping, and skips images already ingested.
+    """
+    from io import StringIO
+    from pathlib import Path
+    from PIL import Image
+    from django.core.management import call_command
+    from products.images import variant_name
+    lamp = Product.objects.create(name='Lamp', description='', price=1, image_url=image_server('lamp.png'))
+    small = Product.objects.create(name='Small', description='', price=1, image_url=image_server('small.jpg'))
+    broken = Product.objects.create(name='Broken', description='', price=1, image_url=image_server('broken.jpg'))
+    missing = Product.objects.create(name='Missing', description='', price=1, image_url=image_server('missing.png'))
+    Product.objects.create(name='No image', description='', price=1)
+
+    out = StringIO()
+    call_command('ingest_images', workers=2, batch_size=3, stdout=out)
+    assert 'Resized 2 product images' in out.getvalue() and '2 failed' in out.getvalue()
+
+    lamp.refresh_from_db()
+    assert lamp.image_digest is not None and lamp.image_source_url == lamp.image_url
+    media = Path(settings.MEDIA_ROOT)
+    for width in settings.PRODUCT_IMAGE_WIDTHS:
+        with Image.open(media / variant_name(lamp.image_digest, width, 'webp')) as webp:
+            assert webp.format == 'WEBP' and webp.size == (width, width * 3 // 4)
+        with Image.open(media / variant_name(lamp.image_digest, width, 'jpeg')) as jpeg:
+            assert jpeg.format == 'JPEG' and jpeg.mode == 'RGB'
+    small.refresh_from_db()
+    with Image.open(media / variant_name(small.image_digest, 600, 'jpeg')) as jpeg:
+        assert jpeg.size == (300, 200)
+    broken.refresh_from_db()
+    missing.refresh_from_db()
+    assert broken.image_digest is None and missing.image_digest is None
+
+    out = StringIO()
+    call_command('ingest_images', stdout=out)
+    assert 'Resized 0 product images' in out.getvalue() and '2 failed' in out.getvalue()
+
+@pytest.mark.django_db
+def test_pages_serve_resized_images_with_srcset(client, image_server, settings, django_capture_on_commit_callbacks):
+    """
+    Test that saving a product with a new image queues a job resizing it,
+    that catalog and cart pages then use the resized copies with srcset and
+    lazy loading, and that copies are served as immutable.
+    """
+    from products import jobs
+    from products.models import Job
+    product = Product.objects.create(name='Lamp', description='', price=5, image_url='http://example.com/lamp.jpg')
+    response = client.get(reverse('product_list'))
+    assert 'src="http://example.com/lamp.jpg"' in response.content.decode()
+    assert 'srcset' not in response.content.decode()
+
+    settings.PRODUCT_IMAGE_INGEST_ON_SAVE = True
+    product = Product.objects.get(pk=product.pk)
+    product.image_url = image_server('lamp.png')
+    with django_capture_on_commit_callbacks(execute=True):
+        product.save()
+    product.refresh_from_db()
+    assert product.image_digest is None
+    job, = jobs.claim('worker', 10)
+    assert (job.name, job.payload) == ('products.images.ingest_product', {'product_id': product.pk})
+    assert jobs.run(job)
+    product.refresh_from_db()
+    digest = product.image_digest
+    assert digest is not None
+    Product.objects.get(pk=product.pk).save()
+    assert Job.objects.count() == 1
+
+    content = client.get(reverse('product_list')).content.decode()
+    assert f'/media/images/v1/{digest[:2]}/{digest}-400.jpg"' in content
+    assert f'/media/images/v1/{digest[:2]}/{digest}-64.webp 64w, ' in content
+    assert 'type="image/webp"' in content and 'loading="lazy"' in content
+
+    client.post(reverse('add_to_cart', args=[product.pk]))
+    content = client.get(reverse('view_cart')).content.decode()
+    assert f'{digest}-64.jpg"' in content and 'sizes="64px"' in content
+
+    response = client.get(f'/media/images/v1/{digest[:2]}/{digest}-600.webp')
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'image/webp'
+    assert response['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert b''.join(response.streaming_content)[:4] == b'RIFF'
+    assert client.get(f'/media/images/v1/{digest[:2]}/{"0" * 32}-600.webp').status_code == 404
+    assert client.get('/media/../settings.py').status_code == 404
+
+@pytest.mark.django_db
+def test_import_products_resizes_images(tmp_path, image_server):
+    """
+    Test that import_products --images resizes the images of the rows it
+    imported.
+    """
+    source = tmp_path / 'products.csv'
+    source.write_text(
+        'sku,name,description,price,image_url\n'
+        f'A-1,Lamp,,12.50,{image_server("lamp.png")}\n'
+        f'B-2,Chair,,30,{image_server("small.jpg")}\n'
+        'C-3,Table,,40,\n'
+    )
+    stdout, _ = _import(source, '--images', '--image-workers', '1')
+    assert '3 created, 0 updated, 0 rejected, 2 images resized.' in stdout
+    assert Product.objects.exclude(image_hash=None).count() == 2
+
+def _page_markup(content):
+    """
+    Returns page content with whitespace between tags collapsed.
+    """
+    return re.sub(r'>\s+<', '><', content.decode('utf-8')).strip()
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('params', [{}, {'sort': 'price', 'page_size': 3}, {'sort': '-price', 'page_size': 100}])
+def test_streamed_catalog_pages_match_rendered_ones(client, settings, catalog_fixture, params):
+    """
+    Test that a streamed catalog page carries the same markup as a rendered
+    one, sets no cookie, and is cached once it has been sent.
+    """
+    from products.cache import CatalogStream
+    settings.CATALOG_STREAM_CHUNK_SIZE = 2
+    expected = client.get(reverse('product_list'), params)
+    catalog_cache.bump_catalog_version()
+
+    settings.CATALOG_STREAMING = True
+    stream_client = type(client)()
+    response = stream_client.get(reverse('product_list'), params)
+    assert isinstance(response, CatalogStream)
+    assert not response.cookies
+    content = b''.join(response.streaming_content)
+    assert _page_markup(content) == _page_markup(expected.content)
+
+    cached = stream_client.get(reverse('product_list'), params)
+    assert not cached.streaming
+    assert _page_markup(cached.content) == _page_markup(content)
+
+@pytest.mark.django_db
+def test_streamed_catalog_page_walks_and_falls_back(client, settings, catalog_fixture):
+    """
+    Test that next cursors of streamed pages visit the whole catalog, that
+    previous cursors are served rendered, and that an empty catalog streams.
+    """
+    settings.CATALOG_STREAMING = True
+    settings.CATALOG_STREAM_CHUNK_SIZE = 1
+    seen, cursor = [], None
+    while True:
+        response = client.get(reverse('product_list'), {'sort': 'name', 'page_size': 3, **({'cursor': cursor} if cursor else {})})
+        assert response.streaming
+        content = b''.join(response.streaming_content).decode('utf-8')
+        seen.append(content.count('hover:scale-105'))
+        next_links = re.findall(r'href="\?[^"]*cursor=([^"&]+)[^"]*"[^>]*>Next', content)
+        if not next_links:
+            break
+        cursor = next_links[0]
+    assert sum(seen) == len(catalog_fixture)
+    previous = re.findall(r'href="\?[^"]*cursor=([^"&]+)[^"]*"[^>]*>&larr; Previous', content)[0]
+    response = client.get(reverse('product_list'), {'sort': 'name', 'page_size': 3, 'cursor': previous})
+    assert not response.streaming
+    assert len(response.context['products']) == 3
+
+    Product.objects.all().delete()
+    catalog_cache.bump_catalog_version()
+    response = client.get(reverse('product_list'))
+    assert 'No products available yet.' in b''.join(response.streaming_content).decode('utf-8')
+
+@pytest.mark.django_db
+def test_async_catalog_page_streams(asgi_client, settings, catalog_fixture):
+    """
+    Test that the async product list streams the same page it renders, and
+    caches it once sent.
+    """
+    from asgiref.sync import async_to_sync
+    settings.CATALOG_STREAM_CHUNK_SIZE = 2
+    expected = asgi_client.get(reverse('product_list'), {'sort': 'price'}).content
+    catalog_cache.bump_catalog_version()
+    settings.CATALOG_STREAMING = True
+    response = asgi_client.get(reverse('product_list'), {'sort': 'price'})
+    assert response.is_async
+
+    async def read():
+        return b''.join([chunk async for chunk in response.streaming_content])
+    assert _page_markup(async_to_sync(read)()) == _page_markup(expected)
+    assert not asgi_client.get(reverse('product_list'), {'sort': 'price'}).streaming
+
+def _available(product):
+    from products.inventory import stock_levels
+    return stock_levels([product.pk]).get(product.pk)
+
+@pytest.mark.django_db
+def test_cart_reserves_stock_and_refuses_to_oversell(client, multiple_products_fixture, cart_storage_mode):
+    """
+    Test that cart changes reserve and release units of stock-tracked
+    products under every cart storage, refusing what is not in stock, and
+    leave untracked products alone.
+    """
+    from products.inventory import set_stock
+    from products.models import Reservation
+    tracked, untracked = multiple_products_fixture
+    set_stock(tracked.pk, 3)
+    ajax = {'x-requested-with': 'XMLHttpRequest'}
+
+    for _ in range(3):
+        assert client.post(reverse('add_to_cart', args=[tracked.pk]), headers=ajax).status_code == 200
+    response = client.post(reverse('add_to_cart', args=[tracked.pk]), headers=ajax)
+    assert response.status_code == 409
+    assert response.json()['message'] == 'Out of stock'
+    assert client.post(reverse('add_to_cart', args=[tracked.pk])).status_code == 409
+    assert _available(tracked) == 0
+    assert Reservation.objects.get().quantity == 3
+
+    client.post(reverse('add_to_cart', args=[untracked.pk]))
+    assert client.post(reverse('update_cart_quantity', args=[tracked.pk]), {'action': 'decrease'}).json()['new_quantity'] == 2
+    assert _available(tracked) == 1
+    response = post_batch(client, [{'op': 'set', 'product_id': tracked.pk, 'quantity': 5}])
+    assert response.status_code == 409
+    assert response.json()['message'] == 'Only 1 left in stock'
+    assert cart_items(client) == {tracked.pk: 2, untracked.pk: 1}
+
+    client.post(reverse('remove_from_cart', args=[tracked.pk]))
+    assert _available(tracked) == 3
+    assert not Reservation.objects.exists()
+    assert _available(untracked) is None
+
+@pytest.mark.django_db
+def test_failed_cart_batch_releases_its_reservations(client, multiple_products_fixture):
+    """
+    Test that when one operation of a batch runs out of stock, the units the
+    others reserved are given back.
+    """
+    from products.inventory import set_stock
+    product_a, product_b = multiple_products_fixture
+    set_stock(product_a.pk, 10)
+    set_stock(product_b.pk, 1)
+    client.post(reverse('add_to_cart', args=[product_a.pk]))
+    client.post(reverse('add_to_cart', args=[product_b.pk]))
+
+    response = post_batch(client, [
+        {'op': 'set', 'product_id': product_a.pk, 'quantity': 6},
+        {'op': 'increase', 'product_id': product_b.pk},
+    ])
+    assert response.status_code == 409
+    assert response.json()['index'] == 1
+    assert (_available(product_a), _available(product_b)) == (9, 0)
+    assert cart_items(client) == {product_a.pk: 1, product_b.pk: 1}
+
+@pytest.mark.django_db
+def test_stock_tracked_by_another_process_is_reserved(client, multiple_products_fixture, settings, django_assert_num_queries):
+    """
+    Test that a product set_stock() tracked in another process is reserved
+    here once that process has bumped the shared stock version, although
+    this process had already loaded its tracked-product snapshot, and that
+    catalog bumps do not reload the snapshot.
+    """
+    from pathlib import Path
+    from products.inventory import stock_version, tracked_product_ids
+    from products.models import Reservation, Stock
+    product_a, product_b = multiple_products_fixture
+    client.post(reverse('add_to_cart', args=[product_a.pk]))
+    assert not Reservation.objects.exists()
+    catalog_cache.bump_catalog_version()
+    with django_assert_num_queries(0):
+        assert not tracked_product_ids.contains(product_a.pk)
+
+    # What set_stock() leaves behind in another process: the Stock row and,
+    # once it commits, a newer stock version.
+    Stock.objects.create(product=product_b, shard=0, quantity=5)
+    Path(settings.STOCK_VERSION_PATH).write_text(str(stock_version() + 1))
+    client.post(reverse('add_to_cart', args=[product_b.pk]))
+    assert Reservation.objects.get().product_id == product_b.pk
+    assert _available(product_b) == 4
+
+@pytest.mark.django_db
+def test_expired_reservations_return_to_stock(client, product_fixture):
+    """
+    Test that the sweeper returns expired reservations to stock, and that
+    the cart page reserves its lines again while it can and flags them once
+    someone else took the units.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from products.inventory import reserve, set_stock
+    from products.maintenance import RateLimiter, expire_reservations
+    from products.models import Reservation
+
+    def expire_all():
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        return expire_reservations(batch_size=1, limiter=RateLimiter(0))
+
+    set_stock(product_fixture.pk, 3)
+    client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+    client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+    reserve('session:other', product_fixture.pk, 1)
+    assert expire_all() == 2
+    assert _available(product_fixture) == 3
+    assert not Reservation.objects.exists()
+
+    response = client.get(reverse('view_cart'))
+    assert response.context['cart_items'][0].available is None
+    assert Reservation.objects.get().quantity == 2
+    assert Reservation.objects.get().expires_at > timezone.now()
+
+    assert expire_all() == 1
+    reserve('session:other', product_fixture.pk, 2)
+    response = client.get(reverse('view_cart'))
+    assert response.context['cart_items'][0].available == 1
+    assert 'Only 1 left' in response.content.decode('utf-8')
+
+@pytest.mark.django_db
+def test_sharded_stock_reserves_across_shards(product_fixture):
+    """
+    Test that stock spread over shards is fully reservable, taking from
+    several shards when no single one holds enough, and never oversold.
+    """
+    from io import StringIO
+    from django.core.management import call_command
+    from products.cart import OutOfStock
+    from products.inventory import release, reserve
+    from products.models import Stock
+    out = StringIO()
+    call_command('set_stock', str(product_fixture.pk), '5', shards=3, stdout=out)
+    assert out.getvalue() == f'Product {product_fixture.pk}: 5 units available\n'
+    assert sorted(Stock.objects.values_list('quantity', flat=True)) == [1, 2, 2]
+
+    reserve('session:a', product_fixture.pk, 4)
+    with pytest.raises(OutOfStock) as error:
+        reserve('session:b', product_fixture.pk, 2)
+    assert error.value.available == 1
+    reserve('session:b', product_fixture.pk, 1)
+    assert _available(product_fixture) == 0
+    assert release('session:a', product_fixture.pk, 10) == 4
+    assert _available(product_fixture) == 4
+
+    call_command('set_stock', str(product_fixture.pk), 'none', stdout=out)
+    assert _available(product_fixture) is None
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('shards', [1, 4])
+def test_concurrent_reservations_never_oversell(product_fixture, shards):
+    """
+    Stress test: many threads reserving one hot product at once take
+    exactly its stock, never more.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from django.db import connections
+    from products.cart import OutOfStock
+    from products.inventory import reserve, set_stock
+    from products.models import Reservation
+    set_stock(product_fixture.pk, 25, shards=shards)
+
+    def buyer(index):
+        reserved = 0
+        try:
+            for _ in range(5):
+                reserve(f'session:{index}', product_fixture.pk, 1)
+                reserved += 1
+        except OutOfStock:
+            pass
+        finally:
+            connections.close_all()
+        return reserved
+
+    with ThreadPoolExecutor(8) as pool:
+        reserved = sum(pool.map(buyer, range(16)))
+    assert reserved == 25
+    assert _available(product_fixture) == 0
+    assert sum(Reservation.objects.values_list('quantity', flat=True)) == 25
+
+def _checkout(client, key, **data):
+    return client.post(reverse('checkout'), {'idempotency_key': key, **data})
+
+@pytest.mark.django_db
+def test_checkout_places_one_order_per_idempotency_key(client, multiple_products_fixture, cart_storage_mode):
+    """
+    Test that checkout turns the cart into an order with its lines, empties
+    the cart and queues the order's jobs, and that repeating it with the
+    same key returns that order without placing another.
+    """
+    from django.test import Client
+    from products.models import Job, Order
+    product_a, product_b = multiple_products_fixture
+    assert _checkout(client, 'empty-cart').status_code == 400
+    client.post(reverse('add_to_cart', args=[product_a.pk]))
+    client.post(reverse('add_to_cart', args=[product_a.pk]))
+    client.post(reverse('add_to_cart', args=[product_b.pk]))
+    assert client.post(reverse('checkout')).status_code == 400
+    assert 'name="idempotency_key"' in client.get(reverse('view_cart')).content.decode('utf-8')
+
+    response = _checkout(client, 'key-1', email='buyer@example.com')
+    order = Order.objects.get()
+    assert response.status_code == 302
+    assert response.url == reverse('order_detail', args=[order.number])
+    assert (order.item_count, order.total, order.status) == (3, product_a.price * 2 + product_b.price, Order.PLACED)
+    assert sorted(order.lines.values_list('name', 'quantity')) == sorted([(product_a.name, 2), (product_b.name, 1)])
+    assert cart_items(client) == {}
+    assert sorted(Job.objects.values_list('name', flat=True)) == [
+        'products.orders.finalize_order', 'products.orders.send_confirmation',
+    ]
+
+    response = client.post(reverse('checkout'), headers={'Idempotency-Key': 'key-1'})
+    assert response.status_code == 200
+    assert response.json()['order'] == str(order.number)
+    assert Order.objects.count() == 1 and Job.objects.count() == 2
+    response = Client().post(reverse('checkout'), headers={'Idempotency-Key': 'key-1'})
+    assert response.status_code == 422
+
+    assert client.get(reverse('order_detail', args=[order.number])).status_code == 200
+    assert Client().get(reverse('order_detail', args=[order.number])).status_code == 404
+
+@pytest.mark.django_db
+def test_order_jobs_settle_stock_and_send_confirmation(client, product_fixture, settings):
+    """
+    Test that checked-out reservations outlive their expiry, and that the
+    queued jobs settle them, confirm the order and email it once.
+    """
+    import threading
+    from datetime import timedelta
+    from django.core import mail
+    from django.utils import timezone
+    from products import jobs
+    from products.inventory import set_stock
+    from products.maintenance import collect_garbage
+    from products.models import Job, Order, Reservation
+    set_stock(product_fixture.pk, 5)
+    client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+    client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+    response = client.post(reverse('checkout'), {'email': 'buyer@example.com'}, headers={'Idempotency-Key': 'abc'})
+    assert response.status_code == 201
+    order = Order.objects.get()
+    assert Reservation.objects.get().order == order
+
+    Reservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+    assert collect_garbage()['reservations'] == 0
+    assert _available(product_fixture) == 3
+
+    jobs.work(threading.Event(), drain=True)
+    order.refresh_from_db()
+    assert order.status == Order.CONFIRMED and order.emailed_at is not None
+    assert not Reservation.objects.exists()
+    assert _available(product_fixture) == 3
+    assert len(mail.outbox) == 1
+    assert str(order.number) in mail.outbox[0].subject
+    assert f'2 x {product_fixture.name}' in mail.outbox[0].body
+    assert set(Job.objects.values_list('status', flat=True)) == {Job.DONE}
+    assert 'being confirmed' not in client.get(response.json()['url']).content.decode('utf-8')
+
+    Job.objects.update(finished_at=timezone.now() - timedelta(hours=settings.JOB_RETENTION_HOURS + 1))
+    assert collect_garbage()['jobs'] == 2
+    assert not Job.objects.exists()
+
+def failing_job(**payload):
+    raise ValueError('boom')
+
+@pytest.mark.django_db
+def test_failed_jobs_back_off_and_expired_leases_are_reclaimed(settings):
+    """
+    Test that a failing job is retried with doubling backoff until
+    JOB_MAX_ATTEMPTS and then kept as failed, that a job whose worker
+    stopped renewing its lease is claimed again, and that /metrics reports
+    the backlog.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from products import jobs
+    from products.metrics import metrics
+    from products.models import Job
+    settings.JOB_MAX_ATTEMPTS = 3
+    settings.JOB_RETRY_BACKOFF = 10
+    job = jobs.enqueue('products.tests.failing_job', order_id=1)
+
+    for attempt, backoff in ((1, 10), (2, 20)):
+        claimed, = jobs.claim('worker-a', 10)
+        assert not jobs.run(claimed)
+        job.refresh_from_db()
+        assert (job.status, job.attempts, job.last_error) == (Job.PENDING, attempt, 'ValueError: boom')
+        assert job.run_after - timezone.now() == pytest.approx(timedelta(seconds=backoff), abs=timedelta(seconds=2))
+        assert jobs.claim('worker-a', 10) == []
+        Job.objects.update(run_after=timezone.now())
+    claimed, = jobs.claim('worker-a', 10)
+    assert not jobs.run(claimed)
+    job.refresh_from_db()
+    assert (job.status, job.attempts) == (Job.FAILED, 3)
+
+    stuck = jobs.enqueue('products.orders.finalize_order', order_id=0)
+    assert [job.pk for job in jobs.claim('worker-a', 10)] == [stuck.pk]
+    assert jobs.claim('worker-b', 10) == []
+    Job.objects.filter(pk=stuck.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+    reclaimed, = jobs.claim('worker-b', 10)
+    assert (reclaimed.locked_by, reclaimed.attempts) == ('worker-b', 2)
+    assert jobs.run(reclaimed)
+    stale = Job.objects.get(pk=stuck.pk)
+    stale.locked_by = 'worker-a'
+    jobs._finish(stale, status=Job.FAILED)
+    assert Job.objects.get(pk=stuck.pk).status == Job.DONE
+
+    jobs.enqueue('products.orders.finalize_order', order_id=0)
+    body = metrics.prometheus(job_stats=jobs.backlog())
+    assert 'ecom_jobs{status="pending"} 1' in body
+    assert 'ecom_jobs{status="failed"} 1' in body
+    assert 'ecom_jobs_throughput 0.016667' in body
+
+@pytest.mark.django_db(transaction=True)
+def test_run_jobs_command_drains_the_queue():
+    """
+    Test that run_jobs --drain runs every due job and reports how many.
+    """
+    from io import StringIO
+    from django.core.management import call_command
+    from products import jobs
+    from products.models import Job
+    for _ in range(3):
+        jobs.enqueue('products.orders.finalize_order', order_id=0)
+    out = StringIO()
+    call_command('run_jobs', workers=1, drain=True, report=0, stdout=out)
+    assert out.getvalue().startswith('Ran 3 jobs in ')
+    assert set(Job.objects.values_list('status', flat=True)) == {Job.DONE}
+
+@pytest.mark.django_db
+def test_async_checkout_places_order(asgi_client, product_fixture):
+    """
+    Test that the async checkout view places and replays orders like the
+    sync one.
+    """
+    from products.models import Order
+    asgi_client.post(reverse('add_to_cart', args=[product_fixture.pk]))
+    response = asgi_client.post(reverse('checkout'), headers={'Idempotency-Key': 'async-key'})
+    assert response.status_code == 201
+    assert asgi_client.post(reverse('checkout'), headers={'Idempotency-Key': 'async-key'}).status_code == 200
+    order = Order.objects.get()
+    assert response.json()['total_price'] == float(product_fixture.price)
+    response = asgi_client.get(response.json()['url'])
+    assert response.status_code == 200
+    assert product_fixture.name in response.content.decode('utf-8')
+    assert order.lines.get().quantity == 1
+
+@pytest.mark.django_db
+def test_product_api_pages_through_sparse_fields(client, catalog_fixture, django_assert_num_queries, monkeypatch):
+    """
+    Test that /api/products/ walks the catalog with cursors, sending only
+    the fields asked for, in one query per page and without instantiating
+    products, and that it answers with ETags, gzip and 400s.
+    """
+    from products.models import Product
+    monkeypatch.setattr(Product, 'from_db', classmethod(lambda *args: pytest.fail('Product instantiated')))
+    url = reverse('product_api')
+    params = {'sort': 'price', 'page_size': 3, 'fields': 'id,price'}
+    pages, cursor = [], None
+    while True:
+        with django_assert_num_queries(1):
+            response = client.get(url, {**params, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/json'
+        data = response.json()
+        assert all(set(row) == {'id', 'price'} for row in data['results'])
+        pages.append([(row['price'], row['id']) for row in data['results']])
+        cursor = data['next']
+        if cursor is None:
+            break
+    expected = [(f'{p.price:.2f}', p.pk) for p in sorted(catalog_fixture, key=lambda p: (p.price, p.pk))]
+    assert sum(pages, []) == expected
+    previous = client.get(url, {**params, 'cursor': data['previous']}).json()['results']
+    assert [(row['price'], row['id']) for row in previous] == pages[-2]
+
+    first = client.get(url)
+    assert [row['name'] for row in first.json()['results']] == sorted(p.name for p in catalog_fixture)
+    assert set(first.json()['results'][0]) == {'id', 'sku', 'name', 'price', 'image_url'}
+    with django_assert_num_queries(0):
+        assert client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code == 304
+    compressed = client.get(url, {'page_size': 100}, HTTP_ACCEPT_ENCODING='gzip')
+    assert compressed['Content-Encoding'] == 'gzip'
+    assert client.get(url, {'page_size': 100}, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=compressed['ETag']).status_code == 304
+
+    assert client.get(url, {'fields': 'id,password'}).status_code == 400
+    assert client.get(url, {'cursor': 'garbage'}).json()['status'] == 'error'
+    assert client.get(url, {'sort': 'random'}).status_code == 400
+    assert client.post(url).status_code == 405
+
+@pytest.mark.django_db
+def test_product_api_fetches_ids_in_one_query(client, multiple_products_fixture, django_assert_num_queries, settings):
+    """
+    Test that ?ids= returns the products asked for, in order, skipping
+    missing ones, from one query, and refuses more than API_MAX_PAGE_SIZE.
+    """
+    product_a, product_b = multiple_products_fixture
+    url = reverse('product_api')
+    with django_assert_num_queries(1):
+        response = client.get(url, {'ids': f'{product_b.pk},999999,{product_a.pk},{product_b.pk}', 'fields': 'name,updated_at'})
+    results = response.json()['results']
+    assert [row['name'] for row in results] == [product_b.name, product_a.name]
+    assert results[0]['updated_at'] == product_b.updated_at.isoformat()
+    assert 'next' not in response.json()
+
+    settings.API_MAX_PAGE_SIZE = 1
+    assert client.get(url, {'ids': f'{product_a.pk},{product_b.pk}'}).status_code == 400
+    assert client.get(url, {'ids': 'one,two'}).status_code == 400
+
+@pytest.mark.django_db
+def test_async_product_api_matches_sync(client, asgi_client, catalog_fixture):
+    """
+    Test that the async API view serves the same bodies as the sync one.
+    """
+    from django.test import RequestFactory
+    from products.views import product_api
+    for params in [{'sort': '-price', 'page_size': 2, 'fields': 'id,name,description'}, {'ids': '3,1'}]:
+        response = asgi_client.get(reverse('product_api'), params)
+        assert response.status_code == 200
+        assert response.content == product_api(RequestFactory().get(reverse('product_api'), params)).content
@@ -3,9 +3,17 @@ from . import views
 
 urlpatterns = [
     path('', views.product_list, name='product_list'),
+    path('search/', views.search, name='search'),
     path('product/<int:pk>/', views.product_detail, name='product_detail'),
     path('add_to_cart/<int:pk>/', views.add_to_cart, name='add_to_cart'),
     path('update_cart_quantity/<int:product_id>/', views.update_cart_quantity, name='update_cart_quantity'),
     path('remove_from_cart/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('cart/', views.view_cart, name='view_cart'),
+    path('cart/batch/', views.cart_batch, name='cart_batch'),
+    path('cart/checkout/', views.checkout, name='checkout'),
+    path('orders/<uuid:number>/', views.order_detail, name='order_detail'),
+    path('api/products/', views.product_api, name='product_api'),
+    path('csrf/', views.csrf_token, name='csrf_token'),
+    path('metrics', views.metrics, name='metrics'),
+    path('media/<path:name>', views.product_image, name='product_image'),
 ]
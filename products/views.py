@@ -1,139 +1,433 @@
+import json
+import uuid
+
+from django.conf import settings
+from django.db.models.functions import Substr
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Product, CartItem 
-from django.http import JsonResponse
+from .models import Product, CartItem, Order
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
+from django.middleware.csrf import get_token
+from django.template import Engine
+from django.template.loader import render_to_string
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from django.utils.safestring import mark_safe
+from django.views.decorators.cache import never_cache
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_safe
 from .models import Product
+from .bulk import batched
+from .cache import CatalogStream, cache_catalog_page, conditional_catalog_page, get_or_set_catalog_value, stats
+from .metrics import metrics as request_metrics
+from . import images, jobs
+from .api import InvalidQuery, ProductQuery
+from .cart import CART_OPERATIONS, CartError, OutOfStock, add_product, apply_operation, get_cart, undo_holds
+from .inventory import hold_cart, holder
+from .orders import IDEMPOTENCY_KEY_MAX_LENGTH, place_order
+from .pagination import InvalidCursor, KeysetPaginator, get_page_size
+from .search import search_product_ids
+from .templatetags.catalog_cache import render_cards
+
+# Rendered by product_list.html in place of the cards and of the pagination
+# of a streamed page.
+STREAM_BREAK = mark_safe('<!--catalog-stream-->')
+
+
+def _grid_products():
+    """
+    Returns products with only the columns the product grid renders; the
+    description is truncated by the database rather than in the template.
+    """
+    return Product.objects.only('id', 'name', 'price', 'image_url', 'image_hash', 'image_source_url').annotate(
+        short_description=Substr('description', 1, settings.CATALOG_DESCRIPTION_CHARS)
+    )
 
+def _catalog_shell(request, context):
+    """
+    Renders product_list.html for a streamed page, returning its markup
+    before the cards, between the cards and the pagination, and after it.
+    """
+    return render_to_string('products/product_list.html', {**context, 'stream_break': STREAM_BREAK}, request).split(STREAM_BREAK)
+
+def _stream_product_list(request, stream, context):
+    """
+    Yields a catalog page: the shell at once, then the cards as each chunk
+    of products arrives from the database, then the pagination.
+    """
+    head, middle, tail = _catalog_shell(request, context)
+    yield head
+    engine = Engine.get_default()
+    empty = True
+    for products in batched(stream, stream.chunk_size):
+        empty = False
+        yield render_cards(products, engine)
+    if empty:
+        yield render_to_string('products/_catalog_empty.html')
+    yield middle
+    yield render_to_string('products/_catalog_pagination.html', {'page': stream.page}, request)
+    yield tail
+
+@conditional_catalog_page()
+@cache_catalog_page
 def product_list(request):
     """
-    Displays a list of all available products.
+    Displays one keyset-paginated page of the catalog. With
+    CATALOG_STREAMING, forward pages are streamed as they render.
     """
-    products = Product.objects.all()
-    return render(request, 'products/product_list.html', {'products': products})
+    paginator = KeysetPaginator(
+        _grid_products(),
+        ordering=request.GET.get('sort'),
+        page_size=get_page_size(request.GET.get('page_size')),
+    )
+    cursor = request.GET.get('cursor')
+    context = {'sort': paginator.ordering}
+    try:
+        if settings.CATALOG_STREAMING:
+            stream = paginator.stream(cursor, chunk_size=settings.CATALOG_STREAM_CHUNK_SIZE)
+            if stream is not None:
+                return CatalogStream(request, _stream_product_list(request, stream, context))
+        page = paginator.page(cursor)
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor')
+    return TemplateResponse(request, 'products/product_list.html', {
+        **context,
+        'products': page.items,
+        'page': page,
+    })
 
+def _api_error(message):
+    return JsonResponse({'status': 'error', 'message': message}, status=400)
+
+@require_safe
+@gzip_page
+@conditional_catalog_page()
+def product_api(request):
+    """
+    Serves a page of the catalog, or the products listed in ?ids=, as JSON;
+    see products.api. Bodies are cached like catalog pages.
+    """
+    try:
+        query = ProductQuery.parse(request.GET)
+        body = get_or_set_catalog_value('api', [request.get_full_path()], query.body)
+    except (InvalidQuery, InvalidCursor) as e:
+        return _api_error(str(e))
+    return HttpResponse(body, content_type='application/json')
+
+def _product_last_modified(request, pk):
+    return get_or_set_catalog_value(
+        'updated_at', [pk],
+        lambda: Product.objects.filter(pk=pk).values_list('updated_at', flat=True).first(),
+    )
+
+@conditional_catalog_page(_product_last_modified)
+@cache_catalog_page
 def product_detail(request, pk):
     """
     Displays the details of a single product.
     """
     product = get_object_or_404(Product, pk=pk)
-    return render(request, 'products/product_detail.html', {'product': product})
+    return TemplateResponse(request, 'products/product_detail.html', {'product': product})
+
+@conditional_catalog_page()
+@cache_catalog_page
+def search(request):
+    """
+    Displays products matching the q parameter, best matches first, one
+    numbered page at a time.
+    """
+    query = request.GET.get('q', '').strip()
+    page_size = get_page_size(request.GET.get('page_size'))
+    try:
+        page_number = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page_number = 1
+    # One extra id tells whether there is a next page without counting matches.
+    ids = search_product_ids(query, page_size + 1, (page_number - 1) * page_size) if query else []
+    products = _grid_products().in_bulk(ids[:page_size])
+    return TemplateResponse(request, 'products/search.html', {
+        'query': query,
+        'products': [products[pk] for pk in ids[:page_size] if pk in products],
+        'page_number': page_number,
+        'has_previous': page_number > 1,
+        'has_next': len(ids) > page_size,
+    })
 
+
+@never_cache
 def add_to_cart(request, pk):
     """
     Adds a specified product to the user's session-based shopping cart.
     If the product is already in the cart, its quantity is increased.
     """
-    product = get_object_or_404(Product, pk=pk)
-    cart = request.session.get('cart', {}) 
-    product_id_str = str(product.id) 
-
-    if product_id_str in cart:
-        cart[product_id_str]['quantity'] += 1
-    else:
-        cart[product_id_str] = {
-            'name': product.name,
-            'price': str(product.price), 
-            'quantity': 1,
-            'image_url': product.image_url,
-        }
-
-    request.session['cart'] = cart 
-    request.session.modified = True 
+    cart = get_cart(request)
+    try:
+        _, name = add_product(cart, pk)
+    except Product.DoesNotExist:
+        raise Http404('No Product matches the given query.')
+    except OutOfStock as e:
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=e.status_code)
+        return HttpResponse(str(e), status=e.status_code, content_type='text/plain; charset=utf-8')
+    cart.save()
 
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        return JsonResponse({'status': 'success', 'message': f'{product.name} added to cart!'})
+        if name is None:
+            # Already in the cart, so add_product() did not read it.
+            name = Product.objects.values_list('name', flat=True).get(pk=pk)
+        return JsonResponse({'status': 'success', 'message': f'{name} added to cart!', **cart.totals.as_json()})
     else:
         return redirect('view_cart')
 
+@never_cache
 def view_cart(request):
     """
     Displays the contents of the user's session-based shopping cart.
-    Calculates the total price of items in the cart.
+    Product details are resolved from the catalog in one query; the total
+    comes from the cart's running totals. Reservations of stock-tracked
+    lines are renewed, and lines short of stock are flagged.
+    """
+    cart = get_cart(request)
+    cart_items = cart.lines()
+    short = hold_cart(cart)
+    for line in cart_items:
+        line.available = short.get(line.product_id)
+    return render(request, 'products/cart.html', {
+        'cart_items': cart_items,
+        'totals': cart.totals,
+        'total_price': cart.totals.total_price,
+        **_checkout_form(request),
+    })
+
+def _checkout_form(request):
+    # A fresh idempotency key each time the cart page is rendered.
+    user = getattr(request, 'user', None)
+    return {
+        'idempotency_key': uuid.uuid4().hex,
+        'email': user.email if user is not None and user.is_authenticated else '',
+    }
+
+def _checkout_params(request):
+    """
+    Reads a checkout's idempotency key, from the Idempotency-Key header or
+    the form, and email. Returns (key, email, error message).
+    """
+    key = request.headers.get('Idempotency-Key') or request.POST.get('idempotency_key', '')
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return None, None, f'An idempotency key of at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters is required'
+    email = request.POST.get('email', '').strip()
+    user = getattr(request, 'user', None)
+    if not email and user is not None and user.is_authenticated:
+        email = user.email
+    if len(email) > Order._meta.get_field('email').max_length:
+        return None, None, 'Invalid email'
+    return key, email, None
+
+def _place_order(request, key, email):
+    user = getattr(request, 'user', None)
+    return place_order(
+        get_cart(request), key, email=email, user=user if user is not None and user.is_authenticated else None,
+    )
+
+def _wants_json(request):
+    # API clients identify themselves with the Idempotency-Key header.
+    return request.headers.get('x-requested-with') == 'XMLHttpRequest' or 'Idempotency-Key' in request.headers
+
+def _checkout_error(request, message, status):
+    if _wants_json(request):
+        return JsonResponse({'status': 'error', 'message': message}, status=status)
+    return HttpResponse(message, status=status, content_type='text/plain; charset=utf-8')
+
+def _checkout_response(request, order, created):
+    url = reverse('order_detail', args=[order.number])
+    if _wants_json(request):
+        return JsonResponse({
+            'status': 'success',
+            'order': str(order.number),
+            'total_price': float(order.total),
+            'url': url,
+        }, status=201 if created else 200)
+    return redirect(url)
+
+@never_cache
+def checkout(request):
     """
-    cart = request.session.get('cart', {})
-    cart_items = []
-    total_price = 0
+    Places an order for the cart and redirects to it, or with an
+    Idempotency-Key header or AJAX answers with JSON (201 when the order was
+    placed, 200 when the key had already placed it). Settling the stock and
+    emailing the receipt are left to jobs (see products.orders).
+    """
+    if not request.method == 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
 
-    for product_id, item_data in cart.items():
-        item_price = float(item_data['price']) * item_data['quantity']
-        total_price += item_price
-        cart_items.append({
-            'product_id': product_id,
-            'name': item_data['name'],
-            'price': float(item_data['price']),
-            'quantity': item_data['quantity'],
-            'image_url': item_data.get('image_url', ''),
-            'subtotal': item_price,
-        })
+    key, email, error = _checkout_params(request)
+    if error:
+        return _checkout_error(request, error, 400)
+    try:
+        order, created = _place_order(request, key, email)
+    except CartError as e:
+        return _checkout_error(request, str(e), e.status_code)
+    return _checkout_response(request, order, created)
 
-    return render(request, 'products/cart.html', {'cart_items': cart_items, 'total_price': total_price})
+def _order_context(request, order):
+    # Only the cart's owner, or staff, may see an order.
+    if order.holder != holder(request) and not getattr(getattr(request, 'user', None), 'is_staff', False):
+        raise Http404('No Order matches the given query.')
+    return {'order': order, 'lines': list(order.lines.all())}
+
+@never_cache
+def order_detail(request, number):
+    """
+    Shows a placed order to the customer who placed it.
+    """
+    order = get_object_or_404(Order, number=number)
+    return render(request, 'products/order.html', _order_context(request, order))
 
 
 
+@never_cache
 def update_cart_quantity(request, product_id):
     """Handle quantity updates via AJAX"""
     if not request.method == 'POST':
         return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
 
-    product = get_object_or_404(Product, pk=product_id)
-    cart = request.session.get('cart', {})
-    product_id_str = str(product_id)
-    
-    if product_id_str not in cart:
-        return JsonResponse({'status': 'error', 'message': 'Product not in cart'}, status=404)
-
     action = request.POST.get('action')
-    
-    if action == 'increase':
-        cart[product_id_str]['quantity'] += 1
-    elif action == 'decrease':
-        if cart[product_id_str]['quantity'] > 1:
-            cart[product_id_str]['quantity'] -= 1
-        else:
-            del cart[product_id_str]
-            request.session['cart'] = cart
-            request.session.modified = True
-            return JsonResponse({
-                'status': 'success',
-                'new_quantity': 0,
-                'total_price': sum(float(item['price']) * item['quantity'] for item in cart.values())
-            })
-    else:
+    if action not in ('increase', 'decrease'):
         return JsonResponse({'status': 'error', 'message': 'Invalid action'}, status=400)
 
-    request.session['cart'] = cart
-    request.session.modified = True
-    
-    new_quantity = cart[product_id_str]['quantity']
-    new_subtotal = float(cart[product_id_str]['price']) * new_quantity
-    total_price = sum(float(item['price']) * item['quantity'] for item in cart.values())
-    
-    return JsonResponse({
-        'status': 'success',
-        'new_quantity': new_quantity,
-        'new_subtotal': new_subtotal,
-        'total_price': total_price
-    })
+    cart = get_cart(request)
+    try:
+        new_quantity = apply_operation(cart, action, product_id)
+    except CartError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=e.status_code)
+    cart.save()
 
+    response = {'status': 'success', 'new_quantity': new_quantity, **cart.totals.as_json()}
+    if new_quantity:
+        response['new_subtotal'] = float(cart.line_subtotal(product_id))
+    return JsonResponse(response)
+
+@never_cache
 def remove_from_cart(request, product_id):
     """Handle item removal via AJAX"""
     if not request.method == 'POST':
         return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
 
-    cart = request.session.get('cart', {})
-    product_id_str = str(product_id)
+    cart = get_cart(request)
+    try:
+        apply_operation(cart, 'remove', product_id)
+    except CartError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=e.status_code)
+    cart.save()
     
-    if product_id_str not in cart:
-        return JsonResponse({'status': 'error', 'message': 'Product not in cart'}, status=404)
+    return JsonResponse({'status': 'success', **cart.totals.as_json()})
 
-    # Remove the item from cart
-    del cart[product_id_str]
-    request.session['cart'] = cart
-    request.session.modified = True
-    
-    # Calculate new total
-    total_price = sum(float(item['price']) * item['quantity'] for item in cart.values())
-    
-    return JsonResponse({
-        'status': 'success',
-        'total_price': total_price
-    })
\ No newline at end of file
+def _parse_batch(body):
+    """
+    Validates a batch of cart operations, returning (operations, error message).
+    """
+    try:
+        operations = json.loads(body)
+    except ValueError:
+        return None, 'Invalid JSON'
+    if not isinstance(operations, list) or not operations:
+        return None, 'Expected a non-empty list of operations'
+    if len(operations) > settings.CART_BATCH_MAX_OPERATIONS:
+        return None, f'At most {settings.CART_BATCH_MAX_OPERATIONS} operations per batch'
+
+    parsed = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS:
+            return None, f'Operation {index}: op must be one of {", ".join(CART_OPERATIONS)}'
+        product_id = operation.get('product_id')
+        quantity = operation.get('quantity', 1)
+        if type(product_id) is not int or type(quantity) is not int:
+            return None, f'Operation {index}: product_id and quantity must be integers'
+        if quantity < 0 or (quantity == 0 and operation['op'] in ('increase', 'decrease')):
+            return None, f'Operation {index}: invalid quantity'
+        if quantity > settings.CART_BATCH_MAX_QUANTITY:
+            return None, f'Operation {index}: at most {settings.CART_BATCH_MAX_QUANTITY} units per operation'
+        parsed.append((operation['op'], product_id, quantity))
+    return parsed, None
+
+@never_cache
+def cart_batch(request):
+    """
+    Applies a JSON list of cart operations in one request, e.g.
+    [{"op": "increase", "product_id": 3, "quantity": 2}, {"op": "remove", "product_id": 5}].
+
+    The batch is all-or-nothing: if any operation fails, none are kept and
+    the stock reserved by the others is released. The cart is then only
+    written if loading it repriced or migrated it.
+    """
+    if not request.method == 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
+
+    operations, error = _parse_batch(request.body)
+    if error:
+        return JsonResponse({'status': 'error', 'message': error}, status=400)
+
+    cart = get_cart(request)
+    # Loading may already have marked the cart to be saved (repriced or
+    # migrated), so a failed batch goes back to this state rather than just
+    # skipping cart.save().
+    checkpoint = cart.checkpoint()
+    results = []
+    for index, (op, product_id, quantity) in enumerate(operations):
+        try:
+            new_quantity = apply_operation(cart, op, product_id, quantity)
+        except CartError as e:
+            undo_holds(cart)
+            cart.rollback(checkpoint)
+            return JsonResponse({'status': 'error', 'message': str(e), 'index': index}, status=e.status_code)
+        results.append({'product_id': product_id, 'new_quantity': new_quantity})
+
+    cart.save()
+
+    for result in results:
+        if result['product_id'] in cart:
+            result['new_subtotal'] = float(cart.line_subtotal(result['product_id']))
+    return JsonResponse({'status': 'success', 'results': results, **cart.totals.as_json()})
+
+@never_cache
+def csrf_token(request):
+    """
+    Returns a CSRF token for the forms of catalog pages, which are shared
+    between visitors and so carry none, and sets the csrftoken cookie.
+    """
+    return JsonResponse({'token': get_token(request)})
+
+@never_cache
+def metrics(request):
+    """
+    Serves this process's request metrics and catalog cache counters, and
+    the job queue's backlog, in the Prometheus text format, to staff users
+    or with the METRICS_TOKEN bearer token.
+    """
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    # Storefront workers have no request.user, only the token.
+    is_staff = getattr(getattr(request, 'user', None), 'is_staff', False)
+    if not (settings.METRICS_TOKEN and constant_time_compare(token, settings.METRICS_TOKEN)) and not is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        request_metrics.prometheus(stats.snapshot(), jobs.backlog()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+def product_image(request, name):
+    """
+    Serves a resized product image from the default storage. Its name
+    changes with its content, so clients may keep it for a year without
+    revalidating. In production, have the web server serve MEDIA_ROOT/images/
+    with the same Cache-Control instead.
+    """
+    if not images.VARIANT_NAME.fullmatch(name):
+        raise Http404
+    try:
+        image = default_storage.open(name)
+    except FileNotFoundError:
+        raise Http404
+    response = FileResponse(image, content_type=images.content_type(name))
+    response['Cache-Control'] = f'public, max-age={images.ONE_YEAR}, immutable'
+    return response